@@ -1,20 +1,40 @@
-from langgraph.graph import StateGraph, END
-from typing import TypedDict, List, Optional, Dict, Any
-from langchain.prompts import ChatPromptTemplate, MessagesPlaceholder
-from langchain.agents import AgentExecutor, create_tool_calling_agent
-from langchain_openai import ChatOpenAI
+from typing import TypedDict, List, Optional, Dict, Any, Callable, Awaitable, Iterator, AsyncIterator
+import functools
+import inspect
+import logging
+import queue
+import threading
+import time
+import uuid
 import os
-from dotenv import load_dotenv
-load_dotenv()
-from langchain.tools import tool
-from langchain_core.messages import HumanMessage, AIMessage
-from ollama import chat
-from kg_drafter import integrate_with_intake_script
-
-@tool
-def thesis_generator(conversation_summary: str) -> str:
-    """Generate a clinical thesis from the full patient conversation using MedGemma via Ollama."""
-    messages = [
+from kg_drafter import integrate_with_intake_script, aintegrate_with_intake_script, IncrementalCaseExtractor
+from kg_resources import get_registry, load_environment, shutdown_registry
+from kg_metrics import span, timed, record_llm_call, llm_callback_handler, write_prometheus
+from session_store import SessionCheckpoint, completed_retention, default_session_store
+from model_router import default_model_router
+
+# LangChain, LangGraph and Ollama are imported inside the factories and nodes that
+# use them, and the LLM, agent and graph are built on first use (see get_workflow),
+# so importing this module has no side effects and stays cheap.
+
+THESIS_MODEL = "alibayram/medgemma:latest"
+
+def load_settings():
+    """Read the INTAKE_* settings from the environment (main() re-reads them after loading .env)"""
+    global STREAM_OUTPUT, SPECULATIVE_KG, SPECULATIVE_BATCH_TURNS
+    
+    # Print assistant replies and the clinical analysis token by token as they are generated
+    STREAM_OUTPUT = os.getenv("INTAKE_STREAM", "0") == "1"
+    
+    # Extract KG entities in the background while the conversation runs, every N patient turns
+    SPECULATIVE_KG = os.getenv("INTAKE_SPECULATIVE_KG", "0") == "1"
+    SPECULATIVE_BATCH_TURNS = int(os.getenv("INTAKE_SPECULATIVE_BATCH_TURNS", "2"))
+
+load_settings()
+
+def _thesis_messages(conversation_summary: str) -> List[Dict[str, str]]:
+    """Build the MedGemma prompt for a conversation summary"""
+    return [
         {
             "role": "system", 
             "content": """You are a medical expert. Analyze this patient conversation and generate:
@@ -27,8 +47,64 @@ def thesis_generator(conversation_summary: str) -> str:
             "content": f"Patient conversation:\n{conversation_summary}"
         },
     ]
+
+def _record_thesis_call(messages: List[Dict[str, str]], content: str, response=None):
+    """Count a MedGemma call in kg_metrics; Ollama reports token counts on the final response/chunk"""
+    record_llm_call(THESIS_MODEL, "thesis",
+                    sum(len(m["content"].encode()) for m in messages), len(content.encode()),
+                    getattr(response, "prompt_eval_count", None), getattr(response, "eval_count", None))
+
+def stream_thesis(conversation_summary: str) -> Iterator[str]:
+    """Yield the MedGemma clinical analysis as tokens arrive"""
+    messages = _thesis_messages(conversation_summary)
+    tokens = []
+    chunk = None
+    with span("llm.thesis"):
+        for chunk in get_registry().ollama_client().chat(model=THESIS_MODEL, messages=messages, stream=True):
+            if chunk.message.content:
+                tokens.append(chunk.message.content)
+                yield chunk.message.content
+    _record_thesis_call(messages, "".join(tokens), chunk)
+
+async def astream_thesis(conversation_summary: str) -> AsyncIterator[str]:
+    """Async version of stream_thesis"""
+    messages = _thesis_messages(conversation_summary)
+    tokens = []
+    chunk = None
+    with span("llm.thesis"):
+        stream = await get_registry().async_ollama_client().chat(model=THESIS_MODEL, messages=messages, stream=True)
+        async for chunk in stream:
+            if chunk.message.content:
+                tokens.append(chunk.message.content)
+                yield chunk.message.content
+    _record_thesis_call(messages, "".join(tokens), chunk)
+
+def generate_thesis(conversation_summary: str) -> str:
+    """Generate a clinical thesis from the full patient conversation using MedGemma via Ollama."""
+    print("Generating thesis...")
+    if STREAM_OUTPUT:
+        print("\n🧾 Clinical Analysis:")
+        tokens = []
+        for token in stream_thesis(conversation_summary):
+            print(token, end="", flush=True)
+            tokens.append(token)
+        print()
+        return "".join(tokens)
+    
+    messages = _thesis_messages(conversation_summary)
+    with span("llm.thesis"):
+        response = get_registry().ollama_client().chat(model=THESIS_MODEL, messages=messages)
+    _record_thesis_call(messages, response.message.content, response)
+    return response.message.content
+
+
+async def athesis_generator(conversation_summary: str) -> str:
+    """Async version of thesis_generator using the Ollama async client"""
     print("Generating thesis...")
-    response = chat(model="alibayram/medgemma:latest", messages=messages)
+    messages = _thesis_messages(conversation_summary)
+    with span("llm.thesis"):
+        response = await get_registry().async_ollama_client().chat(model=THESIS_MODEL, messages=messages)
+    _record_thesis_call(messages, response.message.content, response)
     return response.message.content
 
 
@@ -62,73 +138,353 @@ Only when confirmation is complete should you generate the clinical analysis.
 Also, make sure you ask only 2 questions at a time, you shouldn't make the patient overwhelmed. be extremely careful and polite
 """
 
-# Create a proper prompt template
-prompt_template = ChatPromptTemplate.from_messages([
-    ("system", system_prompt),
-    MessagesPlaceholder("chat_history", optional=True),
-    ("human", "{input}"),
-    MessagesPlaceholder("agent_scratchpad")
-])
+@functools.lru_cache(maxsize=None)
+def get_thesis_tool():
+    """thesis_generator as a LangChain tool for the agent"""
+    from langchain.tools import tool
+    return tool("thesis_generator")(generate_thesis)
 
-tools = [thesis_generator]  # Make sure thesis_generator is properly defined
-llm = ChatOpenAI(model="gpt-4", api_key=os.getenv('OPENAI_API_KEY'))  # Using standard gpt-4 as gpt-4.1 doesn't exist
-agent = create_tool_calling_agent(llm=llm, tools=tools, prompt=prompt_template)
-agent_executor = AgentExecutor(agent=agent, tools=tools, verbose=True)
+def get_llm():
+    """The intake assistant's chat model (shared through kg_resources)"""
+    return get_registry().llm("gpt-4", streaming=STREAM_OUTPUT)  # Using standard gpt-4 as gpt-4.1 doesn't exist
+
+@functools.lru_cache(maxsize=None)
+def get_agent_executor():
+    """Tool-calling agent executor for intake turns"""
+    from langchain.prompts import ChatPromptTemplate, MessagesPlaceholder
+    from langchain.agents import AgentExecutor, create_tool_calling_agent
+    
+    # Create a proper prompt template
+    prompt_template = ChatPromptTemplate.from_messages([
+        ("system", system_prompt),
+        MessagesPlaceholder("chat_history", optional=True),
+        ("human", "{input}"),
+        MessagesPlaceholder("agent_scratchpad")
+    ])
+    
+    tools = [get_thesis_tool()]
+    agent = create_tool_calling_agent(llm=get_llm(), tools=tools, prompt=prompt_template)
+    return AgentExecutor(agent=agent, tools=tools, verbose=True)
+
+@functools.lru_cache(maxsize=None)
+def get_local_reply_chain(route):
+    """Tool-less chat chain for routine turns on a local model_router route
+    
+    Local models often have no tool calling (Ollama rejects `tools` for them), and
+    the thesis tool is only needed on the closing turn, which the router keeps on
+    the large model. Returns {"output": reply} like the agent executor.
+    """
+    from langchain.prompts import ChatPromptTemplate, MessagesPlaceholder
+    from langchain_core.output_parsers import StrOutputParser
+    from langchain_core.runnables import RunnableParallel
+    
+    prompt_template = ChatPromptTemplate.from_messages([
+        ("system", system_prompt),
+        MessagesPlaceholder("chat_history", optional=True),
+        ("human", "{input}")
+    ])
+    return RunnableParallel(output=prompt_template | route.llm(streaming=STREAM_OUTPUT) | StrOutputParser())
+
+@functools.lru_cache(maxsize=None)
+def get_conversation_context():
+    """Older turns beyond INTAKE_CONTEXT_TOKENS history tokens are folded into a rolling summary"""
+    from intake_context import ConversationContext
+    return ConversationContext(llm=get_llm(), token_budget=int(os.getenv("INTAKE_CONTEXT_TOKENS", "3000")))
+
+# Names that used to be built at import time, now constructed on first access
+_LAZY_ATTRIBUTES = {
+    "thesis_generator": get_thesis_tool,
+    "llm": get_llm,
+    "agent_executor": get_agent_executor,
+    "conversation_context": get_conversation_context,
+}
+
+def __getattr__(name: str):
+    if name in _LAZY_ATTRIBUTES:
+        return _LAZY_ATTRIBUTES[name]()
+    if name == "workflow":
+        return get_workflow()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+# Phrases in a patient reply that signal they have nothing more to add
+END_PHRASES = ("no", "that's all")
+
+# Background extractors hold threads, so they live outside the state, keyed by session_id
+_draft_extractors: Dict[str, IncrementalCaseExtractor] = {}
 
 # Define state
 class AgentState(TypedDict):
+    session_id: str
     messages: List[Dict[str, str]]  # Store as proper message objects
-    symptoms: str
+    chat_history: List[Any]  # LangChain BaseMessage view of messages, appended alongside it
+    last_user_input: str
+    user_said_done: bool  # Any patient reply so far contained an END_PHRASE
+    symptoms: List[str]
     waiting_for_input: bool
     diagnosis: Optional[str]
     should_end: bool   
+    knowledge_graph: Optional[Dict[str, Any]]
+    context_summary: str  # Rolling summary of messages[:summarized_upto]
+    summarized_upto: int
+    message_tokens: List[int]
+    context_stats: Dict[str, int]  # Tokens sent vs. full history, see ConversationContext
+    draft_submitted_upto: int  # messages[:draft_submitted_upto] were sent for speculative extraction
 
 
 
 # Define nodes with updated state references
 def initialize_state():
     return {
+        "session_id": str(uuid.uuid4()),
         "messages": [],
-        "symptoms": "",
+        "chat_history": [],
+        "last_user_input": "",
+        "user_said_done": False,
+        "symptoms": [],
         "waiting_for_input": True,
         "diagnosis": None,
-        "should_end": False
+        "should_end": False,
+        "knowledge_graph": None,
+        "context_summary": "",
+        "summarized_upto": 0,
+        "message_tokens": [],
+        "draft_submitted_upto": 0
     }
 
-def agent_node(state: Dict[str, Any]):
-    if state["waiting_for_input"]:
-        return state
-        
-    # Convert messages to LangChain message format
-    chat_history = []
-    for msg in state["messages"]:
-        if msg["role"] == "user":
-            chat_history.append(HumanMessage(content=msg["content"]))
-        else:
-            chat_history.append(AIMessage(content=msg["content"]))
+def _add_message(state: Dict[str, Any], role: str, content: str):
+    """Append a message to the transcript and keep the derived conversation state in step"""
+    from langchain_core.messages import HumanMessage, AIMessage
+    state["messages"].append({"role": role, "content": content})
     
-    # Get last user input
-    last_user_msg = next((m for m in reversed(state["messages"]) if m["role"] == "user"), None)
-    input_text = last_user_msg["content"] if last_user_msg else ""
-    
-    # Run agent with conversation history
-    response = agent_executor.invoke({
-        "input": input_text,
+    if role == "user":
+        state["chat_history"].append(HumanMessage(content=content))
+        state["last_user_input"] = content
+        if any(phrase in content.lower() for phrase in END_PHRASES):
+            state["user_said_done"] = True
+    else:
+        state["chat_history"].append(AIMessage(content=content))
+
+def _rebuild_conversation_state(state: Dict[str, Any]):
+    """Derive chat_history and end-detection flags for a state that only has messages"""
+    messages = state["messages"]
+    state["messages"] = []
+    state["chat_history"] = []
+    state["last_user_input"] = ""
+    state["user_said_done"] = False
+    for msg in messages:
+        _add_message(state, msg["role"], msg["content"])
+
+def _ensure_conversation_state(state: Dict[str, Any]):
+    # States restored from older snapshots only carry the raw transcript
+    if "chat_history" not in state:
+        _rebuild_conversation_state(state)
+
+def _agent_inputs(state: Dict[str, Any], chat_history: List[Any]) -> Dict[str, Any]:
+    """Build the agent executor inputs from the windowed conversation"""
+    return {
+        "input": state["last_user_input"],
         "chat_history": chat_history
-    })["output"]
-    
+    }
+
+def _thesis_transcript(state: Dict[str, Any]) -> str:
+    """Conversation transcript for MedGemma: rolling summary plus the recent turns verbatim"""
+    recent = generate_conversation_summary(state["messages"][state.get("summarized_upto", 0):])
+    if not state.get("context_summary"):
+        return recent
+    return f"Summary of the earlier conversation:\n{state['context_summary']}\n\nRecent conversation:\n{recent}"
+
+def _record_agent_reply(state: Dict[str, Any], response: str):
+    """Store the agent reply and update the end-of-conversation flags"""
     # Store agent response
-    state["messages"].append({"role": "assistant", "content": response})
+    _add_message(state, "assistant", response)
     
     # Check for ending condition
-    if "anything else" in response.lower():
-        user_responses = [m["content"].lower() for m in state["messages"] if m["role"] == "user"]
-        if any("no" in resp or "that's all" in resp for resp in user_responses):
-            state["should_end"] = True
+    if "anything else" in response.lower() and state["user_said_done"]:
+        state["should_end"] = True
+    
+    _submit_draft_turns(state)
     
     state["waiting_for_input"] = True
     return state
 
+def _submit_draft_turns(state: Dict[str, Any]):
+    """Hand new conversation turns to the session's background KG extractor once a batch is full"""
+    if not SPECULATIVE_KG:
+        return
+    
+    start = state.get("draft_submitted_upto", 0)
+    new_messages = state["messages"][start:]
+    if sum(1 for m in new_messages if m["role"] == "user") < SPECULATIVE_BATCH_TURNS:
+        return
+    
+    session_id = state.setdefault("session_id", str(uuid.uuid4()))
+    extractor = _draft_extractors.get(session_id)
+    if extractor is None:
+        extractor = _draft_extractors[session_id] = IncrementalCaseExtractor()
+    
+    extractor.submit(generate_conversation_summary(new_messages))
+    state["draft_submitted_upto"] = len(state["messages"])
+
+def _token_queue_handler(tokens: queue.Queue):
+    """LangChain callback handler that forwards streamed LLM tokens to a queue"""
+    from langchain_core.callbacks import BaseCallbackHandler
+    
+    class TokenQueueHandler(BaseCallbackHandler):
+        def on_llm_new_token(self, token: str, **kwargs):
+            if token:
+                tokens.put(token)
+    
+    return TokenQueueHandler()
+
+def _agent_config(*callbacks, metrics=None) -> Dict[str, Any]:
+    """Executor run config; the intake LLM calls are always counted in kg_metrics"""
+    return {"callbacks": [metrics or llm_callback_handler("gpt-4", "intake"), *callbacks]}
+
+def _turn_route(state: Dict[str, Any]):
+    """(router, route, reason) for the next assistant reply; router is None when routing is off"""
+    router = default_model_router()
+    if router is None:
+        return None, None, None
+    route, reason = router.route_turn(state)
+    return router, route, reason
+
+def _route_executor(route):
+    # The large route runs the tool-calling executor used without routing
+    return get_local_reply_chain(route) if route is not None and route.local else get_agent_executor()
+
+def _run_agent(state: Dict[str, Any], chat_history: List[Any]) -> str:
+    """One assistant reply; with a router, routine turns go to the local model and weak replies are escalated"""
+    inputs = _agent_inputs(state, chat_history)
+    router, route, reason = _turn_route(state)
+    if router is None:
+        return get_agent_executor().invoke(inputs, config=_agent_config())["output"]
+    
+    def call(route):
+        metrics = llm_callback_handler(route.model, "intake")
+        output = _route_executor(route).invoke(inputs, config=_agent_config(metrics=metrics))["output"]
+        return output, metrics.input_tokens, metrics.output_tokens
+    
+    return router.run("intake", (route, reason), call, router.check_reply)
+
+async def _arun_agent(state: Dict[str, Any], chat_history: List[Any]) -> str:
+    """Async version of _run_agent"""
+    inputs = _agent_inputs(state, chat_history)
+    router, route, reason = _turn_route(state)
+    if router is None:
+        return (await get_agent_executor().ainvoke(inputs, config=_agent_config()))["output"]
+    
+    async def call(route):
+        metrics = llm_callback_handler(route.model, "intake")
+        output = (await _route_executor(route).ainvoke(inputs, config=_agent_config(metrics=metrics)))["output"]
+        return output, metrics.input_tokens, metrics.output_tokens
+    
+    return await router.arun("intake", (route, reason), call, router.check_reply)
+
+def stream_agent_reply(state: Dict[str, Any]) -> Iterator[str]:
+    """Yield the assistant reply token by token, then record the complete reply in state
+    
+    The agent runs in a worker thread and its LLM tokens are relayed through a
+    queue. The reply stored in state["messages"] is the executor's final output,
+    not the concatenated tokens, so tool-call steps never leak into the transcript.
+    Requires an llm created with streaming=True (INTAKE_STREAM=1). With a
+    router the turn is routed by its rules only: tokens already shown cannot
+    be taken back, so a weak local reply is not escalated.
+    """
+    _ensure_conversation_state(state)
+    chat_history = get_conversation_context().window(state)
+    inputs = _agent_inputs(state, chat_history)
+    router, route, reason = _turn_route(state)
+    agent_executor = _route_executor(route)
+    metrics = llm_callback_handler(route.model if route else "gpt-4", "intake")
+    
+    tokens: queue.Queue = queue.Queue()
+    result: Dict[str, Any] = {}
+    start = time.perf_counter()
+    
+    def run():
+        try:
+            result["output"] = agent_executor.invoke(
+                inputs, config=_agent_config(_token_queue_handler(tokens), metrics=metrics)
+            )["output"]
+        except Exception as e:
+            result["error"] = e
+        finally:
+            tokens.put(None)
+    
+    threading.Thread(target=run, daemon=True).start()
+    while (token := tokens.get()) is not None:
+        yield token
+    
+    if router is not None:
+        router.record(route, "intake", reason, time.perf_counter() - start, metrics.input_tokens,
+                      metrics.output_tokens, failed="error" in result)
+    if "error" in result:
+        raise result["error"]
+    _record_agent_reply(state, result["output"])
+
+async def astream_agent_reply(state: Dict[str, Any]) -> AsyncIterator[str]:
+    """Async version of stream_agent_reply, built on AgentExecutor.astream_events"""
+    _ensure_conversation_state(state)
+    chat_history = await get_conversation_context().awindow(state)
+    inputs = _agent_inputs(state, chat_history)
+    router, route, reason = _turn_route(state)
+    metrics = llm_callback_handler(route.model if route else "gpt-4", "intake")
+    start = time.perf_counter()
+    
+    output = None
+    events = _route_executor(route).astream_events(inputs, config=_agent_config(metrics=metrics), version="v2")
+    async for event in events:
+        if event["event"] == "on_chat_model_stream":
+            content = event["data"]["chunk"].content
+            if isinstance(content, str) and content:
+                yield content
+        elif event["event"] == "on_chain_end" and not event["parent_ids"]:
+            # The outermost run: the agent executor or the local reply chain
+            output = event["data"]["output"]["output"]
+    
+    if router is not None:
+        router.record(route, "intake", reason, time.perf_counter() - start, metrics.input_tokens, metrics.output_tokens)
+    _record_agent_reply(state, output or "")
+
+@timed("agent_node")
+def agent_node(state: Dict[str, Any]):
+    if state["waiting_for_input"]:
+        return state
+    
+    if STREAM_OUTPUT:
+        print("\nAssistant: ", end="", flush=True)
+        for token in stream_agent_reply(state):
+            print(token, end="", flush=True)
+        print()
+        return state
+    
+    # Run agent with the budgeted conversation history
+    _ensure_conversation_state(state)
+    chat_history = get_conversation_context().window(state)
+    response = _run_agent(state, chat_history)
+    return _record_agent_reply(state, response)
+
+@timed("agent_node")
+async def aagent_node(state: Dict[str, Any]):
+    """Async version of agent_node"""
+    if state["waiting_for_input"]:
+        return state
+    
+    _ensure_conversation_state(state)
+    chat_history = await get_conversation_context().awindow(state)
+    response = await _arun_agent(state, chat_history)
+    return _record_agent_reply(state, response)
+
+def add_patient_turn(state: Dict[str, Any], user_input: str):
+    """Record a patient message and hand the turn to the assistant"""
+    # Store user message
+    _ensure_conversation_state(state)
+    _add_message(state, "user", user_input)
+    state["symptoms"].append(user_input)
+    state["waiting_for_input"] = False
+    return state
+
+@timed("patient_input_node")
 def patient_input_node(state: Dict[str, Any]):
     if not state["waiting_for_input"]:
         return state
@@ -137,32 +493,33 @@ def patient_input_node(state: Dict[str, Any]):
     if not user_input:
         return state
         
-    # Store user message
-    state["messages"].append({"role": "user", "content": user_input})
-    state["symptoms"] += " " + user_input
-    state["waiting_for_input"] = False
-    return state
+    return add_patient_turn(state, user_input)
 
 
+@timed("generate_diagnosis_node")
 def generate_diagnosis_node(state: Dict[str, Any]):
     if not state.get("messages"):
         state["diagnosis"] = "No conversation to analyze"
         return state
     
     try:
-        conversation_summary = generate_conversation_summary(state["messages"])
+        _ensure_conversation_state(state)
+        get_conversation_context().window(state)
+        conversation_summary = _thesis_transcript(state)
         print("\nGenerating diagnosis based on full conversation...")
         
         # Get clinical analysis
-        result = thesis_generator.invoke({"conversation_summary": conversation_summary})
-        print(f"\n🧾 Clinical Analysis:\n{result}")
+        result = get_thesis_tool().invoke({"conversation_summary": conversation_summary})
+        if not STREAM_OUTPUT:
+            print(f"\n🧾 Clinical Analysis:\n{result}")
         
-        # NEW: Build knowledge graph from the result
-        kg_result = integrate_with_intake_script(result)
+        # NEW: Build knowledge graph from the result, reconciling with the speculative draft if any
+        draft_extractor = _draft_extractors.pop(state.get("session_id"), None)
+        kg_result = integrate_with_intake_script(result, draft_extractor=draft_extractor)
         
         if kg_result['status'] == 'success':
-            print(f"\n🔬 Knowledge Graph Built Successfully!")
-            print(f"Files saved: medical_case_*.json and medical_case_*.cypher")
+            print("\n🔬 Knowledge Graph Built Successfully!")
+            print("Files saved: medical_case_*.json and medical_case_*.cypher")
             
             # Optionally store KG in state
             state["knowledge_graph"] = kg_result['knowledge_graph']
@@ -177,14 +534,32 @@ def generate_diagnosis_node(state: Dict[str, Any]):
     
     return state
 
-# Build the graph
-graph = StateGraph(AgentState)
-
-graph.add_node("assistant", agent_node)
-graph.add_node("user_input", patient_input_node)
-graph.add_node("diagnosis_generator", generate_diagnosis_node)
-
-graph.set_entry_point("user_input")
+@timed("generate_diagnosis_node")
+async def agenerate_diagnosis_node(state: Dict[str, Any]):
+    """Async version of generate_diagnosis_node"""
+    if not state.get("messages"):
+        state["diagnosis"] = "No conversation to analyze"
+        return state
+    
+    try:
+        _ensure_conversation_state(state)
+        await get_conversation_context().awindow(state)
+        result = await athesis_generator(_thesis_transcript(state))
+        
+        draft_extractor = _draft_extractors.pop(state.get("session_id"), None)
+        kg_result = await aintegrate_with_intake_script(result, draft_extractor=draft_extractor)
+        if kg_result['status'] == 'success':
+            state["knowledge_graph"] = kg_result['knowledge_graph']
+        else:
+            print(f"\n❌ KG Generation Failed: {kg_result.get('error')}")
+        
+        state["diagnosis"] = result
+        
+    except Exception as e:
+        print(f"Error generating diagnosis: {e}")
+        state["diagnosis"] = "Could not generate clinical analysis"
+    
+    return state
 
 def decide_next_node(state: Dict[str, Any]):
     state.setdefault("should_end", False)
@@ -196,40 +571,191 @@ def decide_next_node(state: Dict[str, Any]):
         return "user_input"
     return "assistant"
 
-graph.add_conditional_edges(
-    "assistant",
-    decide_next_node,
-    {"user_input": "user_input", "diagnosis_generator": "diagnosis_generator"}
-)
+def pending_node(state: Dict[str, Any]) -> Optional[str]:
+    """Node a state continues at ("user_input" when waiting for the patient), or None once the intake is complete"""
+    if state.get("diagnosis") is not None:
+        return None
+    return decide_next_node(state)
 
-graph.add_conditional_edges(
-    "user_input",
-    lambda state: "assistant",
-    {"assistant": "assistant"}
-)
+def restore_state(stored: Dict[str, Any]) -> Dict[str, Any]:
+    """Live state from a checkpointed one (see session_store), rebuilding chat_history"""
+    state = dict(stored)
+    state.pop("chat_history", None)
+    _ensure_conversation_state(state)
+    return state
+
+# Called as checkpoint(node, state) after each graph node completes; after an async node it may be a coroutine
+Checkpointer = Callable[[str, Dict[str, Any]], Optional[Awaitable[None]]]
 
-graph.add_edge("diagnosis_generator", END)
+def _checkpointed(name: str, node, checkpoint: Optional[Checkpointer]):
+    """Wrap a node (sync or async) so its resulting state is checkpointed"""
+    if checkpoint is None:
+        return node
+    
+    if inspect.iscoroutinefunction(node):
+        @functools.wraps(node)
+        async def async_wrapper(state: Dict[str, Any]):
+            state = await node(state)
+            saved = checkpoint(name, state)
+            if inspect.isawaitable(saved):
+                await saved
+            return state
+        return async_wrapper
+    
+    @functools.wraps(node)
+    def wrapper(state: Dict[str, Any]):
+        state = node(state)
+        checkpoint(name, state)
+        return state
+    return wrapper
 
-# Compile with recursion limit
-workflow = graph.compile()
+def build_graph(checkpoint: Optional[Checkpointer] = None):
+    """Build the (uncompiled) intake StateGraph
+    
+    The entry point follows decide_next_node, so a restored state continues at
+    the node after its last checkpoint instead of asking the patient again.
+    """
+    from langgraph.graph import StateGraph, END
+    
+    graph = StateGraph(AgentState)
+    
+    graph.add_node("assistant", _checkpointed("assistant", agent_node, checkpoint))
+    graph.add_node("user_input", _checkpointed("user_input", patient_input_node, checkpoint))
+    graph.add_node("diagnosis_generator", _checkpointed("diagnosis_generator", generate_diagnosis_node, checkpoint))
+    
+    graph.set_conditional_entry_point(
+        decide_next_node,
+        {"user_input": "user_input", "assistant": "assistant", "diagnosis_generator": "diagnosis_generator"}
+    )
+    
+    graph.add_conditional_edges(
+        "assistant",
+        decide_next_node,
+        {"user_input": "user_input", "diagnosis_generator": "diagnosis_generator"}
+    )
+    
+    graph.add_conditional_edges(
+        "user_input",
+        lambda state: "assistant",
+        {"assistant": "assistant"}
+    )
+    
+    graph.add_edge("diagnosis_generator", END)
+    return graph
 
-# Run conversation
-print("Medical Intake Assistant (type 'quit' to exit)")
-state = initialize_state()
+@functools.lru_cache(maxsize=None)
+def get_workflow():
+    """The compiled intake graph"""
+    # Compile with recursion limit
+    return build_graph().compile()
 
-while True:
-    try:
-        result = workflow.invoke(state)
-        state.update(result)
-        
-        if state.get("diagnosis") is not None:
+def build_turn_graph(checkpoint: Optional[Checkpointer] = None):
+    """Build the (uncompiled) graph for one patient turn, for hosting many sessions (see intake_server)
+    
+    The caller adds the patient's message with add_patient_turn instead of
+    patient_input_node reading it from stdin. The turn ends when the assistant waits
+    for input again, or after the diagnosis once the conversation is complete.
+    A restored state that stopped mid-turn continues at its pending node.
+    """
+    from langgraph.graph import StateGraph, END
+    
+    graph = StateGraph(AgentState)
+    
+    graph.add_node("assistant", _checkpointed("assistant", aagent_node, checkpoint))
+    graph.add_node("diagnosis_generator", _checkpointed("diagnosis_generator", agenerate_diagnosis_node, checkpoint))
+    
+    graph.set_conditional_entry_point(
+        decide_next_node,
+        {"user_input": END, "assistant": "assistant", "diagnosis_generator": "diagnosis_generator"}
+    )
+    
+    graph.add_conditional_edges(
+        "assistant",
+        decide_next_node,
+        {"user_input": END, "diagnosis_generator": "diagnosis_generator"}
+    )
+    
+    graph.add_edge("diagnosis_generator", END)
+    return graph
+
+@functools.lru_cache(maxsize=None)
+def get_turn_workflow():
+    """The compiled per-turn intake graph"""
+    return build_turn_graph().compile()
+
+def main():
+    """Run an interactive intake conversation in the terminal"""
+    logging.basicConfig(level=logging.INFO)
+    load_environment()
+    load_settings()
+    
+    # Checkpoint after every node (INTAKE_SESSION_STORE); INTAKE_RESUME_SESSION continues a saved session
+    store = default_session_store()
+    resume_id = os.getenv("INTAKE_RESUME_SESSION")
+    checkpoint = store.load(resume_id) if store and resume_id else None
+    steps = [checkpoint.step if checkpoint else 0]
+    
+    def save_checkpoint(node: str, node_state: Dict[str, Any]):
+        steps[0] += 1
+        store.save(SessionCheckpoint.from_state(node_state, node, pending_node(node_state), steps[0]))
+    
+    workflow = build_graph(checkpoint=save_checkpoint).compile() if store else get_workflow()
+    
+    # Run conversation
+    print("Medical Intake Assistant (type 'quit' to exit)")
+    if checkpoint is not None:
+        state = restore_state(checkpoint.state)
+        print(f"Resuming session {resume_id} at {checkpoint.next_node or 'the end'}")
+    else:
+        if resume_id:
+            print(f"No saved session {resume_id}; starting a new one")
+        state = initialize_state()
+    if store:
+        print(f"Session {state['session_id']} (resume with INTAKE_RESUME_SESSION={state['session_id']})")
+    
+    # A resumed session may already be complete
+    while state.get("diagnosis") is None:
+        try:
+            result = workflow.invoke(state)
+            state.update(result)
+            
+            if any("quit" in msg.lower() for msg in state.get("conversation", []) if isinstance(msg, str)):
+                print("\nEnding conversation...")
+                break
+        except KeyboardInterrupt:
+            print("\nConversation ended by user")
             break
-        if any("quit" in msg.lower() for msg in state.get("conversation", []) if isinstance(msg, str)):
-            print("\nEnding conversation...")
+        except Exception as e:
+            print(f"Error in conversation flow: {e}")
             break
-    except KeyboardInterrupt:
-        print("\nConversation ended by user")
-        break
-    except Exception as e:
-        print(f"Error in conversation flow: {e}")
-        break
+    
+    # A session that ended before the diagnosis still owns its background extractor
+    extractor = _draft_extractors.pop(state["session_id"], None)
+    if extractor is not None:
+        extractor.discard()
+    
+    # Prometheus text metrics, e.g. for node_exporter's textfile collector
+    if os.getenv("KG_METRICS_FILE"):
+        write_prometheus(os.getenv("KG_METRICS_FILE"))
+    
+    # Per-route calls, latency and cost, for tuning the routing rules
+    router = default_model_router()
+    if router is not None:
+        stats = router.stats()
+        for name, route_stats in stats["routes"].items():
+            print(f"Route {name} ({route_stats['model']}): {route_stats['calls']} calls, "
+                  f"{route_stats['mean_seconds']}s mean, ${route_stats['cost_usd']}")
+        if stats["escalations"]:
+            print(f"Escalations: {stats['escalations']}")
+    
+    if store:
+        # Completed sessions (this one included) have nothing left to resume
+        retention = completed_retention()
+        if retention >= 0:
+            store.prune_completed(retention)
+        store.close()
+    shutdown_registry()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+"""
+Cold-start import time of the project modules.
+
+Each module is imported in a fresh interpreter with `-X importtime`, several
+times, and the median is reported net of a bare `python -c pass` start-up.
+The slowest imports (cumulative microseconds from -X importtime) are listed
+so a regression can be traced to the dependency that caused it.
+
+Usage:
+    python benchmarks/import_time.py
+    python benchmarks/import_time.py kg_drafter agent --runs 10 --max-ms 150
+    python benchmarks/import_time.py --json import_times.json
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+from typing import Dict, Any, List, Tuple
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+DEFAULT_MODULES = ["kg_drafter", "kg_models", "kg_cache", "kg_batch", "intake_context", "agent"]
+
+
+def _run(code: str) -> Tuple[float, str]:
+    """Run `code` in a fresh interpreter; return (wall seconds, -X importtime output)"""
+    start = time.perf_counter()
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        cwd=REPO_ROOT, capture_output=True, text=True
+    )
+    elapsed = time.perf_counter() - start
+    if proc.returncode != 0:
+        raise RuntimeError(proc.stderr.strip().splitlines()[-1] if proc.stderr.strip() else "import failed")
+    return elapsed, proc.stderr
+
+
+def _slowest_imports(importtime_output: str, top: int) -> List[Dict[str, Any]]:
+    """Top imports by cumulative time from `-X importtime` output"""
+    imports = []
+    for line in importtime_output.splitlines():
+        # import time: self [us] | cumulative | imported package
+        if not line.startswith("import time:") or "imported package" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|", 2)
+        imports.append({'module': name.strip(), 'cumulative_ms': round(int(cumulative) / 1000, 2)})
+    imports.sort(key=lambda item: item['cumulative_ms'], reverse=True)
+    return imports[:top]
+
+
+def measure(module: str, runs: int = 5, top: int = 5, baseline_s: float = 0.0) -> Dict[str, Any]:
+    """Median cold import time of one module"""
+    timings = []
+    output = ""
+    try:
+        for _ in range(runs):
+            elapsed, output = _run(f"import {module}")
+            timings.append(elapsed)
+    except RuntimeError as e:
+        return {'module': module, 'status': 'failed', 'error': str(e)}
+
+    median = statistics.median(timings)
+    return {
+        'module': module,
+        'status': 'success',
+        'median_ms': round((median - baseline_s) * 1000, 2),
+        'min_ms': round((min(timings) - baseline_s) * 1000, 2),
+        'slowest_imports': _slowest_imports(output, top)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure cold-start import time of project modules")
+    parser.add_argument("modules", nargs="*", default=DEFAULT_MODULES, help="Modules to import")
+    parser.add_argument("--runs", type=int, default=5, help="Fresh interpreters per module")
+    parser.add_argument("--top", type=int, default=5, help="Slowest imports to list per module")
+    parser.add_argument("--json", default=None, help="Also write the results to this file")
+    parser.add_argument("--max-ms", type=float, default=None, help="Exit non-zero if any module is slower")
+    args = parser.parse_args()
+
+    baseline_s = statistics.median(_run("pass")[0] for _ in range(args.runs))
+    print(f"Interpreter start-up: {baseline_s * 1000:.1f} ms (subtracted below)")
+
+    results = []
+    for module in args.modules:
+        result = measure(module, runs=args.runs, top=args.top, baseline_s=baseline_s)
+        results.append(result)
+
+        if result['status'] != 'success':
+            print(f"{module:<16} FAILED: {result['error']}")
+            continue
+        print(f"{module:<16} {result['median_ms']:>8.1f} ms (min {result['min_ms']:.1f} ms)")
+        for item in result['slowest_imports']:
+            print(f"    {item['cumulative_ms']:>8.1f} ms  {item['module']}")
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump({'python': sys.version.split()[0], 'baseline_ms': round(baseline_s * 1000, 2),
+                       'results': results}, f, indent=2)
+
+    failed = [r['module'] for r in results if r['status'] != 'success']
+    too_slow = [r['module'] for r in results
+                if r['status'] == 'success' and args.max_ms is not None and r['median_ms'] > args.max_ms]
+    if failed or too_slow:
+        if too_slow:
+            print(f"Slower than {args.max_ms} ms: {', '.join(too_slow)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,217 @@
+"""
+Load test for intake_server with stand-in models.
+
+Starts the intake server in this process on the stand-ins from
+benchmarks/standins.py, then runs many simulated patients against it over HTTP
+at once. Each patient opens a session and sends the PATIENT_TURNS conversation
+from benchmarks/pipeline.py turn by turn; the last turn ends the intake, so each
+session also produces a diagnosis and a knowledge graph. Case files are written
+to a temporary directory.
+
+Reports completed sessions, turn latency (median/p95/max), turns per second,
+503 rejections (retried after Retry-After) and peak memory.
+
+With --routing the server runs with model_router on, and the local tier is a
+stand-in that rejects tools like a model without tool support on Ollama.
+Routine turns must then be answered locally without escalating; the script
+reports the per-route stats and exits with status 1 on any local_error
+escalation.
+
+Usage:
+    python benchmarks/intake_load.py --sessions 300 --llm-latency 0.2
+    python benchmarks/intake_load.py --sessions 500 --max-concurrent-turns 64 --json load.json
+    python benchmarks/intake_load.py --sessions 50 --routing
+"""
+
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import os
+import resource
+import statistics
+import sys
+import tempfile
+import time
+from typing import Dict, Any, List, Tuple
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_ROOT = os.path.dirname(BENCHMARKS_DIR)
+sys.path.insert(0, REPO_ROOT)
+sys.path.insert(0, BENCHMARKS_DIR)
+
+
+class Client:
+    """Keep-alive HTTP/1.1 JSON client over one connection"""
+
+    def __init__(self, host: str, port: int):
+        self.host = host
+        self.port = port
+        self.reader = self.writer = None
+
+    async def request(self, method: str, path: str, payload: Any = None) -> Tuple[int, Dict[str, str], Any]:
+        if self.writer is None:
+            self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+        body = json.dumps(payload).encode() if payload is not None else b""
+        self.writer.write(
+            f"{method} {path} HTTP/1.1\r\nHost: {self.host}\r\nContent-Type: application/json\r\n"
+            f"Content-Length: {len(body)}\r\n\r\n".encode() + body
+        )
+        await self.writer.drain()
+
+        status = int((await self.reader.readline()).split()[1])
+        headers = {}
+        while (line := await self.reader.readline()) not in (b"\r\n", b""):
+            name, _, value = line.decode().partition(":")
+            headers[name.strip().lower()] = value.strip()
+        data = await self.reader.readexactly(int(headers.get('content-length', 0)))
+        if headers.get('connection') == "close":
+            await self.close()
+        return status, headers, json.loads(data) if data and 'json' in headers.get('content-type', '') else data
+
+    async def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            with contextlib.suppress(ConnectionError):
+                await self.writer.wait_closed()
+            self.reader = self.writer = None
+
+
+async def patient(host: str, port: int, turns: List[str], stats: Dict[str, Any]):
+    """One simulated patient: open a session, send every turn, retrying when the server is busy"""
+    client = Client(host, port)
+    try:
+        status, _, created = await client.request("POST", "/sessions")
+        if status != 201:
+            stats['failed_sessions'] += 1
+            return
+        session_path = f"/sessions/{created['session_id']}/turns"
+
+        result = None
+        for turn in turns:
+            while True:
+                start = time.perf_counter()
+                status, headers, result = await client.request("POST", session_path, {'message': turn})
+                if status != 503:
+                    break
+                stats['rejected'] += 1
+                await asyncio.sleep(float(headers.get('retry-after', 1)))
+            if status != 200:
+                stats['failed_turns'] += 1
+                return
+            stats['turn_latencies'].append(time.perf_counter() - start)
+        if result and result.get('done'):
+            stats['completed_sessions'] += 1
+    finally:
+        await client.close()
+
+
+async def run(args) -> Dict[str, Any]:
+    from kg_resources import set_registry
+    from intake_server import IntakeServer, IntakeSessionManager
+    from pipeline import PATIENT_TURNS
+    from standins import CannedChatModel, FakeOllamaClient, StandInRegistry, load_case_fixtures, load_thesis_fixture
+    import agent
+    import model_router
+
+    fixtures = load_case_fixtures()
+    llm = CannedChatModel(cases=[json.dumps(case) for case in fixtures], latency=args.llm_latency,
+                          tokens_per_second=args.llm_tokens_per_second)
+    local_llm = None
+    if args.routing:
+        local_llm = CannedChatModel(cases=[json.dumps(case) for case in fixtures], latency=args.llm_latency,
+                                    tokens_per_second=args.llm_tokens_per_second, supports_tools=False)
+    registry = StandInRegistry(llm=llm, ollama=FakeOllamaClient(load_thesis_fixture(), latency=args.llm_latency),
+                               local_llm=local_llm)
+    previous = set_registry(registry)
+    # The executor, reply chains, context and router are cached per process; rebuild them for this run
+    os.environ['KG_ROUTING'] = "1" if args.routing else "0"
+    model_router.default_model_router.cache_clear()
+    agent.get_agent_executor.cache_clear()
+    agent.get_local_reply_chain.cache_clear()
+    agent.get_conversation_context.cache_clear()
+
+    manager = IntakeSessionManager(max_sessions=args.sessions, max_concurrent_turns=args.max_concurrent_turns,
+                                   max_queued_turns=args.max_queued_turns)
+    server = IntakeServer(manager, "127.0.0.1", 0)
+    host, port = await server.start()
+
+    stats = {'completed_sessions': 0, 'failed_sessions': 0, 'failed_turns': 0, 'rejected': 0,
+             'turn_latencies': []}
+    turns = PATIENT_TURNS[-args.turns:]
+    start = time.perf_counter()
+    try:
+        await asyncio.gather(*(patient(host, port, turns, stats) for _ in range(args.sessions)))
+    finally:
+        wall_time = time.perf_counter() - start
+        await server.close()
+        set_registry(previous)
+
+    latencies = sorted(stats.pop('turn_latencies'))
+    return dict(
+        stats,
+        sessions=args.sessions,
+        turns_per_session=len(turns),
+        turns=len(latencies),
+        wall_time_s=round(wall_time, 3),
+        turns_per_s=round(len(latencies) / wall_time, 1) if wall_time else None,
+        turn_latency_ms={
+            'median': round(statistics.median(latencies) * 1000, 1) if latencies else None,
+            'p95': round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))] * 1000, 1)
+            if latencies else None,
+            'max': round(latencies[-1] * 1000, 1) if latencies else None
+        },
+        llm_calls=dict(llm.calls),
+        local_llm_calls=dict(local_llm.calls) if local_llm else None,
+        server=manager.health(),
+        max_rss_mb=round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load-test intake_server with stand-in models")
+    parser.add_argument("--sessions", type=int, default=300, help="Simulated patients, all connected at once")
+    parser.add_argument("--turns", type=int, default=4, help="Patient turns per session (the last ends the intake)")
+    parser.add_argument("--max-concurrent-turns", type=int, default=64, help="Server turn concurrency")
+    parser.add_argument("--max-queued-turns", type=int, default=1024, help="Server turn queue before 503")
+    parser.add_argument("--llm-latency", type=float, default=0.2, help="Simulated seconds per LLM/Ollama call")
+    parser.add_argument("--llm-tokens-per-second", type=float, default=0.0,
+                        help="Simulated generation rate (0: instant)")
+    parser.add_argument("--routing", action="store_true",
+                        help="Route routine turns to a local stand-in without tool support (model_router)")
+    parser.add_argument("--json", default=None, help="Also write the results to this file")
+    args = parser.parse_args()
+
+    # Cases are saved to the working directory; keep them out of the checkout
+    json_path = os.path.abspath(args.json) if args.json else None
+    with tempfile.TemporaryDirectory() as output_dir:
+        os.chdir(output_dir)
+        # AgentExecutor(verbose=True) and the diagnosis node print every step
+        with contextlib.redirect_stdout(io.StringIO()):
+            results = asyncio.run(run(args))
+        os.chdir(REPO_ROOT)
+
+    latency = results['turn_latency_ms']
+    print(f"{results['completed_sessions']}/{results['sessions']} sessions completed, {results['turns']} turns "
+          f"in {results['wall_time_s']}s ({results['turns_per_s']} turns/s)")
+    print(f"Turn latency: median {latency['median']} ms, p95 {latency['p95']} ms, max {latency['max']} ms")
+    print(f"Rejected (503, retried): {results['rejected']}; failed turns: {results['failed_turns']}; "
+          f"peak RSS {results['max_rss_mb']} MB")
+
+    routing = results['server'].get('routing')
+    if routing:
+        for name, route in routing['routes'].items():
+            print(f"Route {name}: {route['calls']} calls ({route['failed']} failed), reasons {route['reasons']}")
+        print(f"Escalations: {routing['escalations'] or 'none'}")
+
+    if json_path:
+        with open(json_path, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+
+    if routing and any(key.endswith(":local_error") for key in routing['escalations']):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,274 @@
+"""
+Offline pipeline benchmark with stand-in LLM, Ollama and Neo4j backends.
+
+Replays the bundled medical_case_*.json and thesis.md fixtures through the
+pipeline stages with the clients from benchmarks/standins.py installed in the
+resource registry, so no GPT-4, Ollama or Neo4j is needed and runs are
+repeatable. With the default zero latency the timings are the pipeline's own
+overhead; --llm-latency / --llm-tokens-per-second / --neo4j-latency add
+simulated service time.
+
+Stages:
+    analyze_medical_report   prompt formatting, LLM call and JSON parsing
+    build_cypher_from_json   Cypher generation per case
+    execute_queries_batch    Neo4jConnection batch execution against the recording driver; the pause
+                             between batches is --neo4j-batch-delay (0 by default, so it is not timed)
+    save_to_files            JSON/Cypher (and kgb with --formats) files per case
+    agent_node               multi-turn intake conversations through the agent executor
+
+Each stage reports median/p95 latency per operation and throughput. If a
+baseline file exists the results are compared against it, and stages slower
+than the baseline by more than --tolerance are reported (exit status 1 with
+--fail-on-regression). --update-baseline stores the current results.
+
+Usage:
+    python benchmarks/pipeline.py
+    python benchmarks/pipeline.py --cases 200 --llm-latency 0.05 --json results.json
+    python benchmarks/pipeline.py --update-baseline
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+from typing import Dict, Any, Callable, List, Optional
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_ROOT = os.path.dirname(BENCHMARKS_DIR)
+sys.path.insert(0, REPO_ROOT)
+
+DEFAULT_BASELINE = os.path.join(BENCHMARKS_DIR, "pipeline_baseline.json")
+
+STAGES = ("analyze_medical_report", "build_cypher_from_json", "execute_queries_batch", "save_to_files", "agent_node")
+
+# Patient side of the simulated intake conversation
+PATIENT_TURNS = [
+    "Hi, I've had some vaginal bleeding for the last two days.",
+    "It's lighter than my usual period, a bit brownish.",
+    "I also get cramps, they come and go, moderate I'd say.",
+    "The cramps get worse when I walk around a lot.",
+    "I feel nauseous, especially with cheese and pickles.",
+    "I have high blood pressure and take medication for it.",
+    "I'm about eight weeks pregnant.",
+    "No, that's all.",
+]
+
+
+def _summarize(timings: List[float], operations: Optional[int] = None) -> Dict[str, Any]:
+    """Latency distribution of one stage; operations defaults to one per timing"""
+    ordered = sorted(timings)
+    total = sum(ordered)
+    operations = len(ordered) if operations is None else operations
+    return {
+        'operations': operations,
+        'median_ms': round(statistics.median(ordered) * 1000, 3),
+        'p95_ms': round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))] * 1000, 3),
+        'total_s': round(total, 4),
+        'throughput_per_s': round(operations / total, 1) if total else None
+    }
+
+
+def _timed(function: Callable, *args, **kwargs):
+    start = time.perf_counter()
+    result = function(*args, **kwargs)
+    return time.perf_counter() - start, result
+
+
+def bench_analyze(builder, reports: List[str]) -> Dict[str, Any]:
+    timings = [_timed(builder.analyze_medical_report, report)[0] for report in reports]
+    return _summarize(timings)
+
+
+def bench_cypher(query_builder, cases: List[Dict[str, Any]]) -> Dict[str, Any]:
+    timings = []
+    queries = 0
+    for case in cases:
+        elapsed, case_queries = _timed(query_builder.build_cypher_from_json, case)
+        timings.append(elapsed)
+        queries += len(case_queries)
+    return dict(_summarize(timings), queries=queries)
+
+
+def bench_execute(connection, query_sets: List[List[str]], batch_size: int, batch_delay: float) -> Dict[str, Any]:
+    timings = []
+    errors = 0
+    for queries in query_sets:
+        elapsed, results = _timed(connection.execute_queries_batch, queries, batch_size=batch_size,
+                                  batch_delay=batch_delay)
+        timings.append(elapsed)
+        errors += results['error_count']
+    return dict(_summarize(timings), queries=sum(len(q) for q in query_sets), errors=errors)
+
+
+def bench_save(builder, cases: List[Dict[str, Any]], formats: Optional[tuple]) -> Dict[str, Any]:
+    timings = []
+    with tempfile.TemporaryDirectory() as output_dir:
+        for i, case in enumerate(cases):
+            queries = builder.generate_cypher_queries(case)
+            base = os.path.join(output_dir, f"medical_case_{i:06d}")
+            timings.append(_timed(builder.save_to_files, case, base, queries=queries, formats=formats)[0])
+    return _summarize(timings)
+
+
+def bench_agent(conversations: int, turns: List[str]) -> Dict[str, Any]:
+    import agent
+
+    # The executor and context are cached per process; rebuild them on the stand-in registry
+    agent.get_agent_executor.cache_clear()
+    agent.get_local_reply_chain.cache_clear()
+    agent.get_conversation_context.cache_clear()
+
+    timings = []
+    # AgentExecutor(verbose=True) prints every step
+    with contextlib.redirect_stdout(io.StringIO()):
+        for _ in range(conversations):
+            state = agent.initialize_state()
+            for turn in turns:
+                agent._add_message(state, "user", turn)
+                state["waiting_for_input"] = False
+                timings.append(_timed(agent.agent_node, state)[0])
+    return dict(_summarize(timings), conversations=conversations, turns_per_conversation=len(turns))
+
+
+def compare(results: Dict[str, Any], baseline: Dict[str, Any], tolerance: float) -> List[Dict[str, Any]]:
+    """Per-stage median change against the baseline; regressions have 'regression': True"""
+    comparison = []
+    for stage, result in results['stages'].items():
+        previous = baseline.get('stages', {}).get(stage)
+        if not previous or not previous.get('median_ms'):
+            continue
+        change = result['median_ms'] / previous['median_ms'] - 1
+        comparison.append({
+            'stage': stage,
+            'baseline_ms': previous['median_ms'],
+            'median_ms': result['median_ms'],
+            'change': round(change, 3),
+            'regression': change > tolerance
+        })
+    return comparison
+
+
+def run(args) -> Dict[str, Any]:
+    from kg_resources import set_registry
+    from kg_drafter import MedicalKGBuilder, Neo4jConnection, Neo4jQueryBuilder
+    from standins import (CannedChatModel, FakeOllamaClient, RecordingNeo4jDriver, StandInRegistry,
+                          load_case_fixtures, load_thesis_fixture)
+
+    fixtures = load_case_fixtures()
+    thesis = load_thesis_fixture()
+    cases = [fixtures[i % len(fixtures)] for i in range(args.cases)]
+    # Distinct report texts, as in a real batch
+    reports = [f"{thesis}\n\nCase reference: {i}" for i in range(args.cases)]
+
+    llm = CannedChatModel(cases=[json.dumps(case) for case in fixtures], latency=args.llm_latency,
+                          tokens_per_second=args.llm_tokens_per_second)
+    driver = RecordingNeo4jDriver(query_latency=args.neo4j_latency)
+    registry = StandInRegistry(llm=llm, ollama=FakeOllamaClient(thesis, latency=args.llm_latency), driver=driver)
+    previous = set_registry(registry)
+
+    stages = [stage for stage in STAGES if not args.stages or stage in args.stages]
+    results: Dict[str, Any] = {}
+    try:
+        builder = MedicalKGBuilder(cache=None, llm=llm)
+        query_builder = Neo4jQueryBuilder()
+
+        for stage in stages:
+            print(f"Running {stage}...", file=sys.stderr)
+            if stage == "analyze_medical_report":
+                results[stage] = bench_analyze(builder, reports)
+            elif stage == "build_cypher_from_json":
+                results[stage] = bench_cypher(query_builder, cases)
+            elif stage == "execute_queries_batch":
+                connection = Neo4jConnection(driver=driver)
+                query_sets = [query_builder.build_cypher_from_json(case) for case in cases[:args.neo4j_cases]]
+                results[stage] = bench_execute(connection, query_sets, args.neo4j_batch_size, args.neo4j_batch_delay)
+            elif stage == "save_to_files":
+                results[stage] = bench_save(builder, cases, tuple(args.formats.split(",")) if args.formats else None)
+            else:
+                results[stage] = bench_agent(args.conversations, PATIENT_TURNS[:args.turns])
+    finally:
+        set_registry(previous)
+
+    return {
+        'python': sys.version.split()[0],
+        'platform': platform.platform(),
+        'parameters': {
+            'cases': args.cases, 'neo4j_cases': args.neo4j_cases, 'neo4j_batch_size': args.neo4j_batch_size,
+            'neo4j_batch_delay': args.neo4j_batch_delay,
+            'conversations': args.conversations, 'turns': args.turns, 'formats': args.formats,
+            'llm_latency': args.llm_latency, 'llm_tokens_per_second': args.llm_tokens_per_second,
+            'neo4j_latency': args.neo4j_latency
+        },
+        'stages': results,
+        'llm_calls': dict(llm.calls),
+        'neo4j_statements': len(driver.statements)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the KG pipeline against local stand-in services")
+    parser.add_argument("--stages", nargs="*", choices=STAGES, help="Stages to run (default: all)")
+    parser.add_argument("--cases", type=int, default=50, help="Cases replayed through analysis, Cypher and saving")
+    parser.add_argument("--neo4j-cases", type=int, default=10, help="Cases executed against the recording driver")
+    parser.add_argument("--neo4j-batch-size", type=int, default=10, help="batch_size for execute_queries_batch")
+    parser.add_argument("--neo4j-batch-delay", type=float, default=0.0,
+                        help="Pause between batches (execute_queries_batch defaults to 0.1)")
+    parser.add_argument("--conversations", type=int, default=5, help="Simulated intake conversations")
+    parser.add_argument("--turns", type=int, default=len(PATIENT_TURNS), help="Patient turns per conversation")
+    parser.add_argument("--formats", default=None, help="save_to_files formats, e.g. json,cypher,kgb")
+    parser.add_argument("--llm-latency", type=float, default=0.0, help="Simulated seconds per LLM/Ollama call")
+    parser.add_argument("--llm-tokens-per-second", type=float, default=0.0,
+                        help="Simulated generation rate (0: instant)")
+    parser.add_argument("--neo4j-latency", type=float, default=0.0, help="Simulated seconds per Cypher statement")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE, help="Baseline results file")
+    parser.add_argument("--update-baseline", action="store_true", help="Store these results as the baseline")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="Allowed slowdown against the baseline")
+    parser.add_argument("--fail-on-regression", action="store_true", help="Exit non-zero on a regression")
+    parser.add_argument("--json", default=None, help="Also write the results to this file")
+    args = parser.parse_args()
+
+    # The stand-ins and the project modules are imported from these directories
+    sys.path.insert(0, BENCHMARKS_DIR)
+    results = run(args)
+
+    print(f"{'stage':<24} {'ops':>6} {'median ms':>10} {'p95 ms':>10} {'ops/s':>10}")
+    for stage, result in results['stages'].items():
+        print(f"{stage:<24} {result['operations']:>6} {result['median_ms']:>10.3f} {result['p95_ms']:>10.3f} "
+              f"{result['throughput_per_s'] or 0:>10.1f}")
+    print(f"LLM calls: {results['llm_calls']}; Neo4j statements recorded: {results['neo4j_statements']}")
+
+    regressions = []
+    if os.path.exists(args.baseline) and not args.update_baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        if baseline.get('parameters') != results['parameters']:
+            print("Note: baseline was recorded with different parameters")
+        results['comparison'] = compare(results, baseline, args.tolerance)
+        print(f"\nAgainst baseline ({os.path.relpath(args.baseline)}):")
+        for item in results['comparison']:
+            flag = "  REGRESSION" if item['regression'] else ""
+            print(f"{item['stage']:<24} {item['baseline_ms']:>10.3f} -> {item['median_ms']:>10.3f} ms "
+                  f"({item['change']:+.1%}){flag}")
+        regressions = [item['stage'] for item in results['comparison'] if item['regression']]
+
+    if args.update_baseline:
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+        print(f"Baseline written to {args.baseline}")
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+
+    if regressions and args.fail_on_regression:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,283 @@
+"""
+Deterministic local stand-ins for the services the pipeline talks to.
+
+    CannedChatModel      LangChain chat model returning canned responses chosen by
+                         prompt (extraction, reconciliation, enhancement, intake
+                         turn, summary), with configurable latency and token rate
+    FakeOllamaClient     ollama.Client / AsyncClient look-alike whose chat() returns
+                         a fixed clinical analysis (thesis.md), optionally streamed
+    RecordingNeo4jDriver neo4j driver look-alike that records every statement and
+                         reports plausible write counters
+    StandInRegistry      kg_resources registry that hands these out, so code that
+                         asks get_registry() for clients gets the stand-ins
+
+Install with `kg_resources.set_registry(StandInRegistry(...))`. LangChain is
+still required: only the remote services are replaced.
+"""
+
+import asyncio
+import json
+import os
+import re
+import threading
+import time
+from types import SimpleNamespace
+from typing import Dict, Any, AsyncIterator, Iterator, List, Optional
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+from kg_resources import ResourceRegistry
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+INTAKE_REPLY = ("Thank you for sharing that. When did the symptoms start, and how severe are they on a "
+                "scale of 1 to 10? Is there anything else we haven't covered?")
+SUMMARY_REPLY = "Patient reports vaginal bleeding and intermittent cramps for two days, with nausea and hypertension."
+EMPTY_DELTA = json.dumps({"patient_demographics": {}, "chief_complaint": "", "entities": [], "relationships": [],
+                          "clinical_reasoning": "", "recommendations": []})
+EMPTY_ENHANCEMENT = json.dumps({"added_entities": [], "added_relationships": [], "icd_codes": []})
+
+# System prompt fragments that identify each pipeline call
+_PROMPT_KINDS = (
+    ("extract structured clinical information", "analysis"),
+    ("return ONLY what the draft is missing", "reconciliation"),
+    ("Return ONLY what the list is missing", "annotation"),
+    ("return ONLY the additions", "enhancement"),
+    ("medical intake assistant", "intake"),
+)
+
+
+def load_case_fixtures(pattern: str = r"medical_case_.*\.json$") -> List[Dict[str, Any]]:
+    """The bundled medical_case_*.json files, without their metadata"""
+    cases = []
+    for filename in sorted(os.listdir(REPO_ROOT)):
+        if re.match(pattern, filename):
+            with open(os.path.join(REPO_ROOT, filename), 'r', encoding='utf-8') as f:
+                case = json.load(f)
+            case.pop('metadata', None)
+            cases.append(case)
+    if not cases:
+        raise FileNotFoundError(f"No medical_case_*.json fixtures in {REPO_ROOT}")
+    return cases
+
+
+def load_thesis_fixture() -> str:
+    with open(os.path.join(REPO_ROOT, "thesis.md"), 'r', encoding='utf-8') as f:
+        return f.read()
+
+
+def _simulated_delay(text: str, latency: float, tokens_per_second: float) -> float:
+    # ~4 characters per token
+    return latency + (len(text) / 4 / tokens_per_second if tokens_per_second else 0.0)
+
+
+class CannedChatModel(BaseChatModel):
+    """Chat model that answers each pipeline prompt with a fixed response
+
+    Extraction prompts get the case fixtures in turn; latency is a fixed delay
+    per call plus len(response) / 4 / tokens_per_second.
+    """
+
+    cases: List[str] = []
+    latency: float = 0.0
+    tokens_per_second: float = 0.0
+    stream_chunk_chars: int = 16
+    supports_tools: bool = True
+    calls: Dict[str, int] = {}
+
+    @property
+    def _llm_type(self) -> str:
+        return "canned"
+
+    def bind_tools(self, tools, **kwargs):
+        if not self.supports_tools:
+            # Like Ollama's 400 for a model without tool support
+            raise ValueError(f"{self._llm_type} model does not support tools")
+        # Never calls tools, so the intake agent answers directly every turn
+        return self
+
+    def _respond(self, messages: List[BaseMessage]) -> str:
+        system = " ".join(m.content for m in messages if m.type == "system" and isinstance(m.content, str))
+        kind = next((kind for fragment, kind in _PROMPT_KINDS if fragment in system), "summary")
+        self.calls[kind] = self.calls.get(kind, 0) + 1
+        if kind == "analysis":
+            return self.cases[(self.calls[kind] - 1) % len(self.cases)]
+        return {
+            "reconciliation": EMPTY_DELTA,
+            "annotation": EMPTY_DELTA,
+            "enhancement": EMPTY_ENHANCEMENT,
+            "intake": INTAKE_REPLY,
+        }.get(kind, SUMMARY_REPLY)
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        text = self._respond(messages)
+        time.sleep(_simulated_delay(text, self.latency, self.tokens_per_second))
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=text))])
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        text = self._respond(messages)
+        await asyncio.sleep(_simulated_delay(text, self.latency, self.tokens_per_second))
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=text))])
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs) -> Iterator[ChatGenerationChunk]:
+        text = self._respond(messages)
+        time.sleep(self.latency)
+        for i in range(0, len(text), self.stream_chunk_chars):
+            piece = text[i:i + self.stream_chunk_chars]
+            time.sleep(_simulated_delay(piece, 0.0, self.tokens_per_second))
+            if run_manager:
+                run_manager.on_llm_new_token(piece)
+            yield ChatGenerationChunk(message=AIMessageChunk(content=piece))
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs) -> AsyncIterator[ChatGenerationChunk]:
+        # Without this LangChain runs _stream in a worker thread, so concurrent streams queue for the pool
+        text = self._respond(messages)
+        await asyncio.sleep(self.latency)
+        for i in range(0, len(text), self.stream_chunk_chars):
+            piece = text[i:i + self.stream_chunk_chars]
+            await asyncio.sleep(_simulated_delay(piece, 0.0, self.tokens_per_second))
+            if run_manager:
+                await run_manager.on_llm_new_token(piece)
+            yield ChatGenerationChunk(message=AIMessageChunk(content=piece))
+
+
+class FakeOllamaClient:
+    """chat() with the ollama client signature, returning a fixed analysis"""
+
+    def __init__(self, response: Optional[str] = None, latency: float = 0.0, stream_chunk_chars: int = 16):
+        self.response = response if response is not None else load_thesis_fixture()
+        self.latency = latency
+        self.stream_chunk_chars = stream_chunk_chars
+        self.calls = 0
+
+    @staticmethod
+    def _message(content: str):
+        return SimpleNamespace(message=SimpleNamespace(role="assistant", content=content))
+
+    def _chunks(self) -> Iterator[SimpleNamespace]:
+        for i in range(0, len(self.response), self.stream_chunk_chars):
+            yield self._message(self.response[i:i + self.stream_chunk_chars])
+
+    def chat(self, model: str, messages: List[Dict[str, str]], stream: bool = False, **kwargs):
+        self.calls += 1
+        time.sleep(self.latency)
+        return self._chunks() if stream else self._message(self.response)
+
+
+class FakeAsyncOllamaClient(FakeOllamaClient):
+    async def chat(self, model: str, messages: List[Dict[str, str]], stream: bool = False, **kwargs):
+        self.calls += 1
+        await asyncio.sleep(self.latency)
+        if not stream:
+            return self._message(self.response)
+
+        async def chunks():
+            for chunk in self._chunks():
+                yield chunk
+        return chunks()
+
+
+_NODE_WRITE = re.compile(r"(?:MERGE|CREATE) \(\w*:")
+_REL_WRITE = re.compile(r"(?:MERGE|CREATE) \(\w*\)-\[")
+
+
+class _Counters(SimpleNamespace):
+    nodes_created = 0
+    nodes_deleted = 0
+    relationships_created = 0
+    relationships_deleted = 0
+    properties_set = 0
+
+
+class _Result:
+    def __init__(self, query: str):
+        # One node or relationship per MERGE/CREATE statement, as the query builders write them
+        self._counters = _Counters(nodes_created=len(_NODE_WRITE.findall(query)),
+                                   relationships_created=len(_REL_WRITE.findall(query)))
+
+    def __iter__(self):
+        return iter(())
+
+    def data(self):
+        return []
+
+    def consume(self):
+        return SimpleNamespace(counters=self._counters)
+
+
+class _Session:
+    def __init__(self, driver: "RecordingNeo4jDriver"):
+        self.driver = driver
+
+    def run(self, query: str, parameters: Optional[Dict[str, Any]] = None, **kwargs) -> _Result:
+        return self.driver._record(query, parameters)
+
+    def execute_write(self, work, *args, **kwargs):
+        return work(self, *args, **kwargs)
+
+    execute_read = execute_write
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class RecordingNeo4jDriver:
+    """Records (query, parameters) for every statement instead of sending it"""
+
+    def __init__(self, query_latency: float = 0.0):
+        self.query_latency = query_latency
+        self.statements: List[tuple] = []
+        self._lock = threading.Lock()
+
+    def _record(self, query: str, parameters: Optional[Dict[str, Any]]) -> _Result:
+        if self.query_latency:
+            time.sleep(self.query_latency)
+        with self._lock:
+            self.statements.append((query, parameters or {}))
+        return _Result(query)
+
+    def session(self, **kwargs) -> _Session:
+        return _Session(self)
+
+    def verify_connectivity(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class StandInRegistry(ResourceRegistry):
+    """Resource registry serving the stand-ins instead of real clients"""
+
+    def __init__(self, llm: Optional[CannedChatModel] = None, ollama: Optional[FakeOllamaClient] = None,
+                 driver: Optional[RecordingNeo4jDriver] = None, local_llm: Optional[CannedChatModel] = None):
+        super().__init__()
+        self.canned_llm = llm or CannedChatModel(cases=[json.dumps(case) for case in load_case_fixtures()])
+        # The model_router local tier; the same stand-in as the large model unless given
+        self.canned_local_llm = local_llm or self.canned_llm
+        self.fake_ollama = ollama or FakeOllamaClient()
+        self.fake_async_ollama = FakeAsyncOllamaClient(self.fake_ollama.response, self.fake_ollama.latency)
+        self.driver = driver or RecordingNeo4jDriver()
+
+    def llm(self, model: str = "gpt-4", **options):
+        return self.canned_llm
+
+    def local_llm(self, model: str, **options):
+        return self.canned_local_llm
+
+    def ollama_client(self):
+        return self.fake_ollama
+
+    def async_ollama_client(self):
+        return self.fake_async_ollama
+
+    def neo4j_driver(self, *args, **kwargs):
+        return self.driver
@@ -0,0 +1,371 @@
+"""
+Local similar-case retrieval over saved knowledge graphs.
+
+Each case is encoded as a sparse tf-idf vector of its entities: the
+normalized entity name qualified by its type, and the ICD-10 code plus its
+three-character category. Similarity is cosine similarity. (A bare entity
+type feature would be in nearly every case: it adds little signal but
+makes its posting list as long as the index.)
+
+The index is an inverted index held in NumPy arrays, sorted by feature, so a
+query touches only the postings of its own features and scores every case
+with one `np.bincount`. New cases go to a small append-only delta that is
+scanned directly, and it is merged into the sorted arrays once it grows, so
+adding a case is cheap even at hundreds of thousands of cases. IDF weights
+and case norms are recomputed lazily, and only after the index changed.
+
+When given a directory, the index persists there: compacted arrays in
+`index.npz` and metadata in `index.json`, plus `delta.jsonl` with the cases
+added since the last compaction.
+"""
+
+import json
+import logging
+import math
+import os
+import threading
+from typing import Dict, Any, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from kg_drafter import _normalize_name
+
+logger = logging.getLogger(__name__)
+
+# Relative weight of each feature kind before idf
+FEATURE_WEIGHTS = {'entity': 1.0, 'icd': 1.0, 'icd_category': 0.5}
+
+# Score at most this many query x case cells at once in search_batch (float64)
+_MAX_BATCH_CELLS = 1 << 24
+
+
+def case_features(kg_json: Dict[str, Any]) -> Dict[str, float]:
+    """Sparse feature -> term weight map for a case's entities"""
+    features: Dict[str, float] = {}
+
+    def add(feature: str, weight: float):
+        features[feature] = features.get(feature, 0.0) + weight
+
+    for entity in kg_json.get('entities', []):
+        entity_type = _normalize_name(entity.get('type', '')).replace(' ', '_')
+        add(f"entity:{entity_type}:{_normalize_name(entity['name'])}", FEATURE_WEIGHTS['entity'])
+
+        icd_code = (entity.get('icd_code') or entity.get('properties', {}).get('icd_code') or "").strip().upper()
+        if icd_code:
+            add(f"icd:{icd_code}", FEATURE_WEIGHTS['icd'])
+            add(f"icd3:{icd_code[:3]}", FEATURE_WEIGHTS['icd_category'])
+
+    # Sublinear term frequency, so a repeated ICD category doesn't drown out specific entities
+    return {feature: 1.0 + math.log(weight) if weight > 1.0 else weight for feature, weight in features.items()}
+
+
+class CaseIndex:
+    """Incremental tf-idf inverted index over cases with batched top-k cosine search"""
+
+    def __init__(self, index_dir: Optional[str] = None, compact_every: int = 2048):
+        self.index_dir = index_dir
+        self.compact_every = compact_every
+        self._lock = threading.RLock()
+
+        self.case_ids: List[str] = []
+        self.case_rows: Dict[str, int] = {}
+        self.vocabulary: Dict[str, int] = {}
+
+        # Compacted postings, sorted by feature: feature_offsets[f]:feature_offsets[f+1] index into
+        # posting_cases/posting_weights
+        self.feature_offsets = np.zeros(1, dtype=np.int64)
+        self.posting_cases = np.zeros(0, dtype=np.int32)
+        self.posting_weights = np.zeros(0, dtype=np.float32)
+
+        # Cases added since the last compaction, as parallel lists of (case row, feature, weight)
+        self._delta_cases: List[int] = []
+        self._delta_features: List[int] = []
+        self._delta_weights: List[float] = []
+        self._delta_added = 0
+        self._delta_log = None
+
+        # Derived from the postings; rebuilt on the next search after any change
+        self._idf: Optional[np.ndarray] = None
+        self._norms: Optional[np.ndarray] = None
+
+        if index_dir:
+            os.makedirs(index_dir, exist_ok=True)
+            self._load()
+
+    def __len__(self) -> int:
+        return len(self.case_ids)
+
+    # --- building -------------------------------------------------------
+
+    def add(self, case_id: str, kg_json: Dict[str, Any]):
+        """Add (or, for a known case id, re-add) a case"""
+        self.add_features(case_id, case_features(kg_json))
+
+    def add_features(self, case_id: str, features: Dict[str, float], _log: bool = True):
+        with self._lock:
+            row = self.case_rows.get(case_id)
+            if row is not None:
+                # Re-adding replaces the case: drop its old postings first
+                self._remove_row(row)
+            else:
+                row = self.case_rows[case_id] = len(self.case_ids)
+                self.case_ids.append(case_id)
+
+            for feature, weight in features.items():
+                feature_id = self.vocabulary.get(feature)
+                if feature_id is None:
+                    feature_id = self.vocabulary[feature] = len(self.vocabulary)
+                self._delta_cases.append(row)
+                self._delta_features.append(feature_id)
+                self._delta_weights.append(weight)
+
+            self._idf = self._norms = None
+            self._delta_added += 1
+            if _log and self.index_dir:
+                self._append_log(case_id, features)
+            if self._delta_added >= self.compact_every:
+                self.compact()
+
+    def add_many(self, cases: Iterable[Tuple[str, Dict[str, Any]]]):
+        """Add (case_id, kg_json) pairs"""
+        for case_id, kg_json in cases:
+            self.add(case_id, kg_json)
+
+    def _remove_row(self, row: int):
+        keep = self.posting_cases != row
+        if not keep.all():
+            features = np.repeat(np.arange(len(self.feature_offsets) - 1), np.diff(self.feature_offsets))
+            counts = np.bincount(features[keep], minlength=len(self.feature_offsets) - 1)
+            self.feature_offsets = np.concatenate(([0], np.cumsum(counts))).astype(np.int64)
+            self.posting_cases = self.posting_cases[keep]
+            self.posting_weights = self.posting_weights[keep]
+
+        kept = [i for i, case in enumerate(self._delta_cases) if case != row]
+        if len(kept) != len(self._delta_cases):
+            self._delta_cases = [self._delta_cases[i] for i in kept]
+            self._delta_features = [self._delta_features[i] for i in kept]
+            self._delta_weights = [self._delta_weights[i] for i in kept]
+
+    def compact(self):
+        """Merge the delta into the sorted postings (and persist them)"""
+        with self._lock:
+            if self._delta_cases:
+                features = np.repeat(
+                    np.arange(len(self.feature_offsets) - 1, dtype=np.int64), np.diff(self.feature_offsets)
+                )
+                features = np.concatenate((features, np.asarray(self._delta_features, dtype=np.int64)))
+                cases = np.concatenate((self.posting_cases, np.asarray(self._delta_cases, dtype=np.int32)))
+                weights = np.concatenate((self.posting_weights, np.asarray(self._delta_weights, dtype=np.float32)))
+
+                order = np.lexsort((cases, features))
+                self.posting_cases = cases[order]
+                self.posting_weights = weights[order]
+                counts = np.bincount(features, minlength=len(self.vocabulary))
+                self.feature_offsets = np.concatenate(([0], np.cumsum(counts))).astype(np.int64)
+
+                self._delta_cases, self._delta_features, self._delta_weights = [], [], []
+                self._delta_added = 0
+
+            if self.index_dir:
+                self._save()
+
+    # --- searching ------------------------------------------------------
+
+    def _refresh(self):
+        """Recompute idf weights and case norms after the index changed"""
+        if self._idf is not None:
+            return
+        if len(self.feature_offsets) - 1 < len(self.vocabulary):
+            # Features first seen in the delta have no compacted postings yet
+            padding = len(self.vocabulary) - (len(self.feature_offsets) - 1)
+            self.feature_offsets = np.concatenate(
+                (self.feature_offsets, np.full(padding, self.feature_offsets[-1], dtype=np.int64))
+            )
+
+        document_frequency = np.diff(self.feature_offsets).astype(np.float64)
+        if self._delta_features:
+            document_frequency += np.bincount(self._delta_features, minlength=len(self.vocabulary))
+        case_count = max(len(self.case_ids), 1)
+        self._idf = np.log((1 + case_count) / (1 + document_frequency)) + 1.0
+
+        features = np.repeat(np.arange(len(self.vocabulary)), np.diff(self.feature_offsets))
+        squares = np.bincount(
+            self.posting_cases, (self.posting_weights * self._idf[features]) ** 2, minlength=len(self.case_ids)
+        ).astype(np.float64)
+        if self._delta_cases:
+            delta_features = np.asarray(self._delta_features)
+            squares += np.bincount(
+                self._delta_cases, (np.asarray(self._delta_weights) * self._idf[delta_features]) ** 2,
+                minlength=len(self.case_ids)
+            )
+        self._norms = np.sqrt(squares)
+        self._norms[self._norms == 0] = 1.0
+
+    def _query_vector(self, features: Dict[str, float]) -> Tuple[np.ndarray, np.ndarray]:
+        """(feature ids, idf-weighted and normalized values) of the query's known features"""
+        pairs = [(self.vocabulary[f], w) for f, w in features.items() if f in self.vocabulary]
+        if not pairs:
+            return np.zeros(0, dtype=np.int64), np.zeros(0)
+        feature_ids = np.asarray([f for f, _ in pairs], dtype=np.int64)
+        values = np.asarray([w for _, w in pairs]) * self._idf[feature_ids]
+        # Unknown features still count towards the query norm
+        norm = math.sqrt(float(values @ values) + sum(w * w for f, w in features.items() if f not in self.vocabulary))
+        return feature_ids, values / (norm or 1.0)
+
+    def _score_chunk(self, queries: List[Tuple[np.ndarray, np.ndarray]]) -> np.ndarray:
+        """Cosine scores of a chunk of queries against every case, shape (len(queries), cases)"""
+        case_count = len(self.case_ids)
+        rows, weights = [], []
+        delta_cases = np.asarray(self._delta_cases, dtype=np.int64)
+        delta_features = np.asarray(self._delta_features, dtype=np.int64)
+        delta_weights = np.asarray(self._delta_weights)
+
+        for q, (feature_ids, values) in enumerate(queries):
+            if not len(feature_ids):
+                continue
+            # Postings of the query's features in the compacted arrays
+            starts = self.feature_offsets[feature_ids]
+            lengths = self.feature_offsets[feature_ids + 1] - starts
+            positions = np.repeat(starts - np.cumsum(lengths) + lengths, lengths) + np.arange(lengths.sum())
+            rows.append(q * case_count + self.posting_cases[positions].astype(np.int64))
+            weights.append(self.posting_weights[positions] * np.repeat(values * self._idf[feature_ids], lengths))
+
+            if len(delta_cases):
+                query_values = np.zeros(len(self.vocabulary))
+                query_values[feature_ids] = values * self._idf[feature_ids]
+                contribution = delta_weights * query_values[delta_features]
+                hit = contribution != 0
+                rows.append(q * case_count + delta_cases[hit])
+                weights.append(contribution[hit])
+
+        if not rows:
+            return np.zeros((len(queries), case_count))
+        scores = np.bincount(np.concatenate(rows), np.concatenate(weights), minlength=len(queries) * case_count)
+        return scores.reshape(len(queries), case_count) / self._norms
+
+    def search_features_batch(self, queries: List[Dict[str, float]], k: int = 5,
+                              exclude: Optional[List[Optional[str]]] = None) -> List[List[Tuple[str, float]]]:
+        """Top-k (case_id, score) per query feature map, best first"""
+        with self._lock:
+            if not self.case_ids:
+                return [[] for _ in queries]
+            self._refresh()
+
+            vectors = [self._query_vector(features) for features in queries]
+            chunk = max(1, _MAX_BATCH_CELLS // len(self.case_ids))
+            results = []
+            for start in range(0, len(vectors), chunk):
+                scores = self._score_chunk(vectors[start:start + chunk])
+                for offset, row in enumerate(scores):
+                    excluded = exclude[start + offset] if exclude else None
+                    if excluded in self.case_rows:
+                        row[self.case_rows[excluded]] = -1.0
+                    top = min(k, len(row))
+                    best = np.argpartition(-row, top - 1)[:top]
+                    best = best[np.argsort(-row[best], kind='stable')]
+                    results.append([(self.case_ids[i], float(row[i])) for i in best if row[i] > 0])
+            return results
+
+    def search_batch(self, cases: List[Dict[str, Any]], k: int = 5) -> List[List[Tuple[str, float]]]:
+        """Top-k similar cases for each KG JSON document (a document never matches itself)"""
+        return self.search_features_batch(
+            [case_features(kg_json) for kg_json in cases], k,
+            exclude=[kg_json.get('metadata', {}).get('case_id') for kg_json in cases]
+        )
+
+    def search(self, kg_json: Dict[str, Any], k: int = 5) -> List[Tuple[str, float]]:
+        """Top-k (case_id, score) most similar to a KG JSON document"""
+        return self.search_batch([kg_json], k)[0]
+
+    # --- persistence ----------------------------------------------------
+
+    def _paths(self) -> Tuple[str, str, str]:
+        return (os.path.join(self.index_dir, "index.npz"), os.path.join(self.index_dir, "index.json"),
+                os.path.join(self.index_dir, "delta.jsonl"))
+
+    def _append_log(self, case_id: str, features: Dict[str, float]):
+        if self._delta_log is None:
+            self._delta_log = open(self._paths()[2], 'a', encoding='utf-8')
+        self._delta_log.write(json.dumps({'id': case_id, 'features': features}, ensure_ascii=False) + "\n")
+        self._delta_log.flush()
+
+    def _save(self):
+        arrays_path, meta_path, log_path = self._paths()
+        # Write-then-rename, so a crash leaves the previous snapshot plus its delta log intact
+        np.savez(arrays_path + ".tmp.npz", feature_offsets=self.feature_offsets,
+                 posting_cases=self.posting_cases, posting_weights=self.posting_weights)
+        with open(meta_path + ".tmp", 'w', encoding='utf-8') as f:
+            json.dump({'case_ids': self.case_ids, 'vocabulary': list(self.vocabulary)}, f, ensure_ascii=False)
+        os.replace(arrays_path + ".tmp.npz", arrays_path)
+        os.replace(meta_path + ".tmp", meta_path)
+
+        if self._delta_log is not None:
+            self._delta_log.close()
+            self._delta_log = None
+        open(log_path, 'w').close()
+
+    def _load(self):
+        arrays_path, meta_path, log_path = self._paths()
+        if os.path.exists(arrays_path) and os.path.exists(meta_path):
+            with open(meta_path, 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+            self.case_ids = meta['case_ids']
+            self.case_rows = {case_id: row for row, case_id in enumerate(self.case_ids)}
+            self.vocabulary = {feature: i for i, feature in enumerate(meta['vocabulary'])}
+            with np.load(arrays_path) as arrays:
+                self.feature_offsets = arrays['feature_offsets']
+                self.posting_cases = arrays['posting_cases']
+                self.posting_weights = arrays['posting_weights']
+
+        replayed = 0
+        if os.path.exists(log_path):
+            with open(log_path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        # A crash mid-write can leave a truncated last line
+                        continue
+                    self.add_features(entry['id'], entry['features'], _log=False)
+                    replayed += 1
+        logger.info(f"Loaded case index with {len(self.case_ids)} cases ({replayed} from the delta log)")
+
+    def close(self):
+        """Compact and persist the index"""
+        self.compact()
+        if self._delta_log is not None:
+            self._delta_log.close()
+            self._delta_log = None
+
+
+def build_index(sources: Iterable[str], index_dir: Optional[str] = None) -> CaseIndex:
+    """Index saved case files (.json or .kgb), glob patterns or directories"""
+    from kg_artifact import load_artifact
+    from kg_export import iter_case_files
+
+    index = CaseIndex(index_dir)
+    for path in iter_case_files(sources):
+        if path.endswith(".kgb"):
+            kg_json = load_artifact(path)
+        else:
+            with open(path, 'r', encoding='utf-8') as f:
+                kg_json = json.load(f)
+        index.add(kg_json['metadata']['case_id'], kg_json)
+    index.compact()
+    return index
+
+
+_default_index: Optional[CaseIndex] = None
+_default_index_lock = threading.Lock()
+
+
+def default_case_index() -> Optional[CaseIndex]:
+    """Index in KG_CASE_INDEX_DIR, or None when the index is not enabled"""
+    global _default_index
+    index_dir = os.getenv('KG_CASE_INDEX_DIR')
+    if not index_dir:
+        return None
+    with _default_index_lock:
+        if _default_index is None:
+            _default_index = CaseIndex(index_dir)
+        return _default_index
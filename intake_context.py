@@ -0,0 +1,152 @@
+"""
+Token-budgeted context windowing for the intake conversation.
+
+Recent turns are sent verbatim; once the history outgrows the token budget the
+oldest turns are folded into a rolling summary kept in the AgentState. The
+summary is only updated when more turns are evicted, so most turns cost no
+extra LLM call, and every prompt stays within the budget however long the
+intake runs.
+"""
+
+import logging
+from typing import Dict, Any, List, Optional
+
+from langchain_core.messages import BaseMessage, SystemMessage
+
+logger = logging.getLogger(__name__)
+
+SUMMARY_SYSTEM_PROMPT = """You maintain a running clinical summary of a medical intake conversation.
+Merge the new turns into the existing summary. Keep every clinically relevant fact:
+symptoms with onset, duration, severity and aggravating/alleviating factors, medications,
+medical and pregnancy history, and the patient's answers to questions asked.
+Write concise notes. Do not add interpretation or advice."""
+
+
+def _count_tokens_fallback(text: str) -> int:
+    # ~4 characters per token for English text
+    return len(text) // 4 + 1
+
+
+def _load_token_counter(model_name: str):
+    """tiktoken counter for the model, or a character-based estimate without tiktoken"""
+    try:
+        import tiktoken
+        encoding = tiktoken.encoding_for_model(model_name)
+    except Exception:
+        return _count_tokens_fallback
+    return lambda text: len(encoding.encode(text))
+
+
+class ConversationContext:
+    """Builds a budgeted chat history: rolling summary of old turns + recent turns verbatim
+
+    All bookkeeping lives in the state dict (context_summary, summarized_upto,
+    message_tokens, context_stats), so one instance can serve many sessions.
+    """
+
+    def __init__(self, llm=None, token_budget: int = 3000, keep_ratio: float = 0.75,
+                 model_name: str = "gpt-4"):
+        self.llm = llm
+        self.token_budget = token_budget
+        # After folding, keep the window at this fraction of the budget so the
+        # summary is not rewritten on every subsequent turn
+        self.keep_ratio = keep_ratio
+        self.count_tokens = _load_token_counter(model_name)
+
+    def _message_tokens(self, state: Dict[str, Any]) -> List[int]:
+        """Per-message token counts, extended incrementally for new messages"""
+        tokens = state.setdefault("message_tokens", [])
+        stats = self._stats(state)
+        for msg in state["messages"][len(tokens):]:
+            count = self.count_tokens(msg["content"])
+            tokens.append(count)
+            stats["history_tokens"] += count
+        return tokens
+
+    @staticmethod
+    def _stats(state: Dict[str, Any]) -> Dict[str, int]:
+        return state.setdefault("context_stats", {
+            "calls": 0,
+            "history_tokens": 0,
+            "tokens_sent": 0,
+            "tokens_saved": 0,
+            "summary_updates": 0
+        })
+
+    def _eviction_point(self, state: Dict[str, Any]) -> Optional[int]:
+        """Index up to which turns must be folded into the summary, or None if within budget"""
+        tokens = self._message_tokens(state)
+        start = state.get("summarized_upto", 0)
+        summary_tokens = self.count_tokens(state.get("context_summary") or "")
+
+        # The window is bounded by the budget, so this sum does not grow with the history
+        verbatim = sum(tokens[start:])
+        if verbatim + summary_tokens <= self.token_budget:
+            return None
+
+        target = self.token_budget * self.keep_ratio - summary_tokens
+        end = start
+        # Always keep the latest message (the turn being answered) verbatim
+        while end < len(tokens) - 1 and verbatim > target:
+            verbatim -= tokens[end]
+            end += 1
+        return end if end > start else None
+
+    def _summary_messages(self, summary: str, evicted: List[Dict[str, str]]):
+        turns = "\n".join(
+            f"{'Patient' if msg['role'] == 'user' else 'Doctor'}: {msg['content']}" for msg in evicted
+        )
+        return [
+            ("system", SUMMARY_SYSTEM_PROMPT),
+            ("human", f"Existing summary:\n{summary or '(none yet)'}\n\nNew turns:\n{turns}")
+        ]
+
+    def _fold(self, state: Dict[str, Any], end: int, new_summary: str):
+        state["context_summary"] = new_summary
+        state["summarized_upto"] = end
+        self._stats(state)["summary_updates"] += 1
+        logger.info(f"Folded conversation up to message {end} into the rolling summary")
+
+    def window(self, state: Dict[str, Any]) -> List[BaseMessage]:
+        """Chat history to send this turn, folding old turns into the summary if needed"""
+        end = self._eviction_point(state)
+        if end is not None:
+            start = state.get("summarized_upto", 0)
+            response = self.llm.invoke(
+                self._summary_messages(state.get("context_summary", ""), state["messages"][start:end])
+            )
+            self._fold(state, end, response.content)
+        return self._assemble(state)
+
+    async def awindow(self, state: Dict[str, Any]) -> List[BaseMessage]:
+        """Async version of window"""
+        end = self._eviction_point(state)
+        if end is not None:
+            start = state.get("summarized_upto", 0)
+            response = await self.llm.ainvoke(
+                self._summary_messages(state.get("context_summary", ""), state["messages"][start:end])
+            )
+            self._fold(state, end, response.content)
+        return self._assemble(state)
+
+    def _assemble(self, state: Dict[str, Any]) -> List[BaseMessage]:
+        start = state.get("summarized_upto", 0)
+        summary = state.get("context_summary")
+        history = state["chat_history"][start:]
+        sent = sum(state["message_tokens"][start:])
+
+        if summary:
+            history = [SystemMessage(content=f"Summary of the earlier conversation:\n{summary}")] + history
+            sent += self.count_tokens(summary)
+
+        self.record_call(state, sent)
+        return history
+
+    def record_call(self, state: Dict[str, Any], tokens_sent: int):
+        """Account for one LLM call that sent `tokens_sent` history tokens instead of the full history"""
+        stats = self._stats(state)
+        saved = max(0, stats["history_tokens"] - tokens_sent)
+        stats["calls"] += 1
+        stats["tokens_sent"] += tokens_sent
+        stats["tokens_saved"] += saved
+        logger.info(f"Context window: sent {tokens_sent} of {stats['history_tokens']} history tokens (saved {saved})")
@@ -0,0 +1,585 @@
+"""
+HTTP server hosting many concurrent intake sessions in one process.
+
+Each session keeps its own AgentState in memory. A patient turn is a request;
+it runs the compiled per-turn graph (agent.get_turn_workflow) on the event loop,
+so no thread blocks on input() and thousands of idle sessions cost only their state.
+
+    POST   /sessions                  start a session            -> {"session_id": ...}
+    POST   /sessions/<id>/turns       {"message": "..."}         -> {"reply", "done", "diagnosis", ...}
+    POST   /sessions/<id>/resume      finish a turn interrupted by a crash or restart
+    GET    /sessions/<id>             transcript and status
+    DELETE /sessions/<id>             end a session
+    GET    /health                    session and turn counts
+    GET    /metrics                   kg_metrics in Prometheus text format
+
+Every turn makes at least one LLM call, so turns are admitted through a
+TurnLimiter: at most max_concurrent_turns run at once, up to max_queued_turns
+wait for a slot, and anything beyond that is refused with 503 and Retry-After
+instead of piling up latency. A session runs one turn at a time (409 otherwise).
+
+Sessions are checkpointed after every graph node to the session store
+(--session-store, default INTAKE_SESSION_STORE or intake_sessions.db). Sessions
+idle for --idle-timeout seconds leave memory and are reloaded on their next
+request, also after a restart. The checkpoint of a completed session is deleted
+once its diagnosis is returned (--completed-retention keeps it for a while).
+
+Usage:
+    python intake_server.py --port 8080 --max-concurrent-turns 32
+"""
+
+import argparse
+import asyncio
+import contextlib
+import http
+import json
+import logging
+import re
+import time
+from dataclasses import dataclass, field
+from typing import Dict, Any, Optional, Tuple
+
+from kg_metrics import METRICS, render_prometheus, span
+from session_store import (
+    SessionCheckpoint, SessionStore, completed_retention, default_session_store, open_session_store
+)
+
+logger = logging.getLogger(__name__)
+
+MAX_HEADER_LINES = 100
+MAX_BODY_BYTES = 64 * 1024
+KEEP_ALIVE_TIMEOUT = 30.0
+
+_SESSION_PATH = re.compile(r"^/sessions/([\w-]+)(?:/(turns|resume))?$")
+
+
+class HTTPError(Exception):
+    def __init__(self, status: int, message: str, headers: Optional[Dict[str, str]] = None):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+        self.headers = headers or {}
+
+
+class ServerBusy(Exception):
+    """Raised when a turn cannot even be queued"""
+
+
+class TurnLimiter:
+    """Bounds concurrent turns, with a bounded wait queue in front"""
+
+    def __init__(self, max_concurrent: int, max_queued: int):
+        self.max_concurrent = max_concurrent
+        self.max_queued = max_queued
+        self.active = 0
+        self.peak_active = 0
+        self.waiting = 0
+        self._slots = asyncio.Semaphore(max_concurrent)
+
+    @contextlib.asynccontextmanager
+    async def slot(self):
+        if self._slots.locked() and self.waiting >= self.max_queued:
+            raise ServerBusy(f"{self.active} turns running and {self.waiting} queued")
+        self.waiting += 1
+        try:
+            await self._slots.acquire()
+        finally:
+            self.waiting -= 1
+        self.active += 1
+        self.peak_active = max(self.peak_active, self.active)
+        try:
+            yield
+        finally:
+            self.active -= 1
+            self._slots.release()
+
+
+def _snapshot(state: Dict[str, Any]) -> Dict[str, Any]:
+    """Copy of a state that the turn's in-place list and dict updates (e.g. context_stats) do not reach"""
+    return {key: list(value) if isinstance(value, list) else dict(value) if isinstance(value, dict) else value
+            for key, value in state.items()}
+
+
+@dataclass
+class IntakeSession:
+    state: Dict[str, Any]
+    created_at: float = field(default_factory=time.time)
+    last_active: float = field(default_factory=time.time)
+    node: Optional[str] = None  # Last completed (and checkpointed) node
+    step: int = 0
+    lock: asyncio.Lock = field(default_factory=asyncio.Lock)
+
+    @property
+    def done(self) -> bool:
+        return self.state.get("diagnosis") is not None
+
+    @property
+    def turns(self) -> int:
+        return sum(1 for m in self.state["messages"] if m["role"] == "user")
+
+
+class IntakeSessionManager:
+    """Sessions and the turn logic, independent of the HTTP layer
+
+    With a store (see session_store) every session is checkpointed when it is
+    created, when a patient message is added and after each graph node. Sessions
+    idle for idle_timeout seconds are dropped from memory (evict_idle) and
+    rehydrated from their checkpoint on their next request; when max_sessions are
+    in memory the least recently active idle session makes room. A turn that
+    stopped mid-way (e.g. the process died during the LLM call) is completed with
+    resume(), which continues at the pending node. Without a store, sessions live
+    in memory until closed.
+
+    The checkpoint of a completed session is deleted when the diagnosis is
+    returned, or with completed_retention > 0 pruned that many seconds later
+    (prune_completed); a negative completed_retention keeps it.
+    """
+
+    def __init__(self, max_sessions: int = 10000, max_concurrent_turns: int = 32, max_queued_turns: int = 256,
+                 store: Optional[SessionStore] = None, idle_timeout: float = 900.0,
+                 completed_retention: float = 0.0):
+        self.max_sessions = max_sessions
+        self.limiter = TurnLimiter(max_concurrent_turns, max_queued_turns)
+        self.store = store
+        self.idle_timeout = idle_timeout
+        self.completed_retention = completed_retention
+        self.sessions: Dict[str, IntakeSession] = {}
+        self.stats = {'sessions_started': 0, 'turns': 0, 'turns_failed': 0, 'turns_rejected': 0,
+                      'diagnoses': 0, 'evicted': 0, 'rehydrated': 0}
+        self._workflow = None
+
+    @property
+    def workflow(self):
+        """The compiled per-turn graph, checkpointing after every node when there is a store"""
+        if self._workflow is None:
+            import agent
+            self._workflow = agent.build_turn_graph(checkpoint=self._checkpoint if self.store else None).compile()
+        return self._workflow
+
+    async def _checkpoint(self, node: str, state: Dict[str, Any]):
+        session = self.sessions.get(state["session_id"])
+        if session is not None:
+            await self._save(session, node, state)
+
+    async def _save(self, session: IntakeSession, node: Optional[str], state: Optional[Dict[str, Any]] = None):
+        import agent
+        if self.store is None:
+            return
+        state = session.state if state is None else state
+        session.node = node
+        session.step += 1
+        # The checkpoint is a copy taken on the event loop; the (blocking) write runs in a thread
+        checkpoint = SessionCheckpoint.from_state(state, node, agent.pending_node(state), session.step)
+        await asyncio.to_thread(self.store.save, checkpoint)
+
+    def _make_room(self):
+        if len(self.sessions) < self.max_sessions:
+            return
+        idle = [session_id for session_id, s in self.sessions.items() if not s.lock.locked()]
+        if self.store is None or not idle:
+            raise HTTPError(503, f"Session limit of {self.max_sessions} reached", {'Retry-After': "30"})
+        self._evict(min(idle, key=lambda session_id: self.sessions[session_id].last_active))
+
+    def _evict(self, session_id: str):
+        import agent
+        del self.sessions[session_id]
+        # The speculative draft is not checkpointed; reconciliation covers what it would have added
+        extractor = agent._draft_extractors.pop(session_id, None)
+        if extractor is not None:
+            extractor.discard()
+        self.stats['evicted'] += 1
+
+    def evict_idle(self) -> int:
+        """Drop sessions idle for longer than idle_timeout from memory (their checkpoints stay)"""
+        if self.store is None:
+            return 0
+        cutoff = time.time() - self.idle_timeout
+        idle = [session_id for session_id, s in self.sessions.items()
+                if s.last_active < cutoff and not s.lock.locked()]
+        for session_id in idle:
+            self._evict(session_id)
+        if idle:
+            logger.info(f"Evicted {len(idle)} idle sessions; {len(self.sessions)} in memory")
+        return len(idle)
+
+    def prune_completed(self) -> int:
+        """Delete checkpoints of sessions completed more than completed_retention seconds ago"""
+        if self.store is None or self.completed_retention <= 0:
+            return 0
+        deleted = self.store.prune_completed(self.completed_retention)
+        if deleted:
+            logger.info(f"Pruned {deleted} completed session checkpoints")
+        return deleted
+
+    async def create(self) -> str:
+        import agent
+        self._make_room()
+        state = agent.initialize_state()
+        session = self.sessions[state["session_id"]] = IntakeSession(state)
+        await self._save(session, None)
+        self.stats['sessions_started'] += 1
+        return state["session_id"]
+
+    def get(self, session_id: str) -> IntakeSession:
+        """The session, rehydrated from its checkpoint if it is not in memory"""
+        import agent
+        session = self.sessions.get(session_id)
+        if session is not None:
+            return session
+
+        checkpoint = self.store.load(session_id) if self.store is not None else None
+        if checkpoint is None:
+            raise HTTPError(404, f"Unknown session {session_id}")
+        self._make_room()
+        session = self.sessions[session_id] = IntakeSession(agent.restore_state(checkpoint.state),
+                                                            node=checkpoint.node, step=checkpoint.step)
+        self.stats['rehydrated'] += 1
+        return session
+
+    def close(self, session_id: str):
+        self.get(session_id)
+        self._evict(session_id)
+        self.stats['evicted'] -= 1
+        if self.store is not None:
+            self.store.delete(session_id)
+
+    @staticmethod
+    def _pending(session: IntakeSession) -> Optional[str]:
+        """Node an unfinished turn stopped before, or None"""
+        import agent
+        node = agent.pending_node(session.state)
+        return node if node not in (None, "user_input") else None
+
+    async def take_turn(self, session_id: str, message: str) -> Dict[str, Any]:
+        """Add the patient's message, run the turn graph and return the assistant's reply"""
+        import agent
+        session = self.get(session_id)
+        if session.done:
+            raise HTTPError(409, "The intake for this session is complete")
+        if session.lock.locked():
+            raise HTTPError(409, "A turn is already in progress for this session")
+        if self._pending(session):
+            raise HTTPError(409, f"The previous turn did not finish; POST /sessions/{session_id}/resume to complete it")
+
+        async with session.lock:
+            snapshot = _snapshot(session.state)
+            node = session.node
+            try:
+                async with self.limiter.slot():
+                    with span("intake_turn"):
+                        agent.add_patient_turn(session.state, message)
+                        await self._save(session, "user_input")
+                        result = await self.workflow.ainvoke(session.state)
+            except ServerBusy as e:
+                self.stats['turns_rejected'] += 1
+                METRICS.inc('kg_intake_turns_total', help="Intake turns", outcome="rejected")
+                raise HTTPError(503, f"Server busy: {e}", {'Retry-After': "1"})
+            except Exception as e:
+                # Roll the patient message back so the turn can be retried
+                logger.error(f"Turn failed for session {session_id}: {e}")
+                session.state = snapshot
+                await self._save(session, node)
+                self.stats['turns_failed'] += 1
+                METRICS.inc('kg_intake_turns_total', help="Intake turns", outcome="failed")
+                raise HTTPError(500, f"Turn failed: {e}")
+
+            self._finish_turn(session, result)
+
+        return self._turn_response(session)
+
+    async def resume(self, session_id: str) -> Dict[str, Any]:
+        """Complete a turn that stopped mid-way, continuing at its pending node"""
+        session = self.get(session_id)
+        if session.lock.locked():
+            raise HTTPError(409, "A turn is already in progress for this session")
+        if not self._pending(session):
+            return self._turn_response(session)
+
+        async with session.lock:
+            try:
+                async with self.limiter.slot():
+                    with span("intake_turn"):
+                        result = await self.workflow.ainvoke(session.state)
+            except ServerBusy as e:
+                self.stats['turns_rejected'] += 1
+                raise HTTPError(503, f"Server busy: {e}", {'Retry-After': "1"})
+            except Exception as e:
+                # The checkpoint still points at the pending node, so the resume can be retried
+                logger.error(f"Resume failed for session {session_id}: {e}")
+                self.stats['turns_failed'] += 1
+                raise HTTPError(500, f"Resume failed: {e}")
+
+            self._finish_turn(session, result)
+
+        return self._turn_response(session)
+
+    def _finish_turn(self, session: IntakeSession, result: Dict[str, Any]):
+        session.state.update(result)
+        session.last_active = time.time()
+        self.stats['turns'] += 1
+        METRICS.inc('kg_intake_turns_total', help="Intake turns", outcome="ok")
+        if session.done:
+            self.stats['diagnoses'] += 1
+            # Nothing left to resume; the reply carries the diagnosis and knowledge graph
+            if self.store is not None and self.completed_retention == 0:
+                self.store.delete(session.state["session_id"])
+
+    @staticmethod
+    def _turn_response(session: IntakeSession) -> Dict[str, Any]:
+        state = session.state
+        replies = [m["content"] for m in state["messages"] if m["role"] == "assistant"]
+        response = {
+            'session_id': state["session_id"],
+            'reply': replies[-1] if replies else None,
+            'done': session.done,
+            'turns': session.turns
+        }
+        if session.done:
+            response['diagnosis'] = state["diagnosis"]
+            response['knowledge_graph'] = state.get("knowledge_graph")
+        return response
+
+    def describe(self, session_id: str) -> Dict[str, Any]:
+        session = self.get(session_id)
+        return {
+            'session_id': session_id,
+            'messages': session.state["messages"],
+            'done': session.done,
+            'diagnosis': session.state.get("diagnosis"),
+            'turns': session.turns,
+            'last_node': session.node,
+            'pending_node': self._pending(session),
+            'created_at': session.created_at,
+            'last_active': session.last_active
+        }
+
+    def health(self) -> Dict[str, Any]:
+        from model_router import default_model_router
+        health = dict(self.stats, sessions=len(self.sessions), turns_running=self.limiter.active,
+                      turns_queued=self.limiter.waiting, peak_turns_running=self.limiter.peak_active)
+        router = default_model_router()
+        if router is not None:
+            health['routing'] = router.stats()
+        return health
+
+
+class IntakeServer:
+    """Minimal HTTP/1.1 JSON front end for an IntakeSessionManager (keep-alive, no chunked bodies)"""
+
+    def __init__(self, manager: IntakeSessionManager, host: str = "127.0.0.1", port: int = 8080):
+        self.manager = manager
+        self.host = host
+        self.port = port
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._evictor: Optional[asyncio.Task] = None
+
+    async def start(self) -> Tuple[str, int]:
+        """Start listening; returns the bound (host, port), so port=0 picks a free port"""
+        self._server = await asyncio.start_server(self._handle_connection, self.host, self.port,
+                                                  limit=MAX_BODY_BYTES, backlog=1024)
+        self.host, self.port = self._server.sockets[0].getsockname()[:2]
+        if self.manager.store is not None:
+            self._evictor = asyncio.create_task(self._evict_idle_sessions())
+        logger.info(f"Intake server listening on http://{self.host}:{self.port}")
+        return self.host, self.port
+
+    async def serve_forever(self):
+        if self._server is None:
+            await self.start()
+        try:
+            async with self._server:
+                await self._server.serve_forever()
+        finally:
+            await self.close()
+
+    async def _evict_idle_sessions(self):
+        interval = max(1.0, min(60.0, self.manager.idle_timeout / 2))
+        while True:
+            await asyncio.sleep(interval)
+            self.manager.evict_idle()
+            await asyncio.to_thread(self.manager.prune_completed)
+
+    async def close(self):
+        from kg_resources import get_registry
+        if self._evictor is not None:
+            self._evictor.cancel()
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+        # Async clients are bound to this event loop, which is about to stop
+        await get_registry().aclose()
+
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                try:
+                    request = await asyncio.wait_for(self._read_request(reader), KEEP_ALIVE_TIMEOUT)
+                except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError):
+                    return
+                except HTTPError as e:
+                    writer.write(_response(e.status, {'error': e.message}, e.headers, keep_alive=False))
+                    await writer.drain()
+                    return
+                if request is None:
+                    return
+
+                method, path, headers, body = request
+                keep_alive = headers.get('connection', '').lower() != 'close'
+                status, payload, extra_headers = await self._dispatch(method, path, body)
+                writer.write(_response(status, payload, extra_headers, keep_alive))
+                await writer.drain()
+                if not keep_alive:
+                    return
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+            # On shutdown the connection task is cancelled while closing
+            with contextlib.suppress(ConnectionError, asyncio.CancelledError):
+                await writer.wait_closed()
+
+    @staticmethod
+    async def _read_line(reader: asyncio.StreamReader, error: HTTPError) -> bytes:
+        try:
+            return await reader.readline()
+        except ValueError:
+            # A line longer than the StreamReader limit (LimitOverrunError is re-raised as ValueError)
+            raise error
+
+    @classmethod
+    async def _read_request(cls, reader: asyncio.StreamReader) -> Optional[Tuple[str, str, Dict[str, str], bytes]]:
+        request_line = await cls._read_line(reader, HTTPError(400, "Request line too long"))
+        if not request_line:
+            return None
+        try:
+            method, path, _ = request_line.decode('latin-1').split()
+        except ValueError:
+            raise HTTPError(400, "Malformed request line")
+
+        headers = {}
+        for _ in range(MAX_HEADER_LINES):
+            line = await cls._read_line(reader, HTTPError(431, "Header line too long"))
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode('latin-1').partition(":")
+            headers[name.strip().lower()] = value.strip()
+        else:
+            raise HTTPError(431, "Too many headers")
+
+        try:
+            length = int(headers.get('content-length') or 0)
+        except ValueError:
+            raise HTTPError(400, "Invalid Content-Length")
+        if length < 0:
+            raise HTTPError(400, "Invalid Content-Length")
+        if length > MAX_BODY_BYTES:
+            raise HTTPError(413, f"Body larger than {MAX_BODY_BYTES} bytes")
+        body = await reader.readexactly(length) if length else b""
+        return method.upper(), path.split("?", 1)[0], headers, body
+
+    async def _dispatch(self, method: str, path: str, body: bytes) -> Tuple[int, Any, Dict[str, str]]:
+        try:
+            return await self._route(method, path, body)
+        except HTTPError as e:
+            return e.status, {'error': e.message}, e.headers
+        except Exception as e:
+            logger.exception(f"Unhandled error for {method} {path}")
+            return 500, {'error': str(e)}, {}
+
+    async def _route(self, method: str, path: str, body: bytes) -> Tuple[int, Any, Dict[str, str]]:
+        manager = self.manager
+        if path == "/health" and method == "GET":
+            return 200, manager.health(), {}
+        if path == "/metrics" and method == "GET":
+            return 200, render_prometheus(), {'Content-Type': "text/plain; version=0.0.4"}
+        if path == "/sessions" and method == "POST":
+            return 201, {'session_id': await manager.create()}, {}
+
+        match = _SESSION_PATH.match(path)
+        if match is None:
+            raise HTTPError(404, f"No route for {path}")
+        session_id, action = match.groups()
+        if action:
+            if method != "POST":
+                raise HTTPError(405, f"Use POST for /{action}")
+            if action == "resume":
+                return 200, await manager.resume(session_id), {}
+            return 200, await manager.take_turn(session_id, _message(body)), {}
+        if method == "GET":
+            return 200, manager.describe(session_id), {}
+        if method == "DELETE":
+            manager.close(session_id)
+            return 200, {'session_id': session_id, 'closed': True}, {}
+        raise HTTPError(405, f"{method} not allowed on {path}")
+
+
+def _message(body: bytes) -> str:
+    try:
+        message = json.loads(body or b"{}").get('message')
+    except (ValueError, AttributeError):
+        raise HTTPError(400, "Body must be a JSON object")
+    if not isinstance(message, str) or not message.strip():
+        raise HTTPError(400, "A non-empty 'message' is required")
+    return message.strip()
+
+
+def _response(status: int, payload: Any, headers: Optional[Dict[str, str]] = None, keep_alive: bool = True) -> bytes:
+    headers = dict(headers or {})
+    if isinstance(payload, str):
+        body = payload.encode('utf-8')
+    else:
+        body = json.dumps(payload, ensure_ascii=False, default=str).encode('utf-8')
+        headers.setdefault('Content-Type', "application/json")
+    headers['Content-Length'] = str(len(body))
+    headers['Connection'] = "keep-alive" if keep_alive else "close"
+    lines = [f"HTTP/1.1 {status} {http.HTTPStatus(status).phrase}"]
+    lines.extend(f"{name}: {value}" for name, value in headers.items())
+    return ("\r\n".join(lines) + "\r\n\r\n").encode('latin-1') + body
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve concurrent intake sessions over HTTP")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--max-sessions", type=int, default=10000, help="Sessions held in memory at once")
+    parser.add_argument("--max-concurrent-turns", type=int, default=32, help="Turns (LLM calls) running at once")
+    parser.add_argument("--max-queued-turns", type=int, default=256,
+                        help="Turns waiting for a slot before requests get 503")
+    parser.add_argument("--session-store", default=None,
+                        help="SQLite file (*.db) or directory for session checkpoints, or 'none' "
+                             "(default: $INTAKE_SESSION_STORE or intake_sessions.db)")
+    parser.add_argument("--idle-timeout", type=float, default=900.0,
+                        help="Seconds before an idle session is evicted from memory")
+    parser.add_argument("--completed-retention", type=float, default=None,
+                        help="Seconds to keep checkpoints of completed sessions (default INTAKE_COMPLETED_RETENTION "
+                             "or 0: delete on completion; negative: keep)")
+    args = parser.parse_args()
+
+    import agent
+    from kg_resources import load_environment, shutdown_registry
+
+    logging.basicConfig(level=logging.INFO)
+    load_environment()
+    agent.load_settings()
+
+    if args.session_store is None:
+        store = default_session_store()
+    else:
+        store = None if args.session_store.lower() == "none" else open_session_store(args.session_store)
+
+    retention = completed_retention() if args.completed_retention is None else args.completed_retention
+    manager = IntakeSessionManager(args.max_sessions, args.max_concurrent_turns, args.max_queued_turns,
+                                   store=store, idle_timeout=args.idle_timeout, completed_retention=retention)
+    server = IntakeServer(manager, args.host, args.port)
+    try:
+        asyncio.run(server.serve_forever())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if store is not None:
+            store.close()
+        shutdown_registry()
+
+
+if __name__ == "__main__":
+    main()
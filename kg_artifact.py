@@ -0,0 +1,311 @@
+"""
+Compact binary artifact format (.kgb) for knowledge-graph JSON documents.
+
+A .kgb file stores one case in a few columnar sections, so stores with millions
+of cases take a fraction of the space of pretty-printed JSON and reload
+without a JSON parse:
+
+    header       magic, version and the offset of every section
+    strings      each distinct string once (names, types, keys, values): an
+                 offset array plus one UTF-8 blob, decoded on demand
+    entities     name and type string ids as uint32 columns, plus each
+                 entity's remaining fields as an encoded value
+    relations    from/to entity names and relationship type as uint32 columns,
+                 plus the remaining fields
+    document     everything else in the document (metadata, demographics, ...)
+
+Values are encoded with one-byte tags (null, bool, int64, float64, string id,
+list, map), and strings are always references into the string table. The
+format is lossless for JSON documents. `KGArtifact` memory-maps a file and
+reads single entities, relationships or columns without decoding the rest;
+`load_artifact` decodes the whole document. All integers are little-endian.
+"""
+
+import mmap
+import struct
+import sys
+from array import array
+from typing import Dict, Any, Iterator, List, Tuple
+
+MAGIC = b"KGB1"
+VERSION = 1
+
+# magic, version, reserved, then offsets of the strings/entities/relations/document sections and file end
+_HEADER = struct.Struct("<4sHH5Q")
+
+_NULL, _TRUE, _FALSE, _INT, _FLOAT, _STRING, _LIST, _MAP = b"NTFidslm"
+_U32 = struct.Struct("<I")
+_I64 = struct.Struct("<q")
+_F64 = struct.Struct("<d")
+
+# Entity and relationship keys stored in their own columns
+_ENTITY_COLUMNS = ("name", "type")
+_RELATION_COLUMNS = ("from_entity", "to_entity", "relationship_type")
+
+
+def _uint32_array(values: List[int]) -> array:
+    column = array("I", values)
+    if sys.byteorder != "little":
+        column.byteswap()
+    return column
+
+
+class _Encoder:
+    """Interns strings and encodes values in a single walk over the document"""
+
+    def __init__(self):
+        self.strings: Dict[str, int] = {}
+
+    def intern(self, value: str) -> int:
+        string_id = self.strings.get(value)
+        if string_id is None:
+            string_id = self.strings[value] = len(self.strings)
+        return string_id
+
+    def encode(self, value: Any, out: bytearray):
+        if value is None:
+            out.append(_NULL)
+        elif value is True:
+            out.append(_TRUE)
+        elif value is False:
+            out.append(_FALSE)
+        elif isinstance(value, int) and -2**63 <= value < 2**63:
+            out.append(_INT)
+            out += _I64.pack(value)
+        elif isinstance(value, float):
+            out.append(_FLOAT)
+            out += _F64.pack(value)
+        elif isinstance(value, (list, tuple)):
+            out.append(_LIST)
+            out += _U32.pack(len(value))
+            for item in value:
+                self.encode(item, out)
+        elif isinstance(value, dict):
+            out.append(_MAP)
+            out += _U32.pack(len(value))
+            for key, item in value.items():
+                out += _U32.pack(self.intern(str(key)))
+                self.encode(item, out)
+        else:
+            # Strings, and anything else JSON would not carry natively, as text
+            out.append(_STRING)
+            out += _U32.pack(self.intern(value if isinstance(value, str) else str(value)))
+
+    def string_table(self) -> bytes:
+        blobs = [value.encode("utf-8") for value in self.strings]
+        offsets = [0]
+        for blob in blobs:
+            offsets.append(offsets[-1] + len(blob))
+        return _U32.pack(len(blobs)) + _uint32_array(offsets).tobytes() + b"".join(blobs)
+
+
+def _columns_section(encoder: _Encoder, records: List[Dict[str, Any]], columns: Tuple[str, ...]) -> bytes:
+    """Column arrays of string ids for `columns`, then offsets and encoded remaining fields"""
+    id_columns = [[] for _ in columns]
+    extra = bytearray()
+    extra_offsets = [0]
+    for record in records:
+        for column, key in zip(id_columns, columns):
+            column.append(encoder.intern(str(record.get(key, ""))))
+        encoder.encode({k: v for k, v in record.items() if k not in columns}, extra)
+        extra_offsets.append(len(extra))
+
+    section = bytearray(_U32.pack(len(records)))
+    for column in id_columns:
+        section += _uint32_array(column).tobytes()
+    section += _uint32_array(extra_offsets).tobytes()
+    section += extra
+    return bytes(section)
+
+
+def dumps(kg_json: Dict[str, Any]) -> bytes:
+    """Encode a KG JSON document as .kgb bytes"""
+    encoder = _Encoder()
+    entities = _columns_section(encoder, kg_json.get("entities", []), _ENTITY_COLUMNS)
+    relations = _columns_section(encoder, kg_json.get("relationships", []), _RELATION_COLUMNS)
+
+    # Entities and relationships stay in the document as null placeholders to keep the key order
+    document = bytearray()
+    encoder.encode({k: None if k in ("entities", "relationships") else v for k, v in kg_json.items()}, document)
+    strings = encoder.string_table()
+
+    offsets = []
+    position = _HEADER.size
+    for section in (strings, entities, relations, document):
+        offsets.append(position)
+        position += len(section)
+    header = _HEADER.pack(MAGIC, VERSION, 0, *offsets, position)
+    return b"".join((header, strings, entities, relations, bytes(document)))
+
+
+def save_artifact(kg_json: Dict[str, Any], path: str) -> str:
+    """Write a KG JSON document to a .kgb file"""
+    with open(path, "wb") as f:
+        f.write(dumps(kg_json))
+    return path
+
+
+class KGArtifact:
+    """Read-only view of a .kgb file or buffer; strings and records are decoded on access"""
+
+    def __init__(self, buffer):
+        self._source = buffer
+        self._views: List[memoryview] = []
+        self._buffer = memoryview(buffer)
+        magic, version, _, *offsets = _HEADER.unpack_from(self._buffer, 0)
+        if magic != MAGIC:
+            raise ValueError("Not a KG artifact")
+        if version != VERSION:
+            raise ValueError(f"Unsupported KG artifact version {version}")
+        strings_at, entities_at, relations_at, self._document_at, _ = offsets
+
+        count = _U32.unpack_from(self._buffer, strings_at)[0]
+        self._string_offsets = self._uint32_column(strings_at + 4, count + 1)
+        self._strings_at = strings_at + 4 + 4 * (count + 1)
+        self._string_cache: Dict[int, str] = {}
+
+        self._entities = self._columns(entities_at, len(_ENTITY_COLUMNS))
+        self._relations = self._columns(relations_at, len(_RELATION_COLUMNS))
+
+    @classmethod
+    def open(cls, path: str) -> "KGArtifact":
+        """Memory-map a .kgb file"""
+        with open(path, "rb") as f:
+            return cls(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+
+    def close(self):
+        """Release the buffer (and unmap the file when opened with open())"""
+        for view in self._views:
+            view.release()
+        self._buffer.release()
+        if isinstance(self._source, mmap.mmap):
+            self._source.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _uint32_column(self, offset: int, count: int):
+        if sys.byteorder != "little":
+            column = array("I", self._buffer[offset:offset + 4 * count])
+            column.byteswap()
+            return column
+        view = self._buffer[offset:offset + 4 * count].cast("I")
+        self._views.append(view)
+        return view
+
+    def _columns(self, offset: int, column_count: int):
+        count = _U32.unpack_from(self._buffer, offset)[0]
+        offset += 4
+        columns = []
+        for _ in range(column_count):
+            columns.append(self._uint32_column(offset, count))
+            offset += 4 * count
+        extra_offsets = self._uint32_column(offset, count + 1)
+        return count, columns, extra_offsets, offset + 4 * (count + 1)
+
+    def string(self, string_id: int) -> str:
+        value = self._string_cache.get(string_id)
+        if value is None:
+            start = self._strings_at + self._string_offsets[string_id]
+            end = self._strings_at + self._string_offsets[string_id + 1]
+            value = self._string_cache[string_id] = str(self._buffer[start:end], "utf-8")
+        return value
+
+    def _decode(self, offset: int) -> Tuple[Any, int]:
+        tag = self._buffer[offset]
+        offset += 1
+        if tag == _NULL:
+            return None, offset
+        if tag == _TRUE:
+            return True, offset
+        if tag == _FALSE:
+            return False, offset
+        if tag == _INT:
+            return _I64.unpack_from(self._buffer, offset)[0], offset + 8
+        if tag == _FLOAT:
+            return _F64.unpack_from(self._buffer, offset)[0], offset + 8
+        if tag == _STRING:
+            return self.string(_U32.unpack_from(self._buffer, offset)[0]), offset + 4
+
+        count = _U32.unpack_from(self._buffer, offset)[0]
+        offset += 4
+        if tag == _LIST:
+            items = []
+            for _ in range(count):
+                item, offset = self._decode(offset)
+                items.append(item)
+            return items, offset
+        if tag == _MAP:
+            mapping = {}
+            for _ in range(count):
+                key = self.string(_U32.unpack_from(self._buffer, offset)[0])
+                mapping[key], offset = self._decode(offset + 4)
+            return mapping, offset
+        raise ValueError(f"Corrupt KG artifact: unknown tag {tag!r}")
+
+    def _record(self, section, keys: Tuple[str, ...], index: int) -> Dict[str, Any]:
+        count, columns, extra_offsets, extra_at = section
+        if not 0 <= index < count:
+            raise IndexError(index)
+        record = {key: self.string(column[index]) for key, column in zip(keys, columns)}
+        record.update(self._decode(extra_at + extra_offsets[index])[0])
+        return record
+
+    @property
+    def entity_count(self) -> int:
+        return self._entities[0]
+
+    @property
+    def relationship_count(self) -> int:
+        return self._relations[0]
+
+    def entity(self, index: int) -> Dict[str, Any]:
+        return self._record(self._entities, _ENTITY_COLUMNS, index)
+
+    def relationship(self, index: int) -> Dict[str, Any]:
+        return self._record(self._relations, _RELATION_COLUMNS, index)
+
+    def iter_entities(self) -> Iterator[Dict[str, Any]]:
+        return (self.entity(i) for i in range(self.entity_count))
+
+    def iter_relationships(self) -> Iterator[Dict[str, Any]]:
+        return (self.relationship(i) for i in range(self.relationship_count))
+
+    def entity_names(self) -> List[str]:
+        """Names of all entities, without decoding their properties"""
+        return [self.string(string_id) for string_id in self._entities[1][0]]
+
+    def relationship_types(self) -> List[str]:
+        """Relationship type of every relationship, without decoding the rest"""
+        return [self.string(string_id) for string_id in self._relations[1][2]]
+
+    def document(self) -> Dict[str, Any]:
+        """Every top-level field except entities and relationships"""
+        document = self._decode(self._document_at)[0]
+        document.pop('entities', None)
+        document.pop('relationships', None)
+        return document
+
+    def to_json(self) -> Dict[str, Any]:
+        """Decode the full KG JSON document"""
+        kg_json = self._decode(self._document_at)[0]
+        if 'entities' in kg_json:
+            kg_json['entities'] = list(self.iter_entities())
+        if 'relationships' in kg_json:
+            kg_json['relationships'] = list(self.iter_relationships())
+        return kg_json
+
+
+def loads(data: bytes) -> Dict[str, Any]:
+    """Decode .kgb bytes into a KG JSON document"""
+    with KGArtifact(data) as artifact:
+        return artifact.to_json()
+
+
+def load_artifact(path: str) -> Dict[str, Any]:
+    """Read a .kgb file into a KG JSON document"""
+    with open(path, "rb") as f:
+        return loads(f.read())
@@ -0,0 +1,330 @@
+"""
+Offline batch processing of saved clinical reports into knowledge graphs.
+
+Reads reports from a directory (one report per .md/.txt file) or a JSONL file
+(one {"id": ..., "report": ...} object per line) and runs them through
+kg_drafter.aprocess_medical_report with bounded concurrency and LLM rate limits.
+Progress is checkpointed after every report, so an interrupted run resumes
+where it stopped. A throughput/latency summary and the run's Prometheus
+metrics (see kg_metrics) are written at the end.
+
+Usage:
+    python kg_batch.py reports/ --output-dir kg_out --concurrency 8
+    python kg_batch.py reports.jsonl --requests-per-minute 60 --tokens-per-minute 80000
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import time
+from pathlib import Path
+from typing import Dict, Any, Iterator, List, Optional, Tuple
+
+from kg_cache import ExtractionCache
+from kg_drafter import aprocess_medical_report, AsyncNeo4jConnection
+from kg_metrics import write_prometheus
+from model_router import default_model_router
+from kg_resources import get_registry
+
+logger = logging.getLogger(__name__)
+
+REPORT_SUFFIXES = {".md", ".txt"}
+
+# Rough per-call token budget on top of the report itself: system prompt plus
+# format instructions on the way in, and the extracted JSON on the way out
+PROMPT_OVERHEAD_TOKENS = 1200
+COMPLETION_TOKENS_ESTIMATE = 2000
+# Enhancement returns only the additions (a KnowledgeDelta), not the whole case
+DELTA_TOKENS_ESTIMATE = 600
+
+
+def estimate_tokens(report: str, enhance: bool = False) -> int:
+    """Estimate the LLM tokens processing a report will consume (~4 characters per token)"""
+    tokens = len(report) // 4 + PROMPT_OVERHEAD_TOKENS + COMPLETION_TOKENS_ESTIMATE
+    if enhance:
+        # Enhancement sends the case as compact name lists (about a third of the
+        # extracted JSON) and receives only the additions
+        tokens += PROMPT_OVERHEAD_TOKENS + COMPLETION_TOKENS_ESTIMATE // 3 + DELTA_TOKENS_ESTIMATE
+    return tokens
+
+
+class TokenBucket:
+    """Async token bucket refilled continuously at a per-minute rate"""
+
+    def __init__(self, per_minute: float):
+        self.capacity = per_minute
+        self.rate = per_minute / 60.0
+        self.available = per_minute
+        self.updated_at = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self, amount: float = 1):
+        """Wait until `amount` units are available and take them"""
+        # Requests larger than the bucket would never fit; let them drain it instead
+        amount = min(amount, self.capacity)
+
+        # The lock keeps waiters FIFO so large requests are not starved by small ones
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.available = min(self.capacity, self.available + (now - self.updated_at) * self.rate)
+                self.updated_at = now
+
+                if self.available >= amount:
+                    self.available -= amount
+                    return
+
+                await asyncio.sleep((amount - self.available) / self.rate)
+
+
+class RateLimiter:
+    """Limits LLM requests per minute and tokens per minute (either may be unlimited)"""
+
+    def __init__(self, requests_per_minute: Optional[float] = None, tokens_per_minute: Optional[float] = None):
+        self.requests = TokenBucket(requests_per_minute) if requests_per_minute else None
+        self.tokens = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+
+    async def acquire(self, requests: int, tokens: int):
+        """Wait for capacity for `requests` LLM calls consuming `tokens` tokens"""
+        if self.requests:
+            await self.requests.acquire(requests)
+        if self.tokens:
+            await self.tokens.acquire(tokens)
+
+
+class Checkpoint:
+    """Append-only JSONL log of finished reports, used to resume interrupted runs"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.entries: Dict[str, Dict[str, Any]] = {}
+
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    line = line.strip()
+                    if not line:
+                        continue
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        # A crash mid-write can leave a truncated last line
+                        logger.warning(f"Ignoring corrupt checkpoint line in {path}")
+                        continue
+                    self.entries[entry['id']] = entry
+            logger.info(f"Loaded {len(self.entries)} checkpoint entries from {path}")
+
+        # The default checkpoint lives in the output directory, which a fresh run has not created yet
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._file = open(path, 'a', encoding='utf-8')
+
+    def is_done(self, report_id: str, retry_failed: bool = False) -> bool:
+        """Whether a report was already processed (failures count only without retry_failed)"""
+        entry = self.entries.get(report_id)
+        if entry is None:
+            return False
+        return entry['status'] == 'success' or not retry_failed
+
+    def record(self, entry: Dict[str, Any]):
+        """Durably record a finished report"""
+        self.entries[entry['id']] = entry
+        self._file.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def close(self):
+        self._file.close()
+
+
+def iter_reports(source: str) -> Iterator[Tuple[str, str]]:
+    """Yield (report_id, report_text) from a directory of reports or a JSONL file"""
+    path = Path(source)
+
+    if path.is_dir():
+        for file_path in sorted(path.rglob("*")):
+            if file_path.is_file() and file_path.suffix.lower() in REPORT_SUFFIXES:
+                yield str(file_path.relative_to(path)), file_path.read_text(encoding='utf-8')
+        return
+
+    with open(path, 'r', encoding='utf-8') as f:
+        for line_number, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            record = json.loads(line)
+            report = record.get('report') or record.get('text')
+            if not report:
+                logger.warning(f"Skipping line {line_number}: no 'report' or 'text' field")
+                continue
+            yield str(record.get('id', f"line-{line_number}")), report
+
+
+def percentile(values: List[float], pct: float) -> float:
+    """Nearest-rank percentile of a list of values"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered) - 1, int(round(pct / 100 * len(ordered))) - 1))
+    return ordered[rank]
+
+
+async def run_batch(source: str, output_dir: str, concurrency: int = 4,
+                    limiter: Optional[RateLimiter] = None, checkpoint: Optional[Checkpoint] = None,
+                    enhance: bool = False, retry_failed: bool = False,
+                    connection: Optional[AsyncNeo4jConnection] = None,
+                    cache: Optional[ExtractionCache] = None, refresh_cache: bool = False,
+                    formats: Optional[Tuple[str, ...]] = None) -> Dict[str, Any]:
+    """Process every report in `source` and return the run summary"""
+    limiter = limiter or RateLimiter()
+    os.makedirs(output_dir, exist_ok=True)
+
+    stats = {'succeeded': 0, 'failed': 0, 'skipped': 0, 'estimated_tokens': 0,
+             'cache_hits': 0, 'cache_misses': 0}
+    latencies: List[float] = []
+
+    # Bounded queue keeps memory flat no matter how large the input is
+    queue: asyncio.Queue = asyncio.Queue(maxsize=concurrency * 2)
+
+    async def worker():
+        while True:
+            item = await queue.get()
+            if item is None:
+                return
+
+            report_id, report = item
+            tokens = estimate_tokens(report, enhance)
+            # Pessimistic: whether a report is a cache hit is only known inside the pipeline
+            await limiter.acquire(2 if enhance else 1, tokens)
+            stats['estimated_tokens'] += tokens
+
+            start = time.perf_counter()
+            entry = {'id': report_id}
+            try:
+                kg_json, _ = await aprocess_medical_report(
+                    report, enhance=enhance, connection=connection, output_dir=output_dir,
+                    cache=cache, refresh_cache=refresh_cache, formats=formats
+                )
+                entry.update(status='success', case_id=kg_json['metadata']['case_id'])
+                case_cache = kg_json['metadata'].get('cache') or {}
+                stats['cache_hits'] += case_cache.get('hits', 0)
+                stats['cache_misses'] += case_cache.get('misses', 0)
+                stats['succeeded'] += 1
+            except Exception as e:
+                logger.error(f"Report {report_id} failed: {e}")
+                entry.update(status='failed', error=str(e))
+                stats['failed'] += 1
+
+            entry['latency'] = time.perf_counter() - start
+            latencies.append(entry['latency'])
+            if checkpoint:
+                checkpoint.record(entry)
+
+    start_time = time.perf_counter()
+    workers = [asyncio.create_task(worker()) for _ in range(concurrency)]
+
+    for report_id, report in iter_reports(source):
+        if checkpoint and checkpoint.is_done(report_id, retry_failed):
+            stats['skipped'] += 1
+            continue
+        await queue.put((report_id, report))
+
+    for _ in workers:
+        await queue.put(None)
+    await asyncio.gather(*workers)
+
+    wall_time = time.perf_counter() - start_time
+    processed = stats['succeeded'] + stats['failed']
+    router = default_model_router()
+
+    summary = {
+        'source': source,
+        'processed': processed,
+        'succeeded': stats['succeeded'],
+        'failed': stats['failed'],
+        'skipped': stats['skipped'],
+        'concurrency': concurrency,
+        'wall_time_s': round(wall_time, 3),
+        'throughput_per_min': round(processed / wall_time * 60, 2) if wall_time > 0 else 0.0,
+        'estimated_tokens': stats['estimated_tokens'],
+        'cache_hits': stats['cache_hits'],
+        'cache_misses': stats['cache_misses'],
+        'latency_s': {
+            'mean': round(sum(latencies) / len(latencies), 3) if latencies else 0.0,
+            'p50': round(percentile(latencies, 50), 3),
+            'p95': round(percentile(latencies, 95), 3),
+            'max': round(max(latencies), 3) if latencies else 0.0
+        }
+    }
+    if router is not None:
+        # Calls, latency, tokens and cost per model route (KG_ROUTING=1)
+        summary['routing'] = router.stats()
+    return summary
+
+
+async def _main(args: argparse.Namespace) -> Dict[str, Any]:
+    checkpoint = Checkpoint(args.checkpoint or os.path.join(args.output_dir, "checkpoint.jsonl"))
+    limiter = RateLimiter(args.requests_per_minute, args.tokens_per_minute)
+    cache = ExtractionCache(args.cache_dir) if args.cache_dir else None
+
+    connection = None
+    if args.ingest:
+        connection = AsyncNeo4jConnection()
+        if not await connection.connect():
+            raise SystemExit("Could not connect to Neo4j")
+
+    try:
+        return await run_batch(
+            args.source, args.output_dir, concurrency=args.concurrency, limiter=limiter,
+            checkpoint=checkpoint, enhance=args.enhance, retry_failed=args.retry_failed,
+            connection=connection, cache=cache, refresh_cache=args.refresh_cache,
+            formats=tuple(args.formats.split(",")) if args.formats else None
+        )
+    finally:
+        checkpoint.close()
+        if connection:
+            await connection.close()
+        # Async clients are bound to this event loop, which asyncio.run is about to close
+        await get_registry().aclose()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Batch-process clinical reports into knowledge graphs")
+    parser.add_argument("source", help="Directory of .md/.txt reports or a JSONL file of {id, report} records")
+    parser.add_argument("--output-dir", default="kg_batch_output", help="Where case files, checkpoint and summary go")
+    parser.add_argument("--concurrency", type=int, default=4, help="Reports processed at once")
+    parser.add_argument("--requests-per-minute", type=float, default=None, help="LLM request rate limit")
+    parser.add_argument("--tokens-per-minute", type=float, default=None, help="LLM token rate limit")
+    parser.add_argument("--checkpoint", default=None, help="Checkpoint file (default: <output-dir>/checkpoint.jsonl)")
+    parser.add_argument("--retry-failed", action="store_true", help="Re-run reports that failed in a previous run")
+    parser.add_argument("--enhance", action="store_true", help="Enhance with medical knowledge")
+    parser.add_argument("--ingest", action="store_true", help="Also write each case to Neo4j")
+    parser.add_argument("--cache-dir", default=None, help="Extraction cache directory (default: $KG_CACHE_DIR, if set)")
+    parser.add_argument("--refresh-cache", action="store_true", help="Ignore cached extractions and overwrite them")
+    parser.add_argument("--formats", default=None,
+                        help="Comma-separated case files to write: json, cypher, kgb (default: $KG_ARTIFACT_FORMATS or json,cypher)")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+
+    summary = asyncio.run(_main(args))
+
+    summary_path = os.path.join(args.output_dir, "batch_summary.json")
+    with open(summary_path, 'w', encoding='utf-8') as f:
+        json.dump(summary, f, indent=2)
+
+    logger.info(
+        f"Processed {summary['processed']} reports ({summary['failed']} failed, {summary['skipped']} skipped) "
+        f"in {summary['wall_time_s']}s: {summary['throughput_per_min']} reports/min, "
+        f"p50 {summary['latency_s']['p50']}s, p95 {summary['latency_s']['p95']}s"
+    )
+    logger.info(f"Summary written to {summary_path}")
+
+    # Span, LLM and Neo4j metrics of the run in Prometheus text format
+    metrics_path = write_prometheus(os.getenv("KG_METRICS_FILE") or os.path.join(args.output_dir, "metrics.prom"))
+    logger.info(f"Metrics written to {metrics_path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,158 @@
+"""
+Persistent, content-addressed cache for MedicalKGBuilder LLM calls.
+
+Entries are keyed by a SHA-256 of everything that determines the LLM output
+(model, pipeline stage and the fully formatted prompt, which embeds the prompt
+template, format instructions and report text), so reprocessing the same report
+with the same prompts is a local file read instead of a GPT-4 call.
+"""
+
+import functools
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import time
+from typing import Dict, Any, Optional
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_ENTRIES = 50_000
+DEFAULT_MAX_BYTES = 1024 * 1024 * 1024  # 1 GiB
+DEFAULT_MAX_AGE_SECONDS = 90 * 24 * 3600  # 90 days
+
+
+class ExtractionCache:
+    """On-disk JSON cache with age-, count- and size-based eviction"""
+
+    def __init__(self, cache_dir: str = ".kg_cache", max_entries: int = DEFAULT_MAX_ENTRIES,
+                 max_bytes: int = DEFAULT_MAX_BYTES, max_age_seconds: float = DEFAULT_MAX_AGE_SECONDS,
+                 evict_every: int = 100):
+        self.cache_dir = cache_dir
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.max_age_seconds = max_age_seconds
+        self.evict_every = evict_every
+        self._writes_since_evict = 0
+        self.stats = {'hits': 0, 'misses': 0, 'writes': 0, 'evictions': 0}
+
+        os.makedirs(cache_dir, exist_ok=True)
+        self.evict()
+
+    @staticmethod
+    def make_key(*parts: Any) -> str:
+        """Stable hash of the given key parts"""
+        payload = json.dumps(parts, sort_keys=True, ensure_ascii=False, default=str)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def _path(self, key: str) -> str:
+        # Shard by prefix so no single directory holds every entry
+        return os.path.join(self.cache_dir, key[:2], f"{key}.json")
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """Return the cached value for key, or None on a miss or expired entry"""
+        path = self._path(key)
+        try:
+            created_at = os.path.getmtime(path)
+            if time.time() - created_at > self.max_age_seconds:
+                os.remove(path)
+                self.stats['evictions'] += 1
+                self.stats['misses'] += 1
+                return None
+
+            with open(path, 'r', encoding='utf-8') as f:
+                value = json.load(f)
+        except (OSError, json.JSONDecodeError):
+            self.stats['misses'] += 1
+            return None
+
+        # mtime records when the entry was written (for age eviction); atime records
+        # the last hit, so size eviction drops least recently used entries first
+        try:
+            os.utime(path, (time.time(), created_at))
+        except OSError:
+            pass
+
+        self.stats['hits'] += 1
+        return value
+
+    def put(self, key: str, value: Dict[str, Any]):
+        """Store a value, atomically replacing any existing entry"""
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump(value, f, ensure_ascii=False)
+            os.replace(tmp_path, path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+        self.stats['writes'] += 1
+        self._writes_since_evict += 1
+        if self._writes_since_evict >= self.evict_every:
+            self.evict()
+
+    def evict(self):
+        """Drop expired entries, then the least recently used until under the count and size limits"""
+        self._writes_since_evict = 0
+        now = time.time()
+        entries = []
+        total_bytes = 0
+
+        for root, _, files in os.walk(self.cache_dir):
+            for name in files:
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+
+                if name.endswith(".tmp"):
+                    # Left behind by a crashed writer once it is old enough not to be in flight
+                    if now - stat.st_mtime > 3600:
+                        self._remove(path)
+                    continue
+
+                if now - stat.st_mtime > self.max_age_seconds:
+                    self._remove(path)
+                    continue
+
+                entries.append((max(stat.st_atime, stat.st_mtime), stat.st_size, path))
+                total_bytes += stat.st_size
+
+        if len(entries) <= self.max_entries and total_bytes <= self.max_bytes:
+            return
+
+        entries.sort()
+        count = len(entries)
+        for _, size, path in entries:
+            if count <= self.max_entries and total_bytes <= self.max_bytes:
+                break
+            self._remove(path)
+            count -= 1
+            total_bytes -= size
+
+    def _remove(self, path: str):
+        try:
+            os.remove(path)
+            self.stats['evictions'] += 1
+        except OSError:
+            pass
+
+    def clear(self):
+        """Remove every cache entry"""
+        for root, _, files in os.walk(self.cache_dir):
+            for name in files:
+                self._remove(os.path.join(root, name))
+
+
+@functools.lru_cache(maxsize=None)
+def default_cache() -> Optional[ExtractionCache]:
+    """Cache configured through KG_CACHE_DIR, or None when caching is not enabled"""
+    cache_dir = os.getenv('KG_CACHE_DIR')
+    return ExtractionCache(cache_dir) if cache_dir else None
@@ -1,65 +1,272 @@
+import asyncio
+import contextvars
 import json
 import re
-from typing import Dict, List, Any, Optional
+import threading
+from concurrent.futures import ThreadPoolExecutor, Future
+from typing import Dict, List, Any, Optional, Tuple, Union
 from dataclasses import dataclass
 from enum import Enum
 import uuid
 from datetime import datetime
 import logging
-from langchain_openai import ChatOpenAI
 import os
-from dotenv import load_dotenv
-load_dotenv()
-from langchain.prompts import ChatPromptTemplate
-from langchain_core.output_parsers import JsonOutputParser
-from pydantic import BaseModel, Field
-from neo4j import GraphDatabase
 import time
+from kg_cache import ExtractionCache, default_cache
+from kg_metrics import span, timed, trace_case, record_llm_call, observe_query
+from kg_resources import get_registry
 
-# Configure logging
-logging.basicConfig(level=logging.INFO)
+# langchain, pydantic and neo4j are imported where they are first used, so that
+# importing this module (e.g. just for Neo4jQueryBuilder) stays cheap
 logger = logging.getLogger(__name__)
 
-# Pydantic models for structured output
-class ClinicalEntity(BaseModel):
-    name: str = Field(description="Name of the clinical entity")
-    type: str = Field(description="Type of entity: symptom, condition, test, treatment, medication, risk_factor")
-    properties: Dict[str, Any] = Field(default_factory=dict, description="Additional properties like severity, duration, location, etc.")
-    icd_code: Optional[str] = Field(default=None, description="ICD-10 code if applicable")
-    confidence: Optional[str] = Field(default=None, description="Confidence level: high, moderate, low")
-
-class ClinicalRelationship(BaseModel):
-    from_entity: str = Field(description="Source entity name")
-    to_entity: str = Field(description="Target entity name")
-    relationship_type: str = Field(description="Type: suggests, indicates_need_for, treated_by, diagnosed_with, etc.")
-    properties: Dict[str, Any] = Field(default_factory=dict, description="Relationship properties")
-    confidence: Optional[str] = Field(default=None, description="Confidence in this relationship")
-
-class PatientCase(BaseModel):
-    patient_demographics: Dict[str, Any] = Field(default_factory=dict, description="Age, gender, relevant history")
-    chief_complaint: str = Field(description="Primary reason for visit")
-    entities: List[ClinicalEntity] = Field(description="All clinical entities found in the report")
-    relationships: List[ClinicalRelationship] = Field(description="Relationships between entities")
-    clinical_reasoning: str = Field(description="Summary of clinical reasoning from the report")
-    recommendations: List[str] = Field(description="Next steps and recommendations")
+_LAZY_MODELS = ("ClinicalEntity", "ClinicalRelationship", "PatientCase", "IcdCodeUpdate", "KnowledgeDelta")
+
+def __getattr__(name: str):
+    # Re-export the pydantic models from kg_models without importing pydantic up front
+    if name in _LAZY_MODELS:
+        import kg_models
+        return getattr(kg_models, name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+# Files save_to_files writes per case: any of "json", "cypher" and "kgb" (compact binary, see kg_artifact)
+ARTIFACT_FORMATS = tuple(f.strip() for f in os.getenv("KG_ARTIFACT_FORMATS", "json,cypher").split(",") if f.strip())
+
+# Entity types from the clinical ontology; their Neo4j labels get a unique `name` constraint
+ONTOLOGY_ENTITY_TYPES = [
+    "symptom", "condition", "test", "diagnostic test", "finding", "treatment",
+    "medication", "outcome", "risk_factor", "gestational_age"
+]
+
+# Node and relationship counts per label/type, read from Neo4j's count store in one call
+GRAPH_COUNTS_QUERY = "CALL db.stats.retrieve('GRAPH COUNTS') YIELD data RETURN data"
+
+# Fallback where db.stats.retrieve is not permitted: still one round trip, and the
+# totals come from the count store, but the per-label/type breakdowns scan the graph
+SCAN_STATS_QUERY = """
+CALL { MATCH (n) RETURN count(n) AS total_nodes }
+CALL { MATCH ()-[r]->() RETURN count(r) AS total_relationships }
+CALL {
+    MATCH (n) UNWIND labels(n) AS label
+    WITH label, count(*) AS count
+    RETURN collect({label: label, count: count}) AS node_types
+}
+CALL {
+    MATCH ()-[r]->()
+    WITH type(r) AS relationship_type, count(*) AS count
+    RETURN collect({relationship_type: relationship_type, count: count}) AS relationship_types
+}
+RETURN total_nodes, total_relationships, node_types, relationship_types
+"""
+
+# Label or relationship type written by a MERGE/CREATE clause (plain or backtick-quoted)
+_WRITTEN_NODE_LABEL = re.compile(r"(?:MERGE|CREATE) \(\w*:(`(?:[^`]|``)+`|\w+)")
+_WRITTEN_REL_TYPE = re.compile(r"(?:MERGE|CREATE) \(\w*\)-\[\w*:(`(?:[^`]|``)+`|\w+)")
+
+def _written_identifier(pattern: re.Pattern, query: str) -> Optional[str]:
+    """The single label/type a statement writes, or None if there is none or more than one"""
+    found = {m.strip('`').replace('``', '`') for m in pattern.findall(query)}
+    return found.pop() if len(found) == 1 else None
+
+def _stats_from_graph_counts(data: Dict[str, Any]) -> Dict[str, Any]:
+    """Convert db.stats.retrieve('GRAPH COUNTS') output to the snapshot format"""
+    stats = {'total_nodes': 0, 'total_relationships': 0, 'node_types': {}, 'relationship_types': {}}
+    for entry in data.get('nodes', []):
+        if 'label' in entry:
+            stats['node_types'][entry['label']] = entry['count']
+        else:
+            stats['total_nodes'] = entry['count']
+    for entry in data.get('relationships', []):
+        # Entries with start/end labels are per-pattern breakdowns; only per-type and total counts are kept
+        if 'startLabel' in entry or 'endLabel' in entry:
+            continue
+        if 'relationshipType' in entry:
+            stats['relationship_types'][entry['relationshipType']] = entry['count']
+        else:
+            stats['total_relationships'] = entry['count']
+    return stats
+
+def _stats_from_scan(record: Dict[str, Any]) -> Dict[str, Any]:
+    """Convert a SCAN_STATS_QUERY record to the snapshot format"""
+    return {
+        'total_nodes': record['total_nodes'],
+        'total_relationships': record['total_relationships'],
+        'node_types': {row['label']: row['count'] for row in record['node_types']},
+        'relationship_types': {row['relationship_type']: row['count'] for row in record['relationship_types']}
+    }
+
+class GraphStatsSnapshot:
+    """TTL-cached database statistics, kept current by the write counters of our own ingestion
+    
+    A snapshot is read from the database at most once per TTL. In between,
+    every committed write reports its created-node and created-relationship
+    counters here, so polls see our own ingestion without another query. Writes
+    that cannot be attributed to a single label/type (or that delete anything)
+    invalidate the snapshot instead.
+    """
+    
+    def __init__(self, ttl: float = 30.0):
+        self.ttl = ttl
+        # Cleared when db.stats.retrieve is rejected, so later reads go straight to the scan query
+        self.count_store_available = True
+        self._lock = threading.Lock()
+        self._stats: Optional[Dict[str, Any]] = None
+        self._read_at = 0.0
+    
+    def get(self, max_age: Optional[float] = None) -> Optional[Dict[str, Any]]:
+        """The snapshot if it is younger than max_age (default: the TTL), else None"""
+        max_age = self.ttl if max_age is None else max_age
+        with self._lock:
+            if self._stats is None or time.monotonic() - self._read_at > max_age:
+                return None
+            return self._render(cached=True)
+    
+    def replace(self, stats: Dict[str, Any], source: str) -> Dict[str, Any]:
+        """Store counts freshly read from the database and return them"""
+        with self._lock:
+            self._stats = dict(stats, source=source)
+            self._read_at = time.monotonic()
+            return self._render(cached=False)
+    
+    def invalidate(self):
+        with self._lock:
+            self._stats = None
+    
+    def record_writes(self, writes: List[Tuple[str, Any]]):
+        """Apply the (query, counters) pairs of a committed transaction"""
+        with self._lock:
+            if self._stats is None:
+                return
+            for query, counters in writes:
+                if counters.nodes_deleted or counters.relationships_deleted:
+                    self._stats = None
+                    return
+                
+                if counters.nodes_created:
+                    label = _written_identifier(_WRITTEN_NODE_LABEL, query)
+                    if label is None:
+                        self._stats = None
+                        return
+                    self._stats['total_nodes'] += counters.nodes_created
+                    node_types = self._stats['node_types']
+                    node_types[label] = node_types.get(label, 0) + counters.nodes_created
+                
+                if counters.relationships_created:
+                    rel_type = _written_identifier(_WRITTEN_REL_TYPE, query)
+                    if rel_type is None:
+                        self._stats = None
+                        return
+                    self._stats['total_relationships'] += counters.relationships_created
+                    rel_types = self._stats['relationship_types']
+                    rel_types[rel_type] = rel_types.get(rel_type, 0) + counters.relationships_created
+    
+    def _render(self, cached: bool) -> Dict[str, Any]:
+        """Snapshot in get_database_stats format, largest counts first"""
+        stats = self._stats
+        return {
+            'total_nodes': stats['total_nodes'],
+            'total_relationships': stats['total_relationships'],
+            'node_types': [
+                {'label': label, 'count': count}
+                for label, count in sorted(stats['node_types'].items(), key=lambda item: -item[1]) if count
+            ],
+            'relationship_types': [
+                {'relationship_type': rel_type, 'count': count}
+                for rel_type, count in sorted(stats['relationship_types'].items(), key=lambda item: -item[1]) if count
+            ],
+            'source': stats['source'],
+            'cached': cached,
+            'age': round(time.monotonic() - self._read_at, 3)
+        }
+
+_graph_stats: Dict[Tuple[str, str], GraphStatsSnapshot] = {}
+_graph_stats_lock = threading.Lock()
+
+def graph_stats_snapshot(uri: str, database: str) -> GraphStatsSnapshot:
+    """Process-wide snapshot for a database, shared by every connection to it"""
+    with _graph_stats_lock:
+        return _graph_stats.setdefault((uri, database), GraphStatsSnapshot())
+
+class _TransactionalRun:
+    """Statements, progress and results of one execute_queries_transactional call
+    
+    The bookkeeping shared by Neo4jConnection and AsyncNeo4jConnection; only
+    running the transaction functions differs between the two.
+    """
+    
+    def __init__(self, queries: List[Union[str, Tuple[str, Dict[str, Any]]]], stats_snapshot: GraphStatsSnapshot):
+        self.statements = [(q, {}) if isinstance(q, str) else q for q in queries]
+        self.stats_snapshot = stats_snapshot
+        self.start_time = time.time()
+        self.results = {
+            'success_count': 0,
+            'error_count': 0,
+            'errors': [],
+            'execution_time': 0,
+            'rolled_back': False
+        }
+    
+    @staticmethod
+    def start_attempt(progress: Dict[str, Any]):
+        # Transaction functions may be retried, so track progress from scratch each attempt
+        progress['index'] = 0
+        progress['writes'] = []
+    
+    @staticmethod
+    def statement_done(progress: Dict[str, Any], query: str, summary, seconds: float):
+        observe_query("transactional", seconds)
+        progress['writes'].append((query, summary.counters))
+        progress['index'] += 1
+    
+    def committed(self, progress: Dict[str, Any], count: int):
+        self.stats_snapshot.record_writes(progress['writes'])
+        self.results['success_count'] += count
+    
+    def record_error(self, index: Optional[int], query: str, error: Exception):
+        """Record a failed query (index into statements), or a failed commit (index None)"""
+        self.results['error_count'] += 1
+        self.results['errors'].append({
+            'query_index': index + 1 if index is not None else None,
+            'query': query[:100] + "..." if len(query) > 100 else query,
+            'error': str(error)
+        })
+        if index is None:
+            logger.error(f"Commit failed: {error}")
+        else:
+            logger.error(f"Query {index+1} failed: {error}")
+    
+    def rolled_back(self, progress: Dict[str, Any], error: Exception):
+        """Record an atomic run that failed at the statement progress reached, or at commit"""
+        failed = progress['index']
+        if failed < len(self.statements):
+            self.record_error(failed, self.statements[failed][0], error)
+        else:
+            # Every statement ran; the commit itself failed
+            self.record_error(None, "COMMIT", error)
+        self.results['rolled_back'] = True
+        logger.error(f"Transaction rolled back; none of the {len(self.statements)} queries were committed")
+    
+    def finish(self) -> Dict[str, Any]:
+        self.results['execution_time'] = time.time() - self.start_time
+        return self.results
 
 class Neo4jConnection:
     """Handles Neo4j database connection and query execution"""
     
-    def __init__(self, database: str = "neo4j"):
+    def __init__(self, database: str = "neo4j", driver=None):
         self.uri = "bolt://localhost:7687"
         self.username = "neo4j"
         self.password = "password"
         self.database = database
-        self.driver = GraphDatabase.driver(self.uri, auth=(self.username, self.password))
+        # Set by connect(); the pooled driver is shared process-wide via kg_resources
+        self.driver = driver
+        self.stats_snapshot = graph_stats_snapshot(self.uri, database)
         
     def connect(self):
         """Establish connection to Neo4j database"""
         try:
-            self.driver = GraphDatabase.driver(
-                self.uri, 
-                auth=(self.username, self.password)
-            )
+            if self.driver is None:
+                self.driver = get_registry().neo4j_driver(self.uri, self.username, self.password)
             # Test connection
             with self.driver.session(database=self.database) as session:
                 session.run("RETURN 1")
@@ -70,9 +277,9 @@ class Neo4jConnection:
             return False
     
     def close(self):
-        """Close Neo4j connection"""
+        """Release the connection (the shared driver's pool is closed by the resource registry)"""
         if self.driver:
-            self.driver.close()
+            self.driver = None
             logger.info("Neo4j connection closed")
     
     def execute_query(self, query: str, parameters: Dict[str, Any] = None) -> List[Dict[str, Any]]:
@@ -82,16 +289,19 @@ class Neo4jConnection:
         
         try:
             with self.driver.session(database=self.database) as session:
+                start = time.perf_counter()
                 result = session.run(query, parameters or {})
                 records = [record.data() for record in result]
+                observe_query("query", time.perf_counter() - start)
                 return records
         except Exception as e:
             logger.error(f"Query execution failed: {e}")
             logger.error(f"Query: {query}")
             raise
     
-    def execute_queries_batch(self, queries: List[str], batch_size: int = 10) -> Dict[str, Any]:
-        """Execute multiple queries in batches"""
+    def execute_queries_batch(self, queries: List[str], batch_size: int = 10,
+                              batch_delay: float = 0.1) -> Dict[str, Any]:
+        """Execute multiple queries in batches, pausing batch_delay seconds between batches"""
         if not self.driver:
             raise Exception("No active database connection. Call connect() first.")
         
@@ -112,7 +322,10 @@ class Neo4jConnection:
                     
                     for j, query in enumerate(batch):
                         try:
-                            session.run(query)
+                            query_start = time.perf_counter()
+                            summary = session.run(query).consume()
+                            observe_query("batch", time.perf_counter() - query_start)
+                            self.stats_snapshot.record_writes([(query, summary.counters)])
                             results['success_count'] += 1
                             logger.debug(f"Query {i+j+1} executed successfully")
                         except Exception as e:
@@ -126,8 +339,8 @@ class Neo4jConnection:
                             logger.error(f"Query {i+j+1} failed: {e}")
                     
                     # Small delay between batches to avoid overwhelming the database
-                    if i + batch_size < len(queries):
-                        time.sleep(0.1)
+                    if batch_delay and i + batch_size < len(queries):
+                        time.sleep(batch_delay)
         
         except Exception as e:
             logger.error(f"Batch execution failed: {e}")
@@ -136,6 +349,152 @@ class Neo4jConnection:
         results['execution_time'] = time.time() - start_time
         return results
     
+    def execute_bulk_queries(self, statements: List[Tuple[str, Dict[str, Any]]]) -> Dict[str, Any]:
+        """Execute parameterized (query, parameters) statements, one round trip each"""
+        if not self.driver:
+            raise Exception("No active database connection. Call connect() first.")
+        
+        results = {
+            'success_count': 0,
+            'error_count': 0,
+            'errors': [],
+            'execution_time': 0
+        }
+        
+        start_time = time.time()
+        
+        with self.driver.session(database=self.database) as session:
+            for i, (query, parameters) in enumerate(statements):
+                try:
+                    query_start = time.perf_counter()
+                    summary = session.run(query, parameters).consume()
+                    observe_query("bulk", time.perf_counter() - query_start)
+                    self.stats_snapshot.record_writes([(query, summary.counters)])
+                    results['success_count'] += 1
+                    logger.debug(f"Bulk statement {i+1} executed successfully")
+                except Exception as e:
+                    results['error_count'] += 1
+                    results['errors'].append({
+                        'query_index': i + 1,
+                        'query': query[:100] + "..." if len(query) > 100 else query,
+                        'error': str(e)
+                    })
+                    logger.error(f"Bulk statement {i+1} failed: {e}")
+        
+        results['execution_time'] = time.time() - start_time
+        logger.info(f"Executed {len(statements)} bulk statements in {results['execution_time']:.2f}s")
+        return results
+    
+    def execute_queries_transactional(self, queries: List[Union[str, Tuple[str, Dict[str, Any]]]],
+                                      batch_size: int = 50, atomic: bool = False) -> Dict[str, Any]:
+        """Execute queries in managed write transactions, one transaction per batch
+        
+        Each batch is committed through the driver's retrying transaction functions,
+        so transient failures (deadlocks, leader switches) are retried by the driver
+        instead of being reported. If a batch fails for good, its queries are re-run
+        one per transaction to find the failing ones, and the rest of the batch is
+        still committed. With atomic=True all queries run in a single transaction and
+        nothing is committed if any query fails.
+        
+        Accepts plain query strings or (query, parameters) tuples as produced by
+        generate_bulk_queries, and reports results like execute_queries_batch.
+        """
+        if not self.driver:
+            raise Exception("No active database connection. Call connect() first.")
+        
+        run = _TransactionalRun(queries, self.stats_snapshot)
+        statements = run.statements
+        
+        def run_statements(tx, batch, progress):
+            run.start_attempt(progress)
+            for query, parameters in batch:
+                query_start = time.perf_counter()
+                summary = tx.run(query, parameters).consume()
+                run.statement_done(progress, query, summary, time.perf_counter() - query_start)
+        
+        with self.driver.session(database=self.database) as session:
+            if atomic:
+                progress = {'index': 0}
+                try:
+                    session.execute_write(run_statements, statements, progress)
+                    run.committed(progress, len(statements))
+                except Exception as e:
+                    run.rolled_back(progress, e)
+            else:
+                for i in range(0, len(statements), batch_size):
+                    batch = statements[i:i + batch_size]
+                    logger.info(f"Committing batch {i//batch_size + 1}: queries {i+1} to {i + len(batch)}")
+                    
+                    progress = {'index': 0}
+                    try:
+                        session.execute_write(run_statements, batch, progress)
+                        run.committed(progress, len(batch))
+                        continue
+                    except Exception as e:
+                        logger.warning(f"Batch {i//batch_size + 1} rolled back ({e}); isolating failing queries")
+                    
+                    for j, statement in enumerate(batch):
+                        try:
+                            session.execute_write(run_statements, [statement], progress)
+                            run.committed(progress, 1)
+                        except Exception as e:
+                            run.record_error(i + j, statement[0], e)
+        
+        return run.finish()
+    
+    def schema_statements(self, labels: Optional[List[str]] = None) -> List[str]:
+        """Idempotent constraint statements for Case.id and per-label name uniqueness"""
+        labels = labels or ontology_labels()
+        statements = [
+            "CREATE CONSTRAINT case_id_unique IF NOT EXISTS FOR (n:`Case`) REQUIRE n.id IS UNIQUE"
+        ]
+        for label in sorted(set(labels)):
+            constraint_name = re.sub(r'\W', '_', label.lower()) + "_name_unique"
+            statements.append(
+                f"CREATE CONSTRAINT {constraint_name} IF NOT EXISTS "
+                f"FOR (n:{Neo4jQueryBuilder._quote(label)}) REQUIRE n.name IS UNIQUE"
+            )
+        return statements
+    
+    def bootstrap_schema(self, labels: Optional[List[str]] = None) -> Dict[str, Any]:
+        """Create uniqueness constraints (and their backing indexes) used by ingestion lookups
+        
+        Safe to run on every startup. Fails if existing data already violates a
+        constraint, e.g. duplicate nodes left by the old property-map MERGE queries.
+        """
+        statements = self.schema_statements(labels)
+        logger.info(f"Bootstrapping Neo4j schema with {len(statements)} constraints...")
+        results = self.execute_queries_batch(statements, batch_size=len(statements))
+        
+        if results['error_count']:
+            logger.warning(f"Schema bootstrap finished with {results['error_count']} errors")
+        return results
+    
+    def check_schema(self, labels: Optional[List[str]] = None) -> List[Dict[str, str]]:
+        """Report the (label, property) lookups used by ingestion that have no index"""
+        labels = labels or ontology_labels()
+        expected = [("Case", "id")] + [(label, "name") for label in sorted(set(labels))]
+        
+        indexes = self.execute_query(
+            "SHOW INDEXES YIELD labelsOrTypes, properties, entityType "
+            "WHERE entityType = 'NODE' RETURN labelsOrTypes, properties"
+        )
+        indexed = set()
+        for index in indexes:
+            # Only single-property indexes (or a composite's leading property) serve these lookups
+            for label in index['labelsOrTypes'] or []:
+                if index['properties']:
+                    indexed.add((label, index['properties'][0]))
+        
+        missing = [
+            {'label': label, 'property': prop}
+            for label, prop in expected
+            if (label, prop) not in indexed
+        ]
+        for item in missing:
+            logger.warning(f"Missing index on :{item['label']}({item['property']})")
+        return missing
+    
     def clear_database(self, confirm: bool = False):
         """Clear all nodes and relationships (USE WITH CAUTION!)"""
         if not confirm:
@@ -143,39 +502,140 @@ class Neo4jConnection:
         
         logger.warning("Clearing entire database...")
         self.execute_query("MATCH (n) DETACH DELETE n")
+        self.stats_snapshot.invalidate()
         logger.info("Database cleared successfully")
     
-    def get_database_stats(self) -> Dict[str, Any]:
-        """Get database statistics"""
-        stats_query = """
-        MATCH (n) 
-        WITH labels(n) AS nodeLabels, count(*) AS nodeCount
-        UNWIND nodeLabels AS label
-        RETURN label, sum(nodeCount) AS count
-        ORDER BY count DESC
-        """
+    def get_database_stats(self, max_age: Optional[float] = None, refresh: bool = False) -> Dict[str, Any]:
+        """Get database statistics
         
-        rel_stats_query = """
-        MATCH ()-[r]->()
-        RETURN type(r) AS relationship_type, count(r) AS count
-        ORDER BY count DESC
+        Served from the shared snapshot while it is younger than max_age (default:
+        the snapshot TTL); otherwise read in one round trip, from the count store
+        where db.stats.retrieve is permitted.
         """
+        if not refresh:
+            cached = self.stats_snapshot.get(max_age)
+            if cached is not None:
+                return cached
+        
+        if self.stats_snapshot.count_store_available:
+            try:
+                data = self.execute_query(GRAPH_COUNTS_QUERY)[0]['data']
+                return self.stats_snapshot.replace(_stats_from_graph_counts(data), source='count_store')
+            except Exception as e:
+                logger.warning(f"db.stats.retrieve unavailable ({e}); falling back to a single scan query")
+                self.stats_snapshot.count_store_available = False
+        
+        record = self.execute_query(SCAN_STATS_QUERY)[0]
+        return self.stats_snapshot.replace(_stats_from_scan(record), source='scan')
+
+class AsyncNeo4jConnection:
+    """Asyncio counterpart of Neo4jConnection built on AsyncGraphDatabase"""
+    
+    def __init__(self, database: str = "neo4j", driver=None):
+        self.uri = "bolt://localhost:7687"
+        self.username = "neo4j"
+        self.password = "password"
+        self.database = database
+        self.driver = driver
+        self.stats_snapshot = graph_stats_snapshot(self.uri, database)
+    
+    async def connect(self):
+        """Establish connection to Neo4j database"""
+        try:
+            if self.driver is None:
+                self.driver = get_registry().async_neo4j_driver(self.uri, self.username, self.password)
+            await self.driver.verify_connectivity()
+            logger.info(f"Successfully connected to Neo4j at {self.uri}")
+            return True
+        except Exception as e:
+            logger.error(f"Failed to connect to Neo4j: {e}")
+            return False
+    
+    async def close(self):
+        """Release the connection (the loop's shared driver is closed by ResourceRegistry.aclose)"""
+        if self.driver:
+            self.driver = None
+            logger.info("Neo4j connection closed")
+    
+    async def execute_query(self, query: str, parameters: Dict[str, Any] = None) -> List[Dict[str, Any]]:
+        """Execute a single Cypher query"""
+        if not self.driver:
+            raise Exception("No active database connection. Call connect() first.")
         
-        node_stats = self.execute_query(stats_query)
-        rel_stats = self.execute_query(rel_stats_query)
+        try:
+            async with self.driver.session(database=self.database) as session:
+                start = time.perf_counter()
+                result = await session.run(query, parameters or {})
+                records = [record.data() async for record in result]
+                observe_query("query", time.perf_counter() - start)
+                return records
+        except Exception as e:
+            logger.error(f"Query execution failed: {e}")
+            logger.error(f"Query: {query}")
+            raise
+    
+    async def execute_queries_transactional(self, queries: List[Union[str, Tuple[str, Dict[str, Any]]]],
+                                            batch_size: int = 50, atomic: bool = False) -> Dict[str, Any]:
+        """Async version of Neo4jConnection.execute_queries_transactional"""
+        if not self.driver:
+            raise Exception("No active database connection. Call connect() first.")
         
-        total_nodes_query = "MATCH (n) RETURN count(n) AS total_nodes"
-        total_rels_query = "MATCH ()-[r]->() RETURN count(r) AS total_relationships"
+        run = _TransactionalRun(queries, self.stats_snapshot)
+        statements = run.statements
         
-        total_nodes = self.execute_query(total_nodes_query)[0]['total_nodes']
-        total_rels = self.execute_query(total_rels_query)[0]['total_relationships']
+        async def run_statements(tx, batch, progress):
+            run.start_attempt(progress)
+            for query, parameters in batch:
+                query_start = time.perf_counter()
+                result = await tx.run(query, parameters)
+                summary = await result.consume()
+                run.statement_done(progress, query, summary, time.perf_counter() - query_start)
         
-        return {
-            'total_nodes': total_nodes,
-            'total_relationships': total_rels,
-            'node_types': node_stats,
-            'relationship_types': rel_stats
-        }
+        async with self.driver.session(database=self.database) as session:
+            if atomic:
+                progress = {'index': 0}
+                try:
+                    await session.execute_write(run_statements, statements, progress)
+                    run.committed(progress, len(statements))
+                except Exception as e:
+                    run.rolled_back(progress, e)
+            else:
+                for i in range(0, len(statements), batch_size):
+                    batch = statements[i:i + batch_size]
+                    progress = {'index': 0}
+                    try:
+                        await session.execute_write(run_statements, batch, progress)
+                        run.committed(progress, len(batch))
+                        continue
+                    except Exception as e:
+                        logger.warning(f"Batch {i//batch_size + 1} rolled back ({e}); isolating failing queries")
+                    
+                    for j, statement in enumerate(batch):
+                        try:
+                            await session.execute_write(run_statements, [statement], progress)
+                            run.committed(progress, 1)
+                        except Exception as e:
+                            run.record_error(i + j, statement[0], e)
+        
+        return run.finish()
+    
+    async def get_database_stats(self, max_age: Optional[float] = None, refresh: bool = False) -> Dict[str, Any]:
+        """Async version of Neo4jConnection.get_database_stats (shares its snapshot)"""
+        if not refresh:
+            cached = self.stats_snapshot.get(max_age)
+            if cached is not None:
+                return cached
+        
+        if self.stats_snapshot.count_store_available:
+            try:
+                data = (await self.execute_query(GRAPH_COUNTS_QUERY))[0]['data']
+                return self.stats_snapshot.replace(_stats_from_graph_counts(data), source='count_store')
+            except Exception as e:
+                logger.warning(f"db.stats.retrieve unavailable ({e}); falling back to a single scan query")
+                self.stats_snapshot.count_store_available = False
+        
+        record = (await self.execute_query(SCAN_STATS_QUERY))[0]
+        return self.stats_snapshot.replace(_stats_from_scan(record), source='scan')
 
 class Neo4jQueryBuilder:
     """Builds Neo4j Cypher queries from JSON knowledge graph"""
@@ -187,6 +647,7 @@ class Neo4jQueryBuilder:
     def build_cypher_from_json(self, kg_json: Dict[str, Any]) -> List[str]:
         """Convert JSON KG to Cypher queries"""
         queries = []
+        entity_labels = self._entity_labels(kg_json)
         
         # Build node creation queries
         for entity in kg_json.get('entities', []):
@@ -195,19 +656,101 @@ class Neo4jQueryBuilder:
         
         # Build relationship creation queries
         for rel in kg_json.get('relationships', []):
-            query = self._build_relationship_query(rel)
+            query = self._build_relationship_query(
+                rel,
+                from_label=entity_labels.get(rel['from_entity']),
+                to_label=entity_labels.get(rel['to_entity'])
+            )
             queries.append(query)
         
         return queries
     
+    def build_bulk_from_json(self, kg_json: Dict[str, Any]) -> List[Tuple[str, Dict[str, Any]]]:
+        """Convert JSON KG to parameterized UNWIND statements, one per label and relationship type"""
+        node_rows: Dict[str, List[Dict[str, Any]]] = {}
+        for entity in kg_json.get('entities', []):
+            node_rows.setdefault(self._node_label(entity), []).append({
+                'name': entity['name'],
+                'props': self._property_map(entity.get('properties', {}))
+            })
+        
+        # Group edges by endpoint labels too, so each statement can use the name index
+        entity_labels = self._entity_labels(kg_json)
+        rel_rows: Dict[Tuple[str, Optional[str], Optional[str]], List[Dict[str, Any]]] = {}
+        for rel in kg_json.get('relationships', []):
+            rel_props = dict(rel.get('properties', {}))
+            if rel.get('confidence'):
+                rel_props['confidence'] = rel['confidence']
+            group = (
+                self._relationship_type(rel),
+                entity_labels.get(rel['from_entity']),
+                entity_labels.get(rel['to_entity'])
+            )
+            rel_rows.setdefault(group, []).append({
+                'from_name': rel['from_entity'],
+                'to_name': rel['to_entity'],
+                'props': self._property_map(rel_props)
+            })
+        
+        statements = []
+        for label, rows in node_rows.items():
+            query = f"""UNWIND $rows AS row
+MERGE (n:{self._quote(label)} {{name: row.name}})
+SET n += row.props"""
+            statements.append((query, {'rows': rows}))
+        
+        for (rel_type, from_label, to_label), rows in rel_rows.items():
+            query = f"""UNWIND $rows AS row
+MATCH (a{self._label_pattern(from_label)} {{name: row.from_name}})
+MATCH (b{self._label_pattern(to_label)} {{name: row.to_name}})
+MERGE (a)-[r:{self._quote(rel_type)}]->(b)
+SET r += row.props"""
+            statements.append((query, {'rows': rows}))
+        
+        return statements
+    
+    @staticmethod
+    def _node_label(entity: Dict[str, Any]) -> str:
+        """Neo4j label for an entity, e.g. 'risk factor' -> 'Riskfactor'"""
+        return entity['type'].replace(' ', '').title()
+    
+    def _entity_labels(self, kg_json: Dict[str, Any]) -> Dict[str, str]:
+        """Map entity names to their labels so relationship endpoints can be matched by label"""
+        return {entity['name']: self._node_label(entity) for entity in kg_json.get('entities', [])}
+    
+    @classmethod
+    def _label_pattern(cls, label: Optional[str]) -> str:
+        """':`Label`' for a known label, or '' to match any node"""
+        return f":{cls._quote(label)}" if label else ""
+    
+    @staticmethod
+    def _relationship_type(relationship: Dict[str, Any]) -> str:
+        """Neo4j relationship type for a relationship, e.g. 'treated_by' -> 'TREATED_BY'"""
+        return relationship['relationship_type'].upper()
+    
+    @staticmethod
+    def _quote(identifier: str) -> str:
+        """Backtick-quote a label or relationship type for safe interpolation"""
+        return "`" + identifier.replace("`", "``") + "`"
+    
+    @staticmethod
+    def _property_map(props: Dict[str, Any]) -> Dict[str, Any]:
+        """Coerce properties to Neo4j-storable values the same way the literal queries do"""
+        coerced = {}
+        for key, value in props.items():
+            if isinstance(value, (str, int, float, bool)):
+                coerced[key] = value
+            elif value is not None:
+                coerced[key] = str(value)
+        return coerced
+    
     def _build_node_query(self, entity: Dict[str, Any]) -> str:
         """Build MERGE query for a node"""
-        node_type = entity['type'].replace(' ', '').title()
+        node_type = self._node_label(entity)
         name = entity['name'].replace("'", "\\'")
         
-        # Build properties string
-        props = {"name": name}
-        props.update(entity.get('properties', {}))
+        # Build properties string; nodes are keyed by name, everything else is SET
+        props = dict(entity.get('properties', {}))
         
         # Convert properties to Cypher format
         prop_strings = []
@@ -221,15 +764,18 @@ class Neo4jQueryBuilder:
             elif value is not None:
                 prop_strings.append(f"{key}: '{str(value).replace('\"', '\\\"')}'")
         
-        props_str = ", ".join(prop_strings)
+        merge = f"MERGE (n:{node_type} {{name: '{name}'}})"
+        if not prop_strings:
+            return f"{merge};"
         
-        return f"MERGE (:{node_type} {{{props_str}}});"
+        return f"{merge}\nSET n += {{{', '.join(prop_strings)}}};"
     
-    def _build_relationship_query(self, relationship: Dict[str, Any]) -> str:
+    def _build_relationship_query(self, relationship: Dict[str, Any], from_label: Optional[str] = None,
+                                  to_label: Optional[str] = None) -> str:
         """Build relationship creation query without Cartesian product"""
         from_name = relationship['from_entity'].replace("'", "\\'")
         to_name = relationship['to_entity'].replace("'", "\\'")
-        rel_type = relationship['relationship_type'].upper()
+        rel_type = self._relationship_type(relationship)
         
         # Build relationship properties
         rel_props = relationship.get('properties', {})
@@ -249,16 +795,186 @@ class Neo4jQueryBuilder:
         
         props_str = f" {{{', '.join(prop_strings)}}}" if prop_strings else ""
         
-        return f"""MATCH (a {{name: '{from_name}'}})
-    MATCH (b {{name: '{to_name}'}})
+        return f"""MATCH (a{self._label_pattern(from_label)} {{name: '{from_name}'}})
+    MATCH (b{self._label_pattern(to_label)} {{name: '{to_name}'}})
     MERGE (a)-[:{rel_type}{props_str}]->(b);"""
 
 
+def ontology_labels() -> List[str]:
+    """Neo4j labels produced for the ontology entity types"""
+    return [Neo4jQueryBuilder._node_label({'type': entity_type}) for entity_type in ONTOLOGY_ENTITY_TYPES]
+
+
+def empty_clinical_data() -> Dict[str, Any]:
+    """A PatientCase-shaped dict with no content"""
+    return {
+        'patient_demographics': {},
+        'chief_complaint': '',
+        'entities': [],
+        'relationships': [],
+        'clinical_reasoning': '',
+        'recommendations': []
+    }
+
+def _normalize_name(name: str) -> str:
+    return " ".join(name.lower().split())
+
+def merge_clinical_data(base: Dict[str, Any], addition: Dict[str, Any]) -> Dict[str, Any]:
+    """Merge extracted clinical data into base in place, de-duplicating entities and relationships
+    
+    Entities match on normalized name and relationships on (from, to, type). For
+    entities already in base, missing properties, ICD codes and confidence are
+    filled in from the addition; existing values are kept.
+    """
+    entities_by_name = {_normalize_name(e['name']): e for e in base.setdefault('entities', [])}
+    for entity in addition.get('entities', []):
+        existing = entities_by_name.get(_normalize_name(entity['name']))
+        if existing is None:
+            base['entities'].append(entity)
+            entities_by_name[_normalize_name(entity['name'])] = entity
+            continue
+        
+        for key, value in entity.get('properties', {}).items():
+            existing.setdefault('properties', {}).setdefault(key, value)
+        for key in ('icd_code', 'confidence'):
+            if entity.get(key) and not existing.get(key):
+                existing[key] = entity[key]
+    
+    rel_keys = {
+        (_normalize_name(r['from_entity']), _normalize_name(r['to_entity']), r['relationship_type'].lower())
+        for r in base.setdefault('relationships', [])
+    }
+    for rel in addition.get('relationships', []):
+        key = (_normalize_name(rel['from_entity']), _normalize_name(rel['to_entity']), rel['relationship_type'].lower())
+        if key not in rel_keys:
+            base['relationships'].append(rel)
+            rel_keys.add(key)
+    
+    for key, value in addition.get('patient_demographics', {}).items():
+        if value is not None:
+            base.setdefault('patient_demographics', {}).setdefault(key, value)
+    
+    for key in ('chief_complaint', 'clinical_reasoning'):
+        if addition.get(key) and not base.get(key):
+            base[key] = addition[key]
+    
+    recommendations = base.setdefault('recommendations', [])
+    for recommendation in addition.get('recommendations', []):
+        if recommendation not in recommendations:
+            recommendations.append(recommendation)
+    
+    return base
+
+# ICD-10-CM shape: letter, digit, alphanumeric, then an optional dotted extension
+_ICD10_CODE = re.compile(r"^[A-Z][0-9][0-9A-Z](\.[0-9A-Z]{1,4})?$")
+
+def apply_knowledge_delta(clinical_data: Dict[str, Any], delta: Dict[str, Any]) -> Dict[str, Any]:
+    """Merge an enhancement delta (see KnowledgeDelta) into clinical data in place
+    
+    Added entities and relationships get properties.knowledge_based = true and
+    filled-in ICD codes get properties.icd_code_knowledge_based = true. Parts of
+    the delta that conflict with the case are skipped:
+    
+    - an added entity whose name exists in the case with a different type
+    - a relationship whose endpoint is neither in the case nor added
+    - an ICD code for an unknown entity, a malformed code, or a code that differs
+      from the one the entity already has
+    
+    Returns a summary with the applied counts and the skipped items.
+    """
+    entities_by_name = {_normalize_name(e['name']): e for e in clinical_data.setdefault('entities', [])}
+    conflicts = []
+    
+    added_entities = []
+    for entity in delta.get('added_entities') or []:
+        existing = entities_by_name.get(_normalize_name(entity['name']))
+        if existing is not None and existing.get('type', '').lower() != entity.get('type', '').lower():
+            conflicts.append({'entity': entity['name'],
+                              'reason': f"type {entity.get('type')!r} conflicts with {existing.get('type')!r}"})
+            continue
+        if existing is None:
+            entity.setdefault('properties', {})['knowledge_based'] = True
+        added_entities.append(entity)
+    
+    known_names = set(entities_by_name) | {_normalize_name(e['name']) for e in added_entities}
+    added_relationships = []
+    for rel in delta.get('added_relationships') or []:
+        missing = [rel[end] for end in ('from_entity', 'to_entity') if _normalize_name(rel[end]) not in known_names]
+        if missing:
+            conflicts.append({'relationship': f"{rel['from_entity']} -{rel['relationship_type']}-> {rel['to_entity']}",
+                              'reason': f"unknown entity {missing[0]!r}"})
+            continue
+        rel.setdefault('properties', {})['knowledge_based'] = True
+        added_relationships.append(rel)
+    
+    entity_count = len(clinical_data['entities'])
+    relationship_count = len(clinical_data.setdefault('relationships', []))
+    merge_clinical_data(clinical_data, {'entities': added_entities, 'relationships': added_relationships})
+    entities_by_name = {_normalize_name(e['name']): e for e in clinical_data['entities']}
+    
+    icd_codes = 0
+    for update in delta.get('icd_codes') or []:
+        entity = entities_by_name.get(_normalize_name(update['entity']))
+        code = (update.get('icd_code') or '').strip().upper()
+        if entity is None:
+            reason = "unknown entity"
+        elif not _ICD10_CODE.match(code):
+            reason = f"malformed ICD-10 code {code!r}"
+        elif entity.get('icd_code') and entity['icd_code'].strip().upper() != code:
+            reason = f"code {code!r} conflicts with {entity['icd_code']!r}"
+        else:
+            if not entity.get('icd_code'):
+                entity['icd_code'] = code
+                entity.setdefault('properties', {})['icd_code_knowledge_based'] = True
+                icd_codes += 1
+            continue
+        conflicts.append({'entity': update['entity'], 'icd_code': update.get('icd_code'), 'reason': reason})
+    
+    for conflict in conflicts:
+        logger.warning(f"Skipped enhancement: {conflict}")
+    return {
+        'added_entities': len(clinical_data['entities']) - entity_count,
+        'added_relationships': len(clinical_data['relationships']) - relationship_count,
+        'icd_codes': icd_codes,
+        'conflicts': conflicts
+    }
+
+# Stream the extraction response and validate entities as they arrive (see kg_stream)
+STREAM_EXTRACTION = os.getenv("KG_STREAM_EXTRACTION", "0") == "1"
+# Extraction cache hits/misses of the case being built in the current thread or asyncio task
+_case_cache_stats: contextvars.ContextVar[Optional[Dict[str, int]]] = contextvars.ContextVar(
+    'case_cache_stats', default=None
+)
+# Enhancement summary (see apply_knowledge_delta) of the case being built
+_case_enhancement: contextvars.ContextVar[Optional[Dict[str, Any]]] = contextvars.ContextVar(
+    'case_enhancement', default=None
+)
+
 class MedicalKGBuilder:
-    def __init__(self, model: str = "gpt-4"):
-        self.llm = ChatOpenAI(model=model, api_key=os.getenv('OPENAI_API_KEY'), temperature=0.1)
+    def __init__(self, model: str = "gpt-4", cache: Optional[ExtractionCache] = None,
+                 refresh_cache: bool = False, llm=None, pre_extractor=None, router=None):
+        self.model = model
+        self.cache = cache
+        self.refresh_cache = refresh_cache
+        from langchain.prompts import ChatPromptTemplate
+        from langchain_core.output_parsers import JsonOutputParser
+        from kg_models import PatientCase, KnowledgeDelta
+        
+        # Any LangChain chat model can be injected; by default the shared client from kg_resources
+        self.llm = llm or get_registry().llm(model, temperature=0.1)
         self.json_parser = JsonOutputParser(pydantic_object=PatientCase)
+        self.delta_parser = JsonOutputParser(pydantic_object=KnowledgeDelta)
         self.query_builder = Neo4jQueryBuilder()
+        # Lexicon pre-extraction (see kg_lexicon); by default enabled with KG_PREEXTRACT=1
+        if pre_extractor is None:
+            from kg_lexicon import default_pre_extractor
+            pre_extractor = default_pre_extractor()
+        self.pre_extractor = pre_extractor
+        # Tiered routing (see model_router); by default enabled with KG_ROUTING=1. self.llm is the large model
+        if router is None:
+            from model_router import default_model_router
+            router = default_model_router()
+        self.router = router
         
         # LLM prompt for clinical report analysis
         self.analysis_prompt = ChatPromptTemplate.from_messages([
@@ -297,23 +1013,224 @@ Your task is to analyze medical reports and extract structured clinical informat
 {format_instructions}"""),
             ("human", "Please analyze this medical report and extract structured clinical information:\n\n{medical_report}")
         ])
+        
+        # LLM prompt for knowledge enhancement; the model returns only a delta (KnowledgeDelta)
+        self.enhancement_prompt = ChatPromptTemplate.from_messages([
+            ("system", """You are a medical knowledge expert. Given extracted clinical entities and relationships, return ONLY the additions that enhance them:
+
+1. **Missing ICD-10 codes** for conditions (icd_codes, using the exact entity names)
+2. **Additional clinical relationships** based on medical knowledge
+3. **Standard medical classifications** and properties
+4. **Contraindications and interactions**
+5. **Typical diagnostic workups** for identified conditions
+6. **Evidence-based treatment protocols**
+
+Only add relationships that are clinically established; they may connect existing and added entities (use the exact names).
+Do not repeat existing entities, relationships or codes.
+
+{format_instructions}"""),
+            ("human", "Chief complaint: {chief_complaint}\n\nEntities (name | type | ICD-10 code):\n{entities}\n\nRelationships:\n{relationships}")
+        ])
+    
+        # LLM prompt for reconciling a report with a draft built during the conversation
+        self.reconciliation_prompt = ChatPromptTemplate.from_messages([
+            ("system", """You are a medical AI expert specializing in clinical data extraction and knowledge graph construction.
+
+A draft knowledge graph was already extracted from the patient conversation. Analyze the final clinical
+report and return ONLY what the draft is missing:
+- entities (conditions, differential diagnoses, tests, treatments, medications, risk factors, findings) not in the draft
+- relationships not in the draft; they may connect new entities and draft entities (use the exact draft names)
+- chief complaint, patient demographics, clinical reasoning and recommendations from the report
+
+Do not repeat draft entities or relationships. Use standard medical terminology and include confidence levels.
+
+{format_instructions}"""),
+            ("human", "Draft entities (name | type):\n{draft_entities}\n\nDraft relationships:\n{draft_relationships}\n\nFinal clinical report:\n\n{medical_report}")
+        ])
+    
+        # LLM prompt for completing lexicon candidates (see kg_lexicon); only the passages the lexicon
+        # could not explain are sent, with a compact output format instead of the full JSON schema
+        self.annotation_prompt = ChatPromptTemplate.from_messages([
+            ("system", """You are a medical AI expert specializing in clinical data extraction.
+
+A clinical lexicon already found the entities listed below in a medical report. You are given only the report
+passages the lexicon could not fully explain. Return ONLY what the list is missing: new entities, relationships
+between any entities (use the exact listed names), and the chief complaint, demographics, reasoning and
+recommendations if the passages state them. Include confidence levels (high/moderate/low); hedged mentions
+("suspected", "possible") are low.
+
+Answer with one JSON object:
+{{"chief_complaint": "", "patient_demographics": {{}}, "entities": [{{"name": "", "type": "", "icd_code": null,
+"confidence": ""}}], "relationships": [{{"from_entity": "", "to_entity": "", "relationship_type": "",
+"confidence": ""}}], "clinical_reasoning": "", "recommendations": []}}"""),
+            ("human", "Entities found (name | type):\n{entities}\n\nReport passages:\n{passages}")
+        ])
+    
+    def _analysis_messages(self, report: str):
+        """Format the extraction prompt for a report"""
+        return self.analysis_prompt.format_messages(
+            medical_report=report,
+            format_instructions=self.json_parser.get_format_instructions()
+        )
+    
+    def _reconciliation_messages(self, report: str, draft: Dict[str, Any]):
+        """Format the reconciliation prompt; the draft is sent as compact name lists"""
+        draft_entities = "\n".join(f"{e['name']} | {e['type']}" for e in draft.get('entities', []))
+        draft_relationships = "\n".join(
+            f"{r['from_entity']} -{r['relationship_type']}-> {r['to_entity']}" for r in draft.get('relationships', [])
+        )
+        return self.reconciliation_prompt.format_messages(
+            medical_report=report,
+            draft_entities=draft_entities or "(none)",
+            draft_relationships=draft_relationships or "(none)",
+            format_instructions=self.json_parser.get_format_instructions()
+        )
+    
+    def _annotation_messages(self, pre):
+        """Format the pre-annotation prompt for lexicon candidates (a kg_lexicon.PreExtraction)"""
+        return self.annotation_prompt.format_messages(
+            entities="\n".join(f"{e['name']} | {e['type']}" for e in pre.entities) or "(none)",
+            passages="\n".join(pre.unresolved) or "(none)"
+        )
+    
+    def _enhancement_messages(self, clinical_data: Dict[str, Any]):
+        """Format the enhancement prompt; the case is sent as compact name lists"""
+        entities = "\n".join(
+            f"{e['name']} | {e.get('type', '')} | {e.get('icd_code') or '-'}" for e in clinical_data.get('entities', [])
+        )
+        relationships = "\n".join(
+            f"{r['from_entity']} -{r['relationship_type']}-> {r['to_entity']}" for r in clinical_data.get('relationships', [])
+        )
+        return self.enhancement_prompt.format_messages(
+            chief_complaint=clinical_data.get('chief_complaint') or "(none)",
+            entities=entities or "(none)",
+            relationships=relationships or "(none)",
+            format_instructions=self.delta_parser.get_format_instructions()
+        )
+    
+    def _cache_model(self, stage: str, messages, routed: bool) -> str:
+        # Results of the local route are keyed by the local model, so they are never served as large-model ones
+        if not routed or self.router is None:
+            return self.model
+        route, _ = self.router.route_extraction(stage, messages[-1].content)
+        return route.model if route.local else self.model
+    
+    def _cache_lookup(self, stage: str, messages, routed: bool = True) -> Tuple[Optional[str], Optional[Dict[str, Any]]]:
+        """Return (cache_key, cached_result); the key is None when caching is disabled
+        
+        With refresh_cache the lookup is skipped (counted as a miss) so the fresh
+        LLM result overwrites the stored entry. The key includes the model the
+        router picks for the call (routed=False for calls that bypass the router).
+        """
+        if self.cache is None:
+            return None, None
+        
+        key = ExtractionCache.make_key(self._cache_model(stage, messages, routed), stage,
+                                       [(m.type, m.content) for m in messages])
+        cached = None if self.refresh_cache else self.cache.get(key)
+        
+        case_stats = _case_cache_stats.get()
+        if case_stats is not None:
+            case_stats['hits' if cached is not None else 'misses'] += 1
+        
+        if cached is not None:
+            logger.info(f"Using cached {stage} result")
+        return key, cached
+    
+    def _record_llm_call(self, stage: str, messages, content: str, usage: Optional[Dict[str, Any]] = None,
+                         model: Optional[str] = None) -> Tuple[int, int]:
+        """Count an LLM call in kg_metrics, with the provider's token usage when it reports one"""
+        usage = usage or {}
+        return record_llm_call(model or self.model, stage,
+                               sum(len(str(m.content).encode()) for m in messages), len(content.encode()),
+                               usage.get('input_tokens'), usage.get('output_tokens'))
+    
+    def _route_llm(self, route):
+        """Chat model for a route; the large route is self.llm, so an injected model is kept"""
+        if route is None or not route.local:
+            return self.llm, self.model
+        return route.llm(temperature=0.1), route.model
+    
+    def _invoke(self, stage: str, messages, route=None):
+        """LLM call on self.llm (or the route's model), timed as llm.<stage> and counted in the LLM metrics
+        
+        Returns the response and its (input, output) tokens.
+        """
+        llm, model = self._route_llm(route)
+        with span(f"llm.{stage}"):
+            response = llm.invoke(messages)
+        tokens = self._record_llm_call(stage, messages, response.content, getattr(response, 'usage_metadata', None),
+                                       model)
+        return response, tokens
     
+    async def _ainvoke(self, stage: str, messages, route=None):
+        """Async version of _invoke"""
+        llm, model = self._route_llm(route)
+        with span(f"llm.{stage}"):
+            response = await llm.ainvoke(messages)
+        tokens = self._record_llm_call(stage, messages, response.content, getattr(response, 'usage_metadata', None),
+                                       model)
+        return response, tokens
+    
+    def _parse(self, parser, content: str) -> Dict[str, Any]:
+        with span("parse_json"):
+            return parser.parse(content)
+    
+    def _parse_routed(self, route, parser, content: str) -> Optional[Dict[str, Any]]:
+        # Output the local model got wrong is escalated (check_extraction) rather than raised
+        try:
+            return self._parse(parser, content)
+        except Exception:
+            if not route.local:
+                raise
+            return None
+    
+    def _generate(self, stage: str, messages, parser) -> Dict[str, Any]:
+        """LLM call and JSON parse for a stage, through the router when there is one
+        
+        The router picks the local or large model from the stage and the prompt
+        input, and repeats the call on the large model when the local result
+        fails router.check_extraction.
+        """
+        if self.router is None:
+            response, _ = self._invoke(stage, messages)
+            return self._parse(parser, response.content)
+        
+        def call(route):
+            response, (input_tokens, output_tokens) = self._invoke(stage, messages, route)
+            return self._parse_routed(route, parser, response.content), input_tokens, output_tokens
+        
+        return self.router.run(stage, self.router.route_extraction(stage, messages[-1].content), call,
+                               lambda data: self.router.check_extraction(stage, data))
+    
+    async def _agenerate(self, stage: str, messages, parser) -> Dict[str, Any]:
+        """Async version of _generate"""
+        if self.router is None:
+            response, _ = await self._ainvoke(stage, messages)
+            return self._parse(parser, response.content)
+        
+        async def call(route):
+            response, (input_tokens, output_tokens) = await self._ainvoke(stage, messages, route)
+            return self._parse_routed(route, parser, response.content), input_tokens, output_tokens
+        
+        return await self.router.arun(stage, self.router.route_extraction(stage, messages[-1].content), call,
+                                      lambda data: self.router.check_extraction(stage, data))
+    
+    @timed("analyze_medical_report")
     def analyze_medical_report(self, report: str) -> Dict[str, Any]:
         """Use LLM to convert medical report to structured JSON"""
         logger.info("Analyzing medical report with LLM...")
         
         try:
             # Format the prompt
-            formatted_prompt = self.analysis_prompt.format_messages(
-                medical_report=report,
-                format_instructions=self.json_parser.get_format_instructions()
-            )
-            
-            # Get LLM response
-            response = self.llm.invoke(formatted_prompt)
+            formatted_prompt = self._analysis_messages(report)
             
-            # Parse JSON response
-            parsed_data = self.json_parser.parse(response.content)
+            cache_key, parsed_data = self._cache_lookup("analysis", formatted_prompt)
+            if parsed_data is None:
+                # Get and parse the LLM response
+                parsed_data = self._generate("analysis", formatted_prompt, self.json_parser)
+                if cache_key:
+                    self.cache.put(cache_key, parsed_data)
             
             logger.info(f"Successfully extracted {len(parsed_data.get('entities', []))} entities and {len(parsed_data.get('relationships', []))} relationships")
             
@@ -323,52 +1240,357 @@ Your task is to analyze medical reports and extract structured clinical informat
             logger.error(f"Error analyzing medical report: {e}")
             raise
     
+    def _replay_cached(self, parsed_data: Dict[str, Any], on_entity, on_relationship):
+        """Hand a cached extraction to streaming callbacks as if it had just been streamed"""
+        for entity in parsed_data.get('entities', []):
+            if on_entity is not None:
+                on_entity(entity)
+        for relationship in parsed_data.get('relationships', []):
+            if on_relationship is not None:
+                on_relationship(relationship)
+    
+    @timed("analyze_medical_report")
+    def analyze_medical_report_streaming(self, report: str, on_entity=None, on_relationship=None,
+                                         max_invalid: int = 0) -> Dict[str, Any]:
+        """Streaming analyze_medical_report: entities are validated and passed on as they are generated
+        
+        on_entity / on_relationship receive each element as soon as it validates
+        against ClinicalEntity / ClinicalRelationship. The generation is abandoned
+        (ExtractionAborted) as soon as the output cannot become a valid case, instead
+        of after the full response has been paid for.
+        """
+        from kg_stream import StreamingCaseParser, ExtractionAborted
+        logger.info("Analyzing medical report with streamed LLM output...")
+        
+        formatted_prompt = self._analysis_messages(report)
+        # Streaming always runs on self.llm
+        cache_key, parsed_data = self._cache_lookup("analysis", formatted_prompt, routed=False)
+        if parsed_data is not None:
+            self._replay_cached(parsed_data, on_entity, on_relationship)
+            return parsed_data
+        
+        parser = StreamingCaseParser(on_entity=on_entity, on_relationship=on_relationship, max_invalid=max_invalid)
+        stream = self.llm.stream(formatted_prompt)
+        try:
+            with span("llm.analysis"):
+                for chunk in stream:
+                    parser.feed(chunk.content)
+        except ExtractionAborted as e:
+            logger.error(f"Aborted extraction after {len(parser.text)} characters: {e}")
+            raise
+        finally:
+            # Stops the HTTP stream, so an aborted generation is not paid for any further
+            stream.close()
+            self._record_llm_call("analysis", formatted_prompt, parser.text)
+        
+        parsed_data = self._parse(self.json_parser, parser.close())
+        if cache_key:
+            self.cache.put(cache_key, parsed_data)
+        
+        logger.info(f"Successfully extracted {len(parsed_data.get('entities', []))} entities and {len(parsed_data.get('relationships', []))} relationships")
+        return parsed_data
+    
+    @timed("analyze_medical_report")
+    async def aanalyze_medical_report_streaming(self, report: str, on_entity=None, on_relationship=None,
+                                                max_invalid: int = 0) -> Dict[str, Any]:
+        """Async version of analyze_medical_report_streaming"""
+        from kg_stream import StreamingCaseParser, ExtractionAborted
+        logger.info("Analyzing medical report with streamed LLM output...")
+        
+        formatted_prompt = self._analysis_messages(report)
+        # Streaming always runs on self.llm
+        cache_key, parsed_data = self._cache_lookup("analysis", formatted_prompt, routed=False)
+        if parsed_data is not None:
+            self._replay_cached(parsed_data, on_entity, on_relationship)
+            return parsed_data
+        
+        parser = StreamingCaseParser(on_entity=on_entity, on_relationship=on_relationship, max_invalid=max_invalid)
+        stream = self.llm.astream(formatted_prompt)
+        try:
+            with span("llm.analysis"):
+                async for chunk in stream:
+                    parser.feed(chunk.content)
+        except ExtractionAborted as e:
+            logger.error(f"Aborted extraction after {len(parser.text)} characters: {e}")
+            raise
+        finally:
+            await stream.aclose()
+            self._record_llm_call("analysis", formatted_prompt, parser.text)
+        
+        parsed_data = self._parse(self.json_parser, parser.close())
+        if cache_key:
+            self.cache.put(cache_key, parsed_data)
+        
+        logger.info(f"Successfully extracted {len(parsed_data.get('entities', []))} entities and {len(parsed_data.get('relationships', []))} relationships")
+        return parsed_data
+    
+    @timed("reconcile_with_draft")
+    def reconcile_with_draft(self, report: str, draft: Dict[str, Any]) -> Dict[str, Any]:
+        """Extract only what a conversation-time draft is missing from the report and merge it in
+        
+        The LLM returns a delta rather than the whole case, so the final pass
+        generates far fewer output tokens than a full analyze_medical_report call.
+        """
+        logger.info(f"Reconciling report with draft of {len(draft.get('entities', []))} entities...")
+        
+        formatted_prompt = self._reconciliation_messages(report, draft)
+        cache_key, delta = self._cache_lookup("reconciliation", formatted_prompt)
+        if delta is None:
+            delta = self._generate("reconciliation", formatted_prompt, self.json_parser)
+            if cache_key:
+                self.cache.put(cache_key, delta)
+        
+        clinical_data = merge_clinical_data(json.loads(json.dumps(draft)), delta)
+        logger.info(f"Reconciled case has {len(clinical_data['entities'])} entities and {len(clinical_data['relationships'])} relationships")
+        return clinical_data
+    
+    @timed("reconcile_with_draft")
+    async def areconcile_with_draft(self, report: str, draft: Dict[str, Any]) -> Dict[str, Any]:
+        """Async version of reconcile_with_draft"""
+        logger.info(f"Reconciling report with draft of {len(draft.get('entities', []))} entities...")
+        
+        formatted_prompt = self._reconciliation_messages(report, draft)
+        cache_key, delta = self._cache_lookup("reconciliation", formatted_prompt)
+        if delta is None:
+            delta = await self._agenerate("reconciliation", formatted_prompt, self.json_parser)
+            if cache_key:
+                self.cache.put(cache_key, delta)
+        
+        return merge_clinical_data(json.loads(json.dumps(draft)), delta)
+    
+    @timed("complete_pre_annotation")
+    def complete_pre_annotation(self, pre) -> Dict[str, Any]:
+        """Extract what the lexicon candidates of a report miss and merge it into them
+        
+        The LLM sees the candidate names and the report sentences the lexicon
+        could not explain rather than the whole report and output schema.
+        """
+        logger.info(f"Completing {len(pre.entities)} lexicon candidates from {len(pre.unresolved)} passages...")
+        
+        formatted_prompt = self._annotation_messages(pre)
+        cache_key, delta = self._cache_lookup("annotation", formatted_prompt)
+        if delta is None:
+            delta = self._generate("annotation", formatted_prompt, self.json_parser)
+            if cache_key:
+                self.cache.put(cache_key, delta)
+        
+        return self._merge_annotation(pre, delta)
+    
+    @timed("complete_pre_annotation")
+    async def acomplete_pre_annotation(self, pre) -> Dict[str, Any]:
+        """Async version of complete_pre_annotation"""
+        formatted_prompt = self._annotation_messages(pre)
+        cache_key, delta = self._cache_lookup("annotation", formatted_prompt)
+        if delta is None:
+            delta = await self._agenerate("annotation", formatted_prompt, self.json_parser)
+            if cache_key:
+                self.cache.put(cache_key, delta)
+        
+        return self._merge_annotation(pre, delta)
+    
+    def _merge_annotation(self, pre, delta: Dict[str, Any]) -> Dict[str, Any]:
+        clinical_data = merge_clinical_data(pre.draft(), delta)
+        if not clinical_data.get('chief_complaint'):
+            clinical_data['chief_complaint'] = pre.chief_complaint
+        logger.info(f"Completed case has {len(clinical_data['entities'])} entities and {len(clinical_data['relationships'])} relationships")
+        return clinical_data
+    
+    @timed("enhance_with_medical_knowledge")
     def enhance_with_medical_knowledge(self, clinical_data: Dict[str, Any]) -> Dict[str, Any]:
         """Enhance extracted data with additional medical knowledge"""
         logger.info("Enhancing with medical knowledge...")
         
-        enhancement_prompt = ChatPromptTemplate.from_messages([
-            ("system", """You are a medical knowledge expert. Given extracted clinical entities and relationships, enhance them with:
-
-1. **Missing ICD-10 codes** for conditions
-2. **Additional clinical relationships** based on medical knowledge
-3. **Standard medical classifications** and properties
-4. **Contraindications and interactions**
-5. **Typical diagnostic workups** for identified conditions
-6. **Evidence-based treatment protocols**
-
-Only add relationships that are clinically established. Mark generated relationships with "knowledge_based": true.
-
-Return the enhanced data in the same JSON format."""),
-            ("human", "Enhance this clinical data:\n\n{clinical_data}")
-        ])
+        try:
+            formatted_prompt = self._enhancement_messages(clinical_data)
+            
+            cache_key, delta = self._cache_lookup("enhancement", formatted_prompt)
+            if delta is None:
+                delta = self._generate("enhancement", formatted_prompt, self.delta_parser)
+                if cache_key:
+                    self.cache.put(cache_key, delta)
+            
+            return self._apply_enhancement(clinical_data, delta)
+            
+        except Exception as e:
+            logger.warning(f"Error enhancing data: {e}. Using original data.")
+            return clinical_data
+    
+    def _apply_enhancement(self, clinical_data: Dict[str, Any], delta: Dict[str, Any]) -> Dict[str, Any]:
+        """Merge an enhancement delta into a copy of the case"""
+        enhanced_data = json.loads(json.dumps(clinical_data))
+        summary = apply_knowledge_delta(enhanced_data, json.loads(json.dumps(delta)))
+        case_enhancement = _case_enhancement.get()
+        if case_enhancement is not None:
+            case_enhancement.update(summary)
+        logger.info(f"Enhanced clinical data with {summary['added_entities']} entities, "
+                    f"{summary['added_relationships']} relationships and {summary['icd_codes']} ICD codes "
+                    f"({len(summary['conflicts'])} conflicts skipped)")
+        return enhanced_data
+    
+    @timed("analyze_medical_report")
+    async def aanalyze_medical_report(self, report: str) -> Dict[str, Any]:
+        """Async version of analyze_medical_report"""
+        logger.info("Analyzing medical report with LLM...")
         
         try:
-            formatted_prompt = enhancement_prompt.format_messages(
-                clinical_data=json.dumps(clinical_data, indent=2)
-            )
+            formatted_prompt = self._analysis_messages(report)
+            
+            cache_key, parsed_data = self._cache_lookup("analysis", formatted_prompt)
+            if parsed_data is None:
+                parsed_data = await self._agenerate("analysis", formatted_prompt, self.json_parser)
+                if cache_key:
+                    self.cache.put(cache_key, parsed_data)
+            
+            logger.info(f"Successfully extracted {len(parsed_data.get('entities', []))} entities and {len(parsed_data.get('relationships', []))} relationships")
+            
+            return parsed_data
             
-            response = self.llm.invoke(formatted_prompt)
-            enhanced_data = self.json_parser.parse(response.content)
+        except Exception as e:
+            logger.error(f"Error analyzing medical report: {e}")
+            raise
+    
+    @timed("enhance_with_medical_knowledge")
+    async def aenhance_with_medical_knowledge(self, clinical_data: Dict[str, Any]) -> Dict[str, Any]:
+        """Async version of enhance_with_medical_knowledge"""
+        logger.info("Enhancing with medical knowledge...")
+        
+        try:
+            formatted_prompt = self._enhancement_messages(clinical_data)
+            
+            cache_key, delta = self._cache_lookup("enhancement", formatted_prompt)
+            if delta is None:
+                delta = await self._agenerate("enhancement", formatted_prompt, self.delta_parser)
+                if cache_key:
+                    self.cache.put(cache_key, delta)
             
-            logger.info("Successfully enhanced clinical data with medical knowledge")
-            return enhanced_data
+            return self._apply_enhancement(clinical_data, delta)
             
         except Exception as e:
             logger.warning(f"Error enhancing data: {e}. Using original data.")
             return clinical_data
     
-    def build_knowledge_graph(self, report: str, enhance: bool = False) -> Dict[str, Any]:
-        """Complete pipeline: report → JSON → enhanced KG"""
+    @timed("lexicon_pre_extract")
+    def _pre_extract(self, report: str, draft: Optional[Dict[str, Any]]):
+        """Lexicon candidates for a report, or None when pre-extraction is off or a draft is given"""
+        if self.pre_extractor is None or (draft and draft.get('entities')):
+            return None
+        pre = self.pre_extractor.extract(report)
+        logger.info(f"Lexicon matched {len(pre.entities)} entities; "
+                    f"{'skipping the LLM' if pre.skip_llm else 'LLM needed'} ({pre.reason})")
+        return pre
+    
+    def _pre_extraction_savings(self, report: str, pre, clinical_data: Dict[str, Any]) -> Dict[str, Any]:
+        """LLM calls and (estimated, ~4 characters per token) tokens the lexicon saved for a case
         
-        # Step 1: Extract structured data from report
-        clinical_data = self.analyze_medical_report(report)
+        A skipped call saves the analysis prompt and the JSON it would have
+        returned. A pre-annotated call saves the difference between the analysis and
+        annotation prompts plus the candidate entities the LLM did not have to write.
+        """
+        def tokens(text_length: int) -> int:
+            return round(text_length / 4)
+        
+        analysis_chars = sum(len(m.content) for m in self._analysis_messages(report))
+        if pre.skip_llm:
+            input_saved = tokens(analysis_chars)
+            output_saved = tokens(len(json.dumps(clinical_data)))
+        elif pre.entities:
+            annotation_chars = sum(len(m.content) for m in self._annotation_messages(pre))
+            input_saved = tokens(analysis_chars - annotation_chars)
+            output_saved = tokens(len(json.dumps(pre.entities)))
+        else:
+            input_saved = output_saved = 0
+        return {
+            'candidates': len(pre.entities),
+            'negated': pre.negated,
+            'skipped_llm': pre.skip_llm,
+            'reason': pre.reason,
+            'llm_calls_saved': 1 if pre.skip_llm else 0,
+            'estimated_input_tokens_saved': input_saved,
+            'estimated_output_tokens_saved': output_saved
+        }
+    
+    @timed("build_knowledge_graph")
+    def build_knowledge_graph(self, report: str, enhance: bool = False,
+                              draft: Optional[Dict[str, Any]] = None,
+                              stream: Optional[bool] = None) -> Dict[str, Any]:
+        """Complete pipeline: report → JSON → enhanced KG
         
-        # Step 2: Enhance with medical knowledge (optional)
-        if enhance:
-            clinical_data = self.enhance_with_medical_knowledge(clinical_data)
+        With a draft (see IncrementalCaseExtractor) the report is reconciled against
+        it instead of being extracted from scratch. With stream (default:
+        STREAM_EXTRACTION) extraction goes through analyze_medical_report_streaming.
+        """
+        stream = STREAM_EXTRACTION if stream is None else stream
+        cache_stats = {'hits': 0, 'misses': 0}
+        enhancement = {}
+        token = _case_cache_stats.set(cache_stats)
+        enhancement_token = _case_enhancement.set(enhancement)
+        pre = self._pre_extract(report, draft)
+        lexicon = None
+        try:
+            # Step 1: Extract structured data from report
+            if draft and draft.get('entities'):
+                clinical_data = self.reconcile_with_draft(report, draft)
+            elif pre is not None and pre.skip_llm:
+                clinical_data = pre.to_clinical_data()
+            elif pre is not None and pre.entities:
+                # Pre-annotated: the LLM only returns what the lexicon missed
+                clinical_data = self.complete_pre_annotation(pre)
+            elif stream:
+                clinical_data = self.analyze_medical_report_streaming(report)
+            else:
+                clinical_data = self.analyze_medical_report(report)
+            if pre is not None:
+                lexicon = self._pre_extraction_savings(report, pre, clinical_data)
+            
+            # Step 2: Enhance with medical knowledge (optional)
+            if enhance:
+                clinical_data = self.enhance_with_medical_knowledge(clinical_data)
+        finally:
+            _case_cache_stats.reset(token)
+            _case_enhancement.reset(enhancement_token)
         
         # Step 3: Add metadata
+        return self._add_metadata(clinical_data, enhance, cache_stats, enhancement, lexicon)
+    
+    @timed("build_knowledge_graph")
+    async def abuild_knowledge_graph(self, report: str, enhance: bool = False,
+                                     draft: Optional[Dict[str, Any]] = None,
+                                     stream: Optional[bool] = None) -> Dict[str, Any]:
+        """Async version of build_knowledge_graph"""
+        stream = STREAM_EXTRACTION if stream is None else stream
+        cache_stats = {'hits': 0, 'misses': 0}
+        enhancement = {}
+        token = _case_cache_stats.set(cache_stats)
+        enhancement_token = _case_enhancement.set(enhancement)
+        pre = self._pre_extract(report, draft)
+        lexicon = None
+        try:
+            if draft and draft.get('entities'):
+                clinical_data = await self.areconcile_with_draft(report, draft)
+            elif pre is not None and pre.skip_llm:
+                clinical_data = pre.to_clinical_data()
+            elif pre is not None and pre.entities:
+                clinical_data = await self.acomplete_pre_annotation(pre)
+            elif stream:
+                clinical_data = await self.aanalyze_medical_report_streaming(report)
+            else:
+                clinical_data = await self.aanalyze_medical_report(report)
+            if pre is not None:
+                lexicon = self._pre_extraction_savings(report, pre, clinical_data)
+            
+            if enhance:
+                clinical_data = await self.aenhance_with_medical_knowledge(clinical_data)
+        finally:
+            _case_cache_stats.reset(token)
+            _case_enhancement.reset(enhancement_token)
+        
+        return self._add_metadata(clinical_data, enhance, cache_stats, enhancement, lexicon)
+    
+    def _add_metadata(self, clinical_data: Dict[str, Any], enhance: bool,
+                      cache_stats: Optional[Dict[str, int]] = None,
+                      enhancement: Optional[Dict[str, Any]] = None,
+                      lexicon: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """Attach case id, timestamps and counts to extracted clinical data"""
         clinical_data['metadata'] = {
             'created_at': datetime.now().isoformat(),
             'case_id': str(uuid.uuid4()),
@@ -376,9 +1598,16 @@ Return the enhanced data in the same JSON format."""),
             'relationship_count': len(clinical_data.get('relationships', [])),
             'enhanced': enhance
         }
+        if self.cache is not None and cache_stats is not None:
+            clinical_data['metadata']['cache'] = cache_stats
+        if enhancement:
+            clinical_data['metadata']['enhancement'] = enhancement
+        if lexicon is not None:
+            clinical_data['metadata']['lexicon'] = lexicon
         
         return clinical_data
     
+    @timed("generate_cypher_queries")
     def generate_cypher_queries(self, kg_json: Dict[str, Any]) -> List[str]:
         """Generate Neo4j Cypher queries from JSON KG"""
         logger.info("Generating Cypher queries...")
@@ -388,97 +1617,333 @@ Return the enhanced data in the same JSON format."""),
         # Add case creation query
         case_id = kg_json.get('metadata', {}).get('case_id', str(uuid.uuid4()))
         case_query = f"""
-MERGE (case:Case {{
-    id: '{case_id}',
-    chief_complaint: '{kg_json.get('chief_complaint', '').replace("'", "\\'")}',
-    created_at: '{kg_json.get('metadata', {}).get('created_at', '')}',
-    clinical_reasoning: '{kg_json.get('clinical_reasoning', '').replace("'", "\\'")}'
-}});"""
+MERGE (case:Case {{id: '{case_id}'}})
+SET case.chief_complaint = '{kg_json.get('chief_complaint', '').replace("'", "\\'")}',
+    case.created_at = '{kg_json.get('metadata', {}).get('created_at', '')}',
+    case.clinical_reasoning = '{kg_json.get('clinical_reasoning', '').replace("'", "\\'")}';"""
         
         queries.insert(0, case_query)
         
         logger.info(f"Generated {len(queries)} Cypher queries")
         return queries
     
-    def save_to_files(self, kg_json: Dict[str, Any], base_filename: str = "medical_kg"):
-        """Save KG JSON and Cypher queries to files"""
+    @timed("generate_bulk_queries")
+    def generate_bulk_queries(self, kg_json: Dict[str, Any]) -> List[Tuple[str, Dict[str, Any]]]:
+        """Generate parameterized UNWIND statements for bulk ingestion of a JSON KG
         
-        # Save JSON
-        json_filename = f"{base_filename}.json"
-        with open(json_filename, 'w', encoding='utf-8') as f:
-            json.dump(kg_json, f, indent=2, ensure_ascii=False)
+        Produces the same graph as generate_cypher_queries, but with one statement
+        per entity label and relationship type instead of one per element.
+        """
+        logger.info("Generating bulk Cypher statements...")
         
-        # Save Cypher queries
-        cypher_filename = f"{base_filename}.cypher"
-        queries = self.generate_cypher_queries(kg_json)
+        statements = self.query_builder.build_bulk_from_json(kg_json)
         
-        with open(cypher_filename, 'w', encoding='utf-8') as f:
-            f.write("// Medical Knowledge Graph - Auto-generated Cypher Queries\n")
-            f.write(f"// Generated at: {datetime.now()}\n\n")
+        metadata = kg_json.get('metadata', {})
+        case_query = """MERGE (case:Case {id: $id})
+SET case += $props"""
+        statements.insert(0, (case_query, {
+            'id': metadata.get('case_id', str(uuid.uuid4())),
+            'props': {
+                'chief_complaint': kg_json.get('chief_complaint', ''),
+                'created_at': metadata.get('created_at', ''),
+                'clinical_reasoning': kg_json.get('clinical_reasoning', '')
+            }
+        }))
+        
+        logger.info(f"Generated {len(statements)} bulk Cypher statements")
+        return statements
+    
+    @timed("save_to_files")
+    def save_to_files(self, kg_json: Dict[str, Any], base_filename: str = "medical_kg",
+                      queries: Optional[List[str]] = None, formats: Optional[Tuple[str, ...]] = None):
+        """Save the KG in each requested format (default: ARTIFACT_FORMATS) and return the filenames
+        
+        Pass the queries from generate_cypher_queries if they were already generated,
+        so they are not built a second time.
+        """
+        formats = formats or ARTIFACT_FORMATS
+        unknown = set(formats) - {"json", "cypher", "kgb"}
+        if unknown:
+            raise ValueError(f"Unknown artifact formats: {', '.join(sorted(unknown))}")
+        
+        filenames = []
+        for artifact_format in formats:
+            if artifact_format == "json":
+                # Save JSON
+                json_filename = f"{base_filename}.json"
+                with open(json_filename, 'w', encoding='utf-8') as f:
+                    json.dump(kg_json, f, indent=2, ensure_ascii=False)
+                filenames.append(json_filename)
+            
+            elif artifact_format == "cypher":
+                # Save Cypher queries
+                cypher_filename = f"{base_filename}.cypher"
+                if queries is None:
+                    queries = self.generate_cypher_queries(kg_json)
+                
+                with open(cypher_filename, 'w', encoding='utf-8') as f:
+                    f.write("// Medical Knowledge Graph - Auto-generated Cypher Queries\n")
+                    f.write(f"// Generated at: {datetime.now()}\n\n")
+                    
+                    for i, query in enumerate(queries, 1):
+                        f.write(f"// Query {i}\n{query}\n\n")
+                filenames.append(cypher_filename)
             
-            for i, query in enumerate(queries, 1):
-                f.write(f"// Query {i}\n{query}\n\n")
+            else:
+                from kg_artifact import save_artifact
+                filenames.append(save_artifact(kg_json, f"{base_filename}.kgb"))
         
-        logger.info(f"Saved KG to {json_filename} and queries to {cypher_filename}")
+        logger.info(f"Saved KG to {', '.join(filenames)}")
         
-        return json_filename, cypher_filename
+        return tuple(filenames)
+    
+    def export_bulk_csv(self, sources: List[str], output_dir: str = "kg_import") -> Dict[str, Any]:
+        """Export saved KG JSON files as deduplicated CSVs for `neo4j-admin database import` (see kg_export)"""
+        from kg_export import export_cases
+        return export_cases(sources, output_dir)
+
+class IncrementalCaseExtractor:
+    """Builds a draft PatientCase in a background thread while the intake conversation runs
+    
+    Each batch of new conversation turns is extracted with the regular analysis
+    prompt and merged into the draft, so when the conversation ends only a
+    reconciliation pass against the final report is left (see reconcile_with_draft).
+    """
+    
+    def __init__(self, kg_builder: Optional[MedicalKGBuilder] = None):
+        self.kg_builder = kg_builder or get_registry().kg_builder(cache=default_cache())
+        self.draft = empty_clinical_data()
+        self._lock = threading.Lock()
+        # One worker keeps batches merging in conversation order
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="kg-draft")
+        self._futures: List[Future] = []
+    
+    def submit(self, transcript: str) -> Future:
+        """Queue a batch of conversation turns for background extraction"""
+        future = self._executor.submit(self._extract, transcript)
+        self._futures.append(future)
+        return future
+    
+    def _extract(self, transcript: str):
+        try:
+            partial = self.kg_builder.analyze_medical_report(transcript)
+        except Exception as e:
+            # A failed batch only makes the draft less complete; reconciliation covers the gap
+            logger.warning(f"Background extraction failed: {e}")
+            return
+        
+        with self._lock:
+            merge_clinical_data(self.draft, partial)
+        logger.info(f"Draft case now has {len(self.draft['entities'])} entities")
+    
+    def finalize(self, timeout: Optional[float] = None) -> Dict[str, Any]:
+        """Wait for queued batches, shut the worker down and return a copy of the draft"""
+        for future in self._futures:
+            future.result(timeout=timeout)
+        self._executor.shutdown(wait=True)
+        
+        with self._lock:
+            return json.loads(json.dumps(self.draft))
+    
+    def discard(self):
+        """Drop queued batches and stop the worker without waiting for the draft"""
+        for future in self._futures:
+            future.cancel()
+        self._executor.shutdown(wait=False)
+
+def case_file_base(kg_json: Dict[str, Any], output_dir: str = ".") -> str:
+    """Base filename (without extension) for a case's saved files"""
+    return os.path.join(output_dir, f"medical_case_{kg_json['metadata']['case_id'][:8]}")
+
+def default_case_index():
+    """Similar-case index in KG_CASE_INDEX_DIR, or None (numpy is only imported when it is enabled)"""
+    if not os.getenv('KG_CASE_INDEX_DIR'):
+        return None
+    from case_index import default_case_index as load_default_index
+    return load_default_index()
+
+def find_similar_cases(kg_json: Dict[str, Any], k: int = 5) -> List[Dict[str, Any]]:
+    """Most similar previously saved cases from the default case index (empty when it is disabled)"""
+    index = default_case_index()
+    if index is None:
+        return []
+    return [{'case_id': case_id, 'score': round(score, 4)} for case_id, score in index.search(kg_json, k)]
 
 # Example usage function
-def process_medical_report(report: str, enhance: bool = False) -> tuple[Dict[str, Any], List[str]]:
+def process_medical_report(report: str, enhance: bool = False, output_dir: str = ".",
+                           cache: Optional[ExtractionCache] = None, refresh_cache: bool = False,
+                           draft: Optional[Dict[str, Any]] = None,
+                           formats: Optional[Tuple[str, ...]] = None) -> tuple[Dict[str, Any], List[str]]:
     """
     Main function to process a medical report into KG
     
     Args:
         report: Medical report text
         enhance: Whether to enhance with medical knowledge
+        output_dir: Directory the medical_case_* files are written to
+        cache: Extraction cache (defaults to the KG_CACHE_DIR cache, if configured)
+        refresh_cache: Skip cache lookups and overwrite entries with fresh LLM results
+        draft: Draft case built during the conversation to reconcile against (optional)
+        formats: Files to save, e.g. ("kgb",) (default: ARTIFACT_FORMATS)
     
     Returns:
         Tuple of (kg_json, cypher_queries)
     """
     
-    # Initialize builder
-    kg_builder = MedicalKGBuilder()
+    # Shared builder: reuses the pooled LLM client and the parsed prompt templates
+    kg_builder = get_registry().kg_builder(cache=cache if cache is not None else default_cache(),
+                                           refresh_cache=refresh_cache)
     
     # Build knowledge graph
-    kg_json = kg_builder.build_knowledge_graph(report, enhance=enhance)
+    kg_json = kg_builder.build_knowledge_graph(report, enhance=enhance, draft=draft)
     
     # Generate Cypher queries
     cypher_queries = kg_builder.generate_cypher_queries(kg_json)
     
-    # Save files
-    kg_builder.save_to_files(kg_json, f"medical_case_{kg_json['metadata']['case_id'][:8]}")
+    # Save files, reusing the queries generated above
+    kg_builder.save_to_files(kg_json, case_file_base(kg_json, output_dir), queries=cypher_queries, formats=formats)
+    
+    # Make the saved case findable by similar-case search
+    case_index = default_case_index()
+    if case_index is not None:
+        with span("case_index_add"):
+            case_index.add(kg_json['metadata']['case_id'], kg_json)
+    
+    return kg_json, cypher_queries
+
+async def aprocess_medical_report(report: str, enhance: bool = False,
+                                  connection: Optional[AsyncNeo4jConnection] = None,
+                                  output_dir: str = ".", cache: Optional[ExtractionCache] = None,
+                                  refresh_cache: bool = False,
+                                  draft: Optional[Dict[str, Any]] = None,
+                                  formats: Optional[Tuple[str, ...]] = None) -> tuple[Dict[str, Any], List[str]]:
+    """
+    Async version of process_medical_report
+    
+    LLM calls and Neo4j writes are awaited, and Cypher generation plus file writes
+    run in a worker thread, so many reports can be processed concurrently on one
+    event loop.
+    
+    Args:
+        report: Medical report text
+        enhance: Whether to enhance with medical knowledge
+        connection: Connected AsyncNeo4jConnection to ingest the case into (optional)
+        output_dir: Directory the medical_case_* files are written to
+        cache: Extraction cache (defaults to the KG_CACHE_DIR cache, if configured)
+        refresh_cache: Skip cache lookups and overwrite entries with fresh LLM results
+        draft: Draft case built during the conversation to reconcile against (optional)
+        formats: Files to save, e.g. ("kgb",) (default: ARTIFACT_FORMATS)
+    
+    Returns:
+        Tuple of (kg_json, cypher_queries)
+    """
+    
+    kg_builder = get_registry().kg_builder(cache=cache if cache is not None else default_cache(),
+                                           refresh_cache=refresh_cache)
+    
+    kg_json = await kg_builder.abuild_knowledge_graph(report, enhance=enhance, draft=draft)
+    
+    def generate_and_save():
+        queries = kg_builder.generate_cypher_queries(kg_json)
+        kg_builder.save_to_files(kg_json, case_file_base(kg_json, output_dir), queries=queries, formats=formats)
+        case_index = default_case_index()
+        if case_index is not None:
+            with span("case_index_add"):
+                case_index.add(kg_json['metadata']['case_id'], kg_json)
+        return queries
+    
+    cypher_queries = await asyncio.to_thread(generate_and_save)
+    
+    if connection is not None:
+        with span("neo4j_ingest"):
+            ingest_results = await connection.execute_queries_transactional(
+                kg_builder.generate_bulk_queries(kg_json), atomic=True
+            )
+        if ingest_results['error_count']:
+            raise Exception(f"Neo4j ingestion failed: {ingest_results['errors'][0]['error']}")
     
     return kg_json, cypher_queries
 
 # Integration with your existing medical intake script
-def integrate_with_intake_script(diagnosis_result: str) -> Dict[str, Any]:
+def integrate_with_intake_script(diagnosis_result: str,
+                                 draft_extractor: Optional[IncrementalCaseExtractor] = None) -> Dict[str, Any]:
     """
     Function to integrate with your existing medical intake script
     Call this function with the diagnosis result from your thesis_generator
+    
+    Pass the session's IncrementalCaseExtractor to reconcile against the draft it
+    built during the conversation instead of extracting from scratch.
+    
+    The result's 'timings' holds the case's timing breakdown (see kg_metrics.CaseTrace).
     """
     
     logger.info("Processing diagnosis result through KG builder...")
     
-    try:
-        kg_json, cypher_queries = process_medical_report(diagnosis_result)
-        
-        print(f"\n🔬 Knowledge Graph Generated:")
-        print(f"  • Entities: {kg_json['metadata']['entity_count']}")
-        print(f"  • Relationships: {kg_json['metadata']['relationship_count']}")
-        print(f"  • Cypher Queries: {len(cypher_queries)}")
-        
-        return {
-            'knowledge_graph': kg_json,
-            'cypher_queries': cypher_queries,
-            'status': 'success'
-        }
-        
-    except Exception as e:
-        logger.error(f"Error processing diagnosis: {e}")
-        return {
-            'error': str(e),
-            'status': 'failed'
-        }
+    with trace_case() as trace:
+        try:
+            with span("draft_finalize"):
+                draft = draft_extractor.finalize() if draft_extractor else None
+            kg_json, cypher_queries = process_medical_report(diagnosis_result, draft=draft)
+            
+            print(f"\n🔬 Knowledge Graph Generated:")
+            print(f"  • Entities: {kg_json['metadata']['entity_count']}")
+            print(f"  • Relationships: {kg_json['metadata']['relationship_count']}")
+            print(f"  • Cypher Queries: {len(cypher_queries)}")
+            
+            with span("similar_cases"):
+                similar_cases = find_similar_cases(kg_json)
+            if similar_cases:
+                print(f"  • Similar Cases: {', '.join(c['case_id'][:8] for c in similar_cases)}")
+            
+            return {
+                'knowledge_graph': kg_json,
+                'cypher_queries': cypher_queries,
+                'cache': kg_json['metadata'].get('cache'),
+                'similar_cases': similar_cases,
+                'timings': trace.breakdown(),
+                'status': 'success'
+            }
+            
+        except Exception as e:
+            logger.error(f"Error processing diagnosis: {e}")
+            return {
+                'error': str(e),
+                'timings': trace.breakdown(),
+                'status': 'failed'
+            }
+
+async def aintegrate_with_intake_script(diagnosis_result: str,
+                                        connection: Optional[AsyncNeo4jConnection] = None,
+                                        draft_extractor: Optional[IncrementalCaseExtractor] = None) -> Dict[str, Any]:
+    """Async version of integrate_with_intake_script"""
+    
+    logger.info("Processing diagnosis result through KG builder...")
+    
+    with trace_case() as trace:
+        try:
+            with span("draft_finalize"):
+                draft = await asyncio.to_thread(draft_extractor.finalize) if draft_extractor else None
+            kg_json, cypher_queries = await aprocess_medical_report(diagnosis_result, connection=connection, draft=draft)
+            
+            with span("similar_cases"):
+                similar_cases = await asyncio.to_thread(find_similar_cases, kg_json)
+            
+            return {
+                'knowledge_graph': kg_json,
+                'cypher_queries': cypher_queries,
+                'cache': kg_json['metadata'].get('cache'),
+                'similar_cases': similar_cases,
+                'timings': trace.breakdown(),
+                'status': 'success'
+            }
+            
+        except Exception as e:
+            logger.error(f"Error processing diagnosis: {e}")
+            return {
+                'error': str(e),
+                'timings': trace.breakdown(),
+                'status': 'failed'
+            }
 
 """
 To integrate with your existing script, modify the generate_diagnosis_node function:
@@ -0,0 +1,334 @@
+"""
+Export knowledge-graph JSON documents as CSV files for `neo4j-admin database import`.
+
+Offline import is far faster than running Cypher for large backfills. Each
+case (a medical_case_*.json or .kgb document) is streamed into a SQLite work
+file that deduplicates nodes and relationships the same way the Cypher path
+MERGEs them: entities by (label, name), cases by id, and relationships by
+(type, start node, end node). Properties accumulate like `SET n += props`.
+The CSVs are then written from that file, one per label and one per
+(type, start label, end label). Memory stays bounded however many cases are
+exported; only the per-label column schema is held in memory.
+
+Node IDs are a hash of label and name, so the same entity gets the same ID in
+every case and every export.
+
+Usage:
+    python kg_export.py medical_case_*.json --output-dir kg_import
+    python kg_export.py kg_batch_output/ --output-dir kg_import
+"""
+
+import argparse
+import csv
+import glob
+import hashlib
+import json
+import logging
+import os
+import re
+import sqlite3
+from pathlib import Path
+from typing import Dict, Any, Iterable, Iterator, List, Optional, Tuple
+
+from kg_artifact import load_artifact
+from kg_drafter import Neo4jQueryBuilder
+
+logger = logging.getLogger(__name__)
+
+CASE_LABEL = "Case"
+
+# Header type suffixes for neo4j-admin; strings need none
+_TYPE_SUFFIXES = {'boolean': ':boolean', 'long': ':long', 'double': ':double', 'string': ''}
+
+
+def node_id(label: str, name: str) -> str:
+    """Stable import ID for an entity node, unique within its label's ID space"""
+    return hashlib.sha1(f"{label}\x1f{name}".encode('utf-8')).hexdigest()[:20]
+
+
+def _value_type(value: Any) -> str:
+    # bool before int: bool is an int subclass
+    if isinstance(value, bool):
+        return 'boolean'
+    if isinstance(value, int):
+        return 'long'
+    if isinstance(value, float):
+        return 'double'
+    return 'string'
+
+
+def _merge_type(current: Optional[str], new: str) -> str:
+    """Widest column type that holds both; mixed types fall back to string"""
+    if current is None or current == new:
+        return new
+    if {current, new} == {'long', 'double'}:
+        return 'double'
+    return 'string'
+
+
+def _format_value(value: Any, column_type: str) -> str:
+    if value is None:
+        return ""
+    if column_type == 'boolean':
+        return "true" if value else "false"
+    if column_type == 'string' and isinstance(value, bool):
+        return "true" if value else "false"
+    return str(value)
+
+
+def _file_safe(identifier: str) -> str:
+    return re.sub(r"[^A-Za-z0-9_-]+", "_", identifier) or "_"
+
+
+# Formats a case may be saved in, most preferred first
+CASE_SUFFIXES = (".kgb", ".json")
+
+
+def iter_case_files(sources: Iterable[str]) -> Iterator[str]:
+    """Yield case paths from files, glob patterns and directories (medical_case_*.json/.kgb inside)
+
+    A case saved in several formats is yielded once, as .kgb when it exists.
+    """
+    # Case file stem (resolved, without the format suffix) -> chosen path, in first-seen order
+    chosen: Dict[str, str] = {}
+    for source in sources:
+        path = Path(source)
+        if path.is_dir():
+            paths = [str(p) for p in sorted(path.rglob("medical_case_*")) if p.suffix in CASE_SUFFIXES]
+        elif path.exists():
+            paths = [str(path)]
+        else:
+            paths = sorted(glob.glob(source))
+
+        # Overlapping sources and the formats of one case must not import it twice
+        for file_path in paths:
+            stem, suffix = os.path.splitext(os.path.realpath(file_path))
+            if suffix not in CASE_SUFFIXES:
+                chosen.setdefault(stem + suffix, file_path)
+                continue
+            current = chosen.get(stem)
+            if current is None or CASE_SUFFIXES.index(suffix) < CASE_SUFFIXES.index(Path(current).suffix):
+                chosen[stem] = file_path
+
+    yield from chosen.values()
+
+
+class CSVGraphExporter:
+    """Accumulates KG JSON documents in a SQLite work file and writes neo4j-admin CSVs"""
+
+    def __init__(self, output_dir: str, work_db: Optional[str] = None):
+        self.output_dir = output_dir
+        os.makedirs(output_dir, exist_ok=True)
+        self.work_db = work_db or os.path.join(output_dir, ".export_work.sqlite")
+        if os.path.exists(self.work_db):
+            os.remove(self.work_db)
+
+        self.db = sqlite3.connect(self.work_db)
+        self.db.executescript("""
+            PRAGMA journal_mode = OFF;
+            PRAGMA synchronous = OFF;
+            CREATE TABLE nodes (label TEXT, key TEXT, props TEXT, PRIMARY KEY (label, key)) WITHOUT ROWID;
+            CREATE TABLE rels (type TEXT, from_label TEXT, from_name TEXT, to_label TEXT, to_name TEXT,
+                               props TEXT, PRIMARY KEY (type, from_label, from_name, to_label, to_name)) WITHOUT ROWID;
+        """)
+
+        # Column name -> type per label and per relationship group; bounded by the schema, not the data
+        self.node_columns: Dict[str, Dict[str, str]] = {}
+        self.rel_columns: Dict[Tuple[str, str, str], Dict[str, str]] = {}
+        self.stats = {'cases': 0, 'entities_read': 0, 'relationships_read': 0, 'relationships_skipped': 0}
+
+    def _add_columns(self, columns: Dict[str, str], props: Dict[str, Any]):
+        for key, value in props.items():
+            columns[key] = _merge_type(columns.get(key), _value_type(value))
+
+    def _upsert_node(self, label: str, key: str, props: Dict[str, Any]):
+        self._add_columns(self.node_columns.setdefault(label, {}), props)
+        # json_patch merges the property maps like SET n += props (later cases win)
+        self.db.execute(
+            "INSERT INTO nodes VALUES (?, ?, ?) "
+            "ON CONFLICT (label, key) DO UPDATE SET props = json_patch(props, excluded.props)",
+            (label, key, json.dumps(props, ensure_ascii=False))
+        )
+
+    def add_case(self, kg_json: Dict[str, Any]):
+        """Add one KG JSON document"""
+        metadata = kg_json.get('metadata', {})
+        if metadata.get('case_id'):
+            self._upsert_node(CASE_LABEL, metadata['case_id'], {
+                'chief_complaint': kg_json.get('chief_complaint', ''),
+                'created_at': metadata.get('created_at', ''),
+                'clinical_reasoning': kg_json.get('clinical_reasoning', '')
+            })
+
+        entity_labels = {}
+        for entity in kg_json.get('entities', []):
+            label = Neo4jQueryBuilder._node_label(entity)
+            entity_labels[entity['name']] = label
+            props = Neo4jQueryBuilder._property_map(entity.get('properties', {}))
+            # The name is the node key and gets its own column
+            props.pop('name', None)
+            self._upsert_node(label, entity['name'], props)
+            self.stats['entities_read'] += 1
+
+        for rel in kg_json.get('relationships', []):
+            self.stats['relationships_read'] += 1
+            from_label = entity_labels.get(rel['from_entity'])
+            to_label = entity_labels.get(rel['to_entity'])
+            if from_label is None or to_label is None:
+                # The import needs both endpoint IDs; an edge to an undeclared entity has none
+                self.stats['relationships_skipped'] += 1
+                continue
+
+            rel_props = dict(rel.get('properties', {}))
+            if rel.get('confidence'):
+                rel_props['confidence'] = rel['confidence']
+            rel_props = Neo4jQueryBuilder._property_map(rel_props)
+
+            rel_type = Neo4jQueryBuilder._relationship_type(rel)
+            self._add_columns(self.rel_columns.setdefault((rel_type, from_label, to_label), {}), rel_props)
+            self.db.execute(
+                "INSERT INTO rels VALUES (?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (type, from_label, from_name, to_label, to_name) "
+                "DO UPDATE SET props = json_patch(props, excluded.props)",
+                (rel_type, from_label, rel['from_entity'], to_label, rel['to_entity'],
+                 json.dumps(rel_props, ensure_ascii=False))
+            )
+
+        self.stats['cases'] += 1
+
+    def add_file(self, path: str):
+        """Add one medical_case_*.json or .kgb file"""
+        if path.endswith(".kgb"):
+            self.add_case(load_artifact(path))
+        else:
+            with open(path, 'r', encoding='utf-8') as f:
+                self.add_case(json.load(f))
+        # Commit per case so the SQLite page cache, not Python, holds pending rows
+        self.db.commit()
+
+    def _write_nodes(self, label: str) -> Tuple[str, int]:
+        columns = sorted(self.node_columns[label].items())
+        if label == CASE_LABEL:
+            # Cases are keyed by their own id, which is also stored as the `id` property
+            header = ["id:ID(Case)"]
+        else:
+            header = [f":ID({label})", "name"]
+        header += [f"{key}{_TYPE_SUFFIXES[column_type]}" for key, column_type in columns]
+
+        path = os.path.join(self.output_dir, f"nodes_{_file_safe(label)}.csv")
+        count = 0
+        with open(path, 'w', encoding='utf-8', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(header)
+            for key, props in self.db.execute("SELECT key, props FROM nodes WHERE label = ? ORDER BY key", (label,)):
+                props = json.loads(props)
+                row = [key] if label == CASE_LABEL else [node_id(label, key), key]
+                row += [_format_value(props.get(column), column_type) for column, column_type in columns]
+                writer.writerow(row)
+                count += 1
+        return path, count
+
+    def _write_relationships(self, rel_type: str, from_label: str, to_label: str) -> Tuple[str, int]:
+        columns = sorted(self.rel_columns[(rel_type, from_label, to_label)].items())
+        header = [f":START_ID({from_label})", f":END_ID({to_label})"]
+        header += [f"{key}{_TYPE_SUFFIXES[column_type]}" for key, column_type in columns]
+
+        path = os.path.join(
+            self.output_dir, f"rels_{_file_safe(rel_type)}__{_file_safe(from_label)}__{_file_safe(to_label)}.csv"
+        )
+        count = 0
+        with open(path, 'w', encoding='utf-8', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(header)
+            rows = self.db.execute(
+                "SELECT from_name, to_name, props FROM rels WHERE type = ? AND from_label = ? AND to_label = ? "
+                "ORDER BY from_name, to_name",
+                (rel_type, from_label, to_label)
+            )
+            for from_name, to_name, props in rows:
+                props = json.loads(props)
+                row = [node_id(from_label, from_name), node_id(to_label, to_name)]
+                row += [_format_value(props.get(column), column_type) for column, column_type in columns]
+                writer.writerow(row)
+                count += 1
+        return path, count
+
+    def import_command(self, node_files: Dict[str, str], rel_files: Dict[str, List[str]],
+                       database: str = "neo4j") -> List[str]:
+        """neo4j-admin arguments importing the written files (paths relative to the output dir)"""
+        command = ["neo4j-admin", "database", "import", "full", "--multiline-fields=true"]
+        command += [f"--nodes={label}={path}" for label, path in sorted(node_files.items())]
+        for rel_type, paths in sorted(rel_files.items()):
+            command += [f"--relationships={rel_type}={path}" for path in paths]
+        command.append(database)
+        return command
+
+    def write(self, database: str = "neo4j") -> Dict[str, Any]:
+        """Write the CSV files and an import.sh script; returns an export summary"""
+        self.db.commit()
+        summary = dict(self.stats, nodes={}, relationships={})
+
+        node_files = {}
+        for label in sorted(self.node_columns):
+            path, summary['nodes'][label] = self._write_nodes(label)
+            node_files[label] = os.path.basename(path)
+
+        rel_files: Dict[str, List[str]] = {}
+        for rel_type, from_label, to_label in sorted(self.rel_columns):
+            path, count = self._write_relationships(rel_type, from_label, to_label)
+            rel_files.setdefault(rel_type, []).append(os.path.basename(path))
+            summary['relationships'][rel_type] = summary['relationships'].get(rel_type, 0) + count
+
+        command = self.import_command(node_files, rel_files, database)
+        script_path = os.path.join(self.output_dir, "import.sh")
+        with open(script_path, 'w', encoding='utf-8') as f:
+            f.write("#!/bin/sh\n# Run with the target database stopped; it must be empty or new\n")
+            f.write('cd "$(dirname "$0")"\n')
+            f.write(" ".join(command[:5]) + " \\\n  " + " \\\n  ".join(command[5:]) + "\n")
+        os.chmod(script_path, 0o755)
+
+        summary['import_command'] = command
+        logger.info(
+            f"Exported {summary['cases']} cases: {sum(summary['nodes'].values())} nodes, "
+            f"{sum(summary['relationships'].values())} relationships to {self.output_dir}"
+        )
+        return summary
+
+    def close(self):
+        """Close and delete the work file"""
+        self.db.close()
+        if os.path.exists(self.work_db):
+            os.remove(self.work_db)
+
+
+def export_cases(sources: Iterable[str], output_dir: str, database: str = "neo4j") -> Dict[str, Any]:
+    """Export every KG JSON file found in `sources` to neo4j-admin CSVs in `output_dir`"""
+    exporter = CSVGraphExporter(output_dir)
+    try:
+        for path in iter_case_files(sources):
+            try:
+                exporter.add_file(path)
+            except (OSError, ValueError, KeyError) as e:
+                logger.error(f"Skipping {path}: {e}")
+        return exporter.write(database)
+    finally:
+        exporter.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export KG JSON documents as CSVs for neo4j-admin import")
+    parser.add_argument("sources", nargs="+", help="Case files (.json/.kgb), glob patterns or directories of medical_case_* files")
+    parser.add_argument("--output-dir", default="kg_import", help="Where the CSV files and import.sh go")
+    parser.add_argument("--database", default="neo4j", help="Database name passed to neo4j-admin")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+
+    summary = export_cases(args.sources, args.output_dir, args.database)
+    if summary['relationships_skipped']:
+        logger.warning(f"Skipped {summary['relationships_skipped']} relationships to undeclared entities")
+    logger.info(f"Import with: {os.path.join(args.output_dir, 'import.sh')}")
+
+
+if __name__ == "__main__":
+    main()
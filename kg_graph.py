@@ -0,0 +1,330 @@
+"""
+In-process graph engine over knowledge-graph JSON, for read paths that do not need Neo4j.
+
+Cases are merged into one graph the way the Cypher path MERGEs them: an entity
+is a node per (label, name) and a relationship is an edge per (start, type,
+end). The graph is then frozen into compressed sparse row (CSR) arrays, with
+outgoing and incoming edges sorted by relationship type. A typed neighbour
+lookup is then a slice plus a binary search, with no per-query allocation
+beyond the result. Label and normalized-name indexes find the start nodes.
+
+    graph = load_graph(["kg_batch_output/"])
+    graph.related("Nausea", "suggests", label="condition")
+    graph.related("Hyperemesis Gravidarum", "treated_by")
+    graph.k_hop(graph.find("Nausea")[0], 2)
+
+Each node and edge also records how many cases asserted it, so answers can be
+ranked by support across cases.
+"""
+
+import json
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import deque
+from typing import Dict, Any, Iterable, List, Optional, Tuple
+
+from kg_drafter import Neo4jQueryBuilder, _normalize_name
+
+OUT = "out"
+IN = "in"
+BOTH = "both"
+
+
+def label_for(entity_type: str) -> str:
+    """Node label for an entity type or label, as the Cypher path names it (e.g. 'condition' -> 'Condition')"""
+    return Neo4jQueryBuilder._node_label({'type': entity_type})
+
+
+def relationship_type_for(relationship_type: str) -> str:
+    """Edge type as the Cypher path names it (e.g. 'treated_by' -> 'TREATED_BY')"""
+    return Neo4jQueryBuilder._relationship_type({'relationship_type': relationship_type})
+
+
+class GraphBuilder:
+    """Accumulates cases; build() freezes them into a KGGraph"""
+
+    def __init__(self):
+        self.labels: List[str] = []
+        self.label_ids: Dict[str, int] = {}
+        self.types: List[str] = []
+        self.type_ids: Dict[str, int] = {}
+
+        self.node_ids: Dict[Tuple[int, str], int] = {}
+        self.node_label = array("I")
+        self.node_name: List[str] = []
+        self.node_properties: List[Dict[str, Any]] = []
+        self.node_cases = array("I")
+
+        # (start, type, end) -> edge index; endpoints without a declared label are resolved at build()
+        self.edge_ids: Dict[Tuple[int, int, int], int] = {}
+        self.edge_cases = array("I")
+        self.unresolved: List[Tuple[str, Optional[int], str, Optional[int], int]] = []
+        self.cases = 0
+
+    def _intern(self, values: List[str], ids: Dict[str, int], value: str) -> int:
+        value_id = ids.get(value)
+        if value_id is None:
+            value_id = ids[value] = len(values)
+            values.append(value)
+        return value_id
+
+    def _node(self, label: str, name: str) -> int:
+        key = (self._intern(self.labels, self.label_ids, label), name)
+        node = self.node_ids.get(key)
+        if node is None:
+            node = self.node_ids[key] = len(self.node_name)
+            self.node_label.append(key[0])
+            self.node_name.append(name)
+            self.node_properties.append({})
+            self.node_cases.append(0)
+        return node
+
+    def _edge(self, start: int, type_id: int, end: int, seen: set):
+        key = (start, type_id, end)
+        edge = self.edge_ids.get(key)
+        if edge is None:
+            edge = self.edge_ids[key] = len(self.edge_cases)
+            self.edge_cases.append(0)
+        # Count each case once per edge, however often it repeats the relationship
+        if key not in seen:
+            seen.add(key)
+            self.edge_cases[edge] += 1
+
+    def add_case(self, kg_json: Dict[str, Any]):
+        """Merge one KG JSON document into the graph"""
+        entity_nodes: Dict[str, int] = {}
+        counted: set = set()
+        for entity in kg_json.get('entities', []):
+            node = self._node(Neo4jQueryBuilder._node_label(entity), entity['name'])
+            # Like SET n += props: later cases overwrite properties they share
+            self.node_properties[node].update(Neo4jQueryBuilder._property_map(entity.get('properties', {})))
+            for key in ('icd_code', 'confidence'):
+                if entity.get(key):
+                    self.node_properties[node][key] = entity[key]
+            if node not in counted:
+                counted.add(node)
+                self.node_cases[node] += 1
+            entity_nodes[entity['name']] = node
+
+        seen: set = set()
+        for rel in kg_json.get('relationships', []):
+            type_id = self._intern(self.types, self.type_ids, Neo4jQueryBuilder._relationship_type(rel))
+            start = entity_nodes.get(rel['from_entity'])
+            end = entity_nodes.get(rel['to_entity'])
+            if start is None or end is None:
+                # Like the label-less MATCH in the Cypher path: bind to any node with that name
+                self.unresolved.append((rel['from_entity'], start, rel['to_entity'], end, type_id))
+                continue
+            self._edge(start, type_id, end, seen)
+
+        self.cases += 1
+
+    def build(self) -> "KGGraph":
+        """Freeze the accumulated cases into CSR adjacency arrays"""
+        by_name: Dict[str, List[int]] = {}
+        for (_, name), node in self.node_ids.items():
+            by_name.setdefault(name, []).append(node)
+
+        for from_name, start, to_name, end, type_id in self.unresolved:
+            starts = [start] if start is not None else by_name.get(from_name, [])
+            ends = [end] if end is not None else by_name.get(to_name, [])
+            for s in starts:
+                for e in ends:
+                    self._edge(s, type_id, e, set())
+        self.unresolved = []
+
+        edges = sorted(self.edge_ids.items())
+        return KGGraph(
+            labels=self.labels, types=self.types, node_label=self.node_label, node_name=self.node_name,
+            node_properties=self.node_properties, node_cases=self.node_cases,
+            edges=[(start, type_id, end, self.edge_cases[edge]) for (start, type_id, end), edge in edges],
+            cases=self.cases
+        )
+
+
+class _CSR:
+    """Adjacency in compressed sparse row form, each node's edges sorted by type then target"""
+
+    def __init__(self, node_count: int, edges: List[Tuple[int, int, int, int]]):
+        edges = sorted(edges)
+        self.offsets = array("I", [0]) * (node_count + 1)
+        for source, _, _, _ in edges:
+            self.offsets[source + 1] += 1
+        for i in range(node_count):
+            self.offsets[i + 1] += self.offsets[i]
+        self.types = array("I", (type_id for _, type_id, _, _ in edges))
+        self.targets = array("I", (target for _, _, target, _ in edges))
+        self.cases = array("I", (cases for _, _, _, cases in edges))
+
+    def span(self, node: int, type_id: Optional[int] = None) -> Tuple[int, int]:
+        lo, hi = self.offsets[node], self.offsets[node + 1]
+        if type_id is None:
+            return lo, hi
+        return bisect_left(self.types, type_id, lo, hi), bisect_right(self.types, type_id, lo, hi)
+
+
+class KGGraph:
+    """Read-only graph with label/name indexes and typed neighbour and k-hop queries"""
+
+    def __init__(self, labels: List[str], types: List[str], node_label: array, node_name: List[str],
+                 node_properties: List[Dict[str, Any]], node_cases: array,
+                 edges: List[Tuple[int, int, int, int]], cases: int = 0):
+        self.labels = labels
+        self.types = types
+        self.label_ids = {label: i for i, label in enumerate(labels)}
+        self.type_ids = {rel_type: i for i, rel_type in enumerate(types)}
+        self.node_label = node_label
+        self.node_name = node_name
+        self.node_properties = node_properties
+        self.node_cases = node_cases
+        self.cases = cases
+
+        self.out = _CSR(len(node_name), edges)
+        self.inc = _CSR(len(node_name), [(end, type_id, start, count) for start, type_id, end, count in edges])
+
+        self.label_index: Dict[int, array] = {}
+        self.name_index: Dict[str, List[int]] = {}
+        for node, (label_id, name) in enumerate(zip(node_label, node_name)):
+            self.label_index.setdefault(label_id, array("I")).append(node)
+            self.name_index.setdefault(_normalize_name(name), []).append(node)
+
+    @property
+    def node_count(self) -> int:
+        return len(self.node_name)
+
+    @property
+    def edge_count(self) -> int:
+        return len(self.out.targets)
+
+    def _label_id(self, label: Optional[str]) -> Optional[int]:
+        if label is None:
+            return None
+        # -1 matches nothing, so an unknown label gives empty answers rather than every node
+        return self.label_ids.get(label_for(label), -1)
+
+    def _type_id(self, rel_type: Optional[str]) -> Optional[int]:
+        if rel_type is None:
+            return None
+        return self.type_ids.get(relationship_type_for(rel_type), -1)
+
+    def find(self, name: str, label: Optional[str] = None) -> List[int]:
+        """Node ids with this name (case- and whitespace-insensitive), optionally of one label"""
+        nodes = self.name_index.get(_normalize_name(name), [])
+        label_id = self._label_id(label)
+        if label_id is None:
+            return list(nodes)
+        return [node for node in nodes if self.node_label[node] == label_id]
+
+    def nodes(self, label: str) -> List[int]:
+        """Node ids of one label"""
+        return list(self.label_index.get(self._label_id(label), ()))
+
+    def node(self, node: int) -> Dict[str, Any]:
+        """A node as {'id', 'label', 'name', 'properties', 'cases'}"""
+        return {
+            'id': node,
+            'label': self.labels[self.node_label[node]],
+            'name': self.node_name[node],
+            'properties': self.node_properties[node],
+            'cases': self.node_cases[node]
+        }
+
+    def _adjacent(self, node: int, type_id: Optional[int], direction: str):
+        """Yield (neighbour, type_id, cases) along one or both directions"""
+        for csr in ((self.out,) if direction == OUT else (self.inc,) if direction == IN else (self.out, self.inc)):
+            if type_id == -1:
+                return
+            lo, hi = csr.span(node, type_id)
+            for i in range(lo, hi):
+                yield csr.targets[i], csr.types[i], csr.cases[i]
+
+    def neighbors(self, node: int, rel_type: Optional[str] = None, direction: str = OUT,
+                  label: Optional[str] = None) -> List[int]:
+        """Adjacent node ids, optionally restricted to one relationship type and neighbour label"""
+        type_id = self._type_id(rel_type)
+        label_id = self._label_id(label)
+        return [
+            target for target, _, _ in self._adjacent(node, type_id, direction)
+            if label_id is None or self.node_label[target] == label_id
+        ]
+
+    def k_hop(self, start: int, k: int, rel_types: Optional[Iterable[str]] = None, direction: str = OUT,
+              label: Optional[str] = None) -> Dict[int, int]:
+        """Nodes reachable within k hops as {node: distance}, optionally only along some types / ending at a label"""
+        type_ids = None if rel_types is None else [self._type_id(rel_type) for rel_type in rel_types]
+        distances = {start: 0}
+        frontier = deque([start])
+        while frontier:
+            node = frontier.popleft()
+            if distances[node] == k:
+                continue
+            for type_id in (type_ids or [None]):
+                for target, _, _ in self._adjacent(node, type_id, direction):
+                    if target not in distances:
+                        distances[target] = distances[node] + 1
+                        frontier.append(target)
+
+        del distances[start]
+        label_id = self._label_id(label)
+        if label_id is None:
+            return distances
+        return {node: distance for node, distance in distances.items() if self.node_label[node] == label_id}
+
+    def related(self, name: str, rel_type: Optional[str] = None, label: Optional[str] = None,
+                direction: str = OUT, from_label: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Nodes related to every node named `name`, ranked by how many cases assert the edge
+
+        E.g. related("Nausea", "suggests", label="condition") answers "which conditions does
+        nausea suggest across cases" and related(condition, "treated_by") "what treats it".
+        """
+        type_id = self._type_id(rel_type)
+        label_id = self._label_id(label)
+        support: Dict[int, int] = {}
+        for node in self.find(name, from_label):
+            for target, _, cases in self._adjacent(node, type_id, direction):
+                if label_id is None or self.node_label[target] == label_id:
+                    support[target] = support.get(target, 0) + cases
+
+        ranked = sorted(support.items(), key=lambda item: (-item[1], self.node_name[item[0]]))
+        return [dict(self.node(node), support=cases) for node, cases in ranked]
+
+    def stats(self) -> Dict[str, Any]:
+        """Counts in the same shape as Neo4jConnection.get_database_stats"""
+        rel_counts: Dict[str, int] = {}
+        for type_id in self.out.types:
+            rel_counts[self.types[type_id]] = rel_counts.get(self.types[type_id], 0) + 1
+        return {
+            'total_nodes': self.node_count,
+            'total_relationships': self.edge_count,
+            'node_types': sorted(
+                ({'label': self.labels[label_id], 'count': len(nodes)} for label_id, nodes in self.label_index.items()),
+                key=lambda row: -row['count']
+            ),
+            'relationship_types': sorted(
+                ({'relationship_type': rel_type, 'count': count} for rel_type, count in rel_counts.items()),
+                key=lambda row: -row['count']
+            )
+        }
+
+    @classmethod
+    def from_cases(cls, cases: Iterable[Dict[str, Any]]) -> "KGGraph":
+        """Build a graph from KG JSON documents"""
+        builder = GraphBuilder()
+        for kg_json in cases:
+            builder.add_case(kg_json)
+        return builder.build()
+
+
+def load_graph(sources: Iterable[str]) -> KGGraph:
+    """Build a graph from saved case files (.json or .kgb), glob patterns or directories"""
+    from kg_artifact import load_artifact
+    from kg_export import iter_case_files
+
+    builder = GraphBuilder()
+    for path in iter_case_files(sources):
+        if path.endswith(".kgb"):
+            builder.add_case(load_artifact(path))
+        else:
+            with open(path, 'r', encoding='utf-8') as f:
+                builder.add_case(json.load(f))
+    return builder.build()
@@ -0,0 +1,356 @@
+"""
+Local lexicon-based pre-extraction of clinical entities.
+
+Many reports name the same common symptoms, conditions, tests and medications.
+`ClinicalLexicon` finds every lexicon term (and synonym) in a report in one pass
+with an Aho-Corasick automaton, keeping whole-word, leftmost-longest matches and
+flagging negated mentions ("no fever", "denies chest pain"). Each match becomes a
+ClinicalEntity-shaped candidate with the lexicon's canonical name, type and
+ICD-10 code.
+
+`LexiconPreExtractor` decides what the LLM still has to do:
+
+    skip        a short report whose clinical words are all covered by the
+                lexicon is turned into a case locally, without an LLM call
+    annotate    otherwise the candidates and only the report sentences the
+                lexicon could not explain are sent to the LLM, which returns
+                what is missing (MedicalKGBuilder.complete_pre_annotation)
+
+The lexicon is a JSON file (see clinical_lexicon.json):
+
+    {"terms": [{"name": "Nausea", "type": "symptom", "icd_code": "R11.0",
+                "synonyms": ["nauseous"]}, ...],
+     "stopwords": ["patient", "reports", ...]}
+
+Stopwords are the non-clinical words a report may contain and still count as
+fully covered. Hedge words ("suspected", "possible", "rule out") are not
+stopwords: a hedged report always goes to the LLM, and a hedged mention is a
+low-confidence candidate.
+"""
+
+import functools
+import json
+import logging
+import os
+import re
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Dict, Any, Iterator, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_LEXICON_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "clinical_lexicon.json")
+
+# A negation cue within the few words before a mention, in the same clause, marks it as negated
+_NEGATION = re.compile(r"\b(?:no|not|denies|denied|denying|without|negative for|absence of|free of)\b")
+_CLAUSE_BREAK = re.compile(r"[.;:!?\n]|\b(?:but|however|although|given|which)\b")
+_NEGATION_WINDOW = 60
+_NEGATION_SCOPE_WORDS = 5
+# Hedge cues; a mention they qualify ("suspected gastroenteritis", "pneumonia is likely") is low confidence,
+# and a report with any of them is never built without the LLM
+_HEDGE = re.compile(r"\b(?:suspect|suspected|suspicious for|possible|possibly|probable|probably|likely|unlikely|"
+                    r"consider|considered|rule out|ruled out|differential|query|questionable)\b")
+_HEDGE_AFTER = re.compile(r"\s*(?:is|was|are|were)\s+(?:suspected|possible|probable|likely|unlikely|considered)\b")
+_WORD = re.compile(r"[a-z][a-z'-]*")
+# A sentence or line; a decimal point like 38.5 does not end it
+_SENTENCE = re.compile(r"(?:[^.!?\n]|[.!?](?=\d))+[.!?]?")
+# Up to the end of the first sentence or clause (a decimal point like 38.5 does not end it)
+_CHIEF_COMPLAINT = re.compile(r"chief complaint\W*?:\**\s*(.+?)(?=[.!?;](?:\s|$)|\n|$)", re.IGNORECASE)
+
+# Heuristic edges for cases built without the LLM, by (from type, to type)
+_INFERRED_RELATIONSHIPS = {
+    ("symptom", "condition"): "suggests",
+    ("risk_factor", "condition"): "increases_risk_of",
+    ("condition", "medication"): "treated_by",
+    ("condition", "treatment"): "treated_by",
+}
+
+
+class AhoCorasick:
+    """Multi-pattern string matcher: every occurrence of every pattern in one pass over the text"""
+
+    def __init__(self, patterns: Dict[str, Any]):
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._out: List[List[Tuple[int, Any]]] = [[]]
+
+        for pattern, value in patterns.items():
+            state = 0
+            for char in pattern:
+                next_state = self._goto[state].get(char)
+                if next_state is None:
+                    next_state = len(self._goto)
+                    self._goto[state][char] = next_state
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._out.append([])
+                state = next_state
+            self._out[state].append((len(pattern), value))
+
+        # Breadth-first failure links; outputs of the failure state are inherited
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self._goto[state].items():
+                queue.append(next_state)
+                fallback = self._fail[state]
+                while fallback and char not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                self._fail[next_state] = self._goto[fallback].get(char, 0)
+                self._out[next_state] = self._out[next_state] + self._out[self._fail[next_state]]
+
+    def iter_matches(self, text: str) -> Iterator[Tuple[int, int, Any]]:
+        """(start, end, value) for every pattern occurrence, including overlapping ones"""
+        goto, fail, out = self._goto, self._fail, self._out
+        state = 0
+        for position, char in enumerate(text):
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            for length, value in out[state]:
+                yield position + 1 - length, position + 1, value
+
+
+@dataclass
+class LexiconMatch:
+    start: int
+    end: int
+    term: Dict[str, Any]
+    negated: bool = False
+    hedged: bool = False
+
+
+def _normalize(text: str) -> str:
+    return " ".join(text.lower().split())
+
+
+class ClinicalLexicon:
+    """Clinical terms with their synonyms, compiled into one matcher"""
+
+    def __init__(self, terms: List[Dict[str, Any]], stopwords: Optional[List[str]] = None):
+        self.terms = terms
+        self.stopwords = frozenset(word.lower() for word in stopwords or [])
+        patterns = {}
+        for term in terms:
+            for surface in [term['name'], *term.get('synonyms', [])]:
+                # The first term to claim a surface form keeps it
+                patterns.setdefault(_normalize(surface), term)
+        self._matcher = AhoCorasick(patterns)
+
+    @classmethod
+    def load(cls, path: str = DEFAULT_LEXICON_PATH) -> "ClinicalLexicon":
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        return cls(data.get('terms', []), data.get('stopwords', []))
+
+    def __len__(self) -> int:
+        return len(self.terms)
+
+    def match(self, text: str) -> List[LexiconMatch]:
+        """Whole-word, non-overlapping, leftmost-longest matches in text (offsets into text.lower())"""
+        lowered = text.lower()
+        candidates = sorted(
+            (start, -end, term) for start, end, term in self._matcher.iter_matches(lowered)
+            if (start == 0 or not lowered[start - 1].isalnum())
+            and (end == len(lowered) or not lowered[end].isalnum())
+        )
+
+        matches = []
+        covered_to = 0
+        for start, neg_end, term in candidates:
+            if start < covered_to:
+                continue
+            covered_to = -neg_end
+            matches.append(LexiconMatch(start, covered_to, term, self._qualified(_NEGATION, lowered, start),
+                                        self._hedged(lowered, start, covered_to)))
+        return matches
+
+    @staticmethod
+    def _qualified(cue: re.Pattern, lowered: str, start: int) -> bool:
+        # A cue within the few words before the mention, in the same clause
+        window = lowered[max(0, start - _NEGATION_WINDOW):start]
+        clause = _CLAUSE_BREAK.split(window)[-1]
+        return cue.search(" ".join(clause.split()[-_NEGATION_SCOPE_WORDS:])) is not None
+
+    @classmethod
+    def _hedged(cls, lowered: str, start: int, end: int) -> bool:
+        return cls._qualified(_HEDGE, lowered, start) or _HEDGE_AFTER.match(lowered, end) is not None
+
+
+@dataclass
+class PreExtraction:
+    """Lexicon candidates for one report and whether the LLM can be skipped"""
+    entities: List[Dict[str, Any]]
+    negated: List[str]
+    unknown_words: List[str]
+    word_count: int
+    chief_complaint: str
+    skip_llm: bool
+    reason: str
+    relationships: List[Dict[str, Any]] = field(default_factory=list)
+    unresolved: List[str] = field(default_factory=list)  # Sentences with unexplained words, negated or hedged mentions
+
+    def draft(self) -> Dict[str, Any]:
+        """Candidates as a draft case (see MedicalKGBuilder.complete_pre_annotation)"""
+        return {
+            'patient_demographics': {},
+            'chief_complaint': '',
+            'entities': json.loads(json.dumps(self.entities)),
+            'relationships': [],
+            'clinical_reasoning': '',
+            'recommendations': []
+        }
+
+    def to_clinical_data(self) -> Dict[str, Any]:
+        """A PatientCase-shaped case built from the candidates alone"""
+        return {
+            'patient_demographics': {},
+            'chief_complaint': self.chief_complaint,
+            'entities': json.loads(json.dumps(self.entities)),
+            'relationships': json.loads(json.dumps(self.relationships)),
+            'clinical_reasoning': "Extracted locally from the clinical lexicon; no LLM analysis.",
+            'recommendations': []
+        }
+
+
+class LexiconPreExtractor:
+    """Matches a report against the lexicon and decides whether the extraction LLM call is needed
+
+    The LLM is skipped only for reports of at most max_report_chars with at least
+    min_entities candidates, where at most max_unknown_ratio of the words that
+    are neither stopwords nor inside a match are left unexplained.
+    """
+
+    def __init__(self, lexicon: ClinicalLexicon, max_report_chars: int = 1500, min_entities: int = 2,
+                 max_unknown_ratio: float = 0.1):
+        self.lexicon = lexicon
+        self.max_report_chars = max_report_chars
+        self.min_entities = min_entities
+        self.max_unknown_ratio = max_unknown_ratio
+
+    def extract(self, report: str) -> PreExtraction:
+        matches = self.lexicon.match(report)
+
+        entities: Dict[str, Dict[str, Any]] = {}
+        negated = []
+        for match in matches:
+            term = match.term
+            if match.negated:
+                if term['name'] not in negated:
+                    negated.append(term['name'])
+                continue
+            if term['name'] not in entities:
+                entity = {'name': term['name'], 'type': term['type'], 'properties': {'source': 'lexicon'},
+                          'confidence': 'low' if match.hedged else 'high'}
+                if term.get('icd_code'):
+                    entity['icd_code'] = term['icd_code']
+                entities[term['name']] = entity
+            elif not match.hedged:
+                # Stated plainly somewhere in the report
+                entities[term['name']]['confidence'] = 'high'
+
+        unknown_words, word_count = self._unexplained_words(report.lower(), matches)
+        chief_complaint = self._chief_complaint(report, list(entities.values()))
+
+        reason = self._skip_blocker(report, entities, negated, unknown_words, word_count)
+        pre = PreExtraction(
+            entities=list(entities.values()),
+            negated=negated,
+            unknown_words=unknown_words,
+            word_count=word_count,
+            chief_complaint=chief_complaint,
+            skip_llm=reason is None,
+            reason=reason or "all clinical words covered by the lexicon"
+        )
+        if pre.skip_llm:
+            pre.relationships = self._infer_relationships(pre.entities)
+        else:
+            pre.unresolved = self._unresolved_sentences(report, matches, set(unknown_words))
+        return pre
+
+    @staticmethod
+    def _unresolved_sentences(report: str, matches: List[LexiconMatch], unknown: set) -> List[str]:
+        """Report sentences the candidates do not explain: an unexplained word, a negated or hedged mention"""
+        qualified_at = [m.start for m in matches if m.negated or m.hedged]
+        sentences = []
+        for sentence in _SENTENCE.finditer(report):
+            text = sentence.group().strip()
+            if not text:
+                continue
+            if any(sentence.start() <= start < sentence.end() for start in qualified_at) \
+                    or any(word in unknown for word in _WORD.findall(text.lower())):
+                sentences.append(text)
+        return sentences
+
+    def _unexplained_words(self, lowered: str, matches: List[LexiconMatch]) -> Tuple[List[str], int]:
+        """Words outside every match that are not stopwords, and the number of words that count"""
+        spans = [(m.start, m.end) for m in matches]
+        unknown = []
+        counted = 0
+        span_index = 0
+        for word in _WORD.finditer(lowered):
+            while span_index < len(spans) and spans[span_index][1] <= word.start():
+                span_index += 1
+            if span_index < len(spans) and spans[span_index][0] <= word.start():
+                counted += 1
+                continue
+            if word.group() in self.lexicon.stopwords or len(word.group()) < 3:
+                continue
+            counted += 1
+            unknown.append(word.group())
+        return unknown, counted
+
+    def _skip_blocker(self, report: str, entities: Dict[str, Dict[str, Any]], negated: List[str],
+                      unknown_words: List[str], word_count: int) -> Optional[str]:
+        """Why the LLM cannot be skipped, or None"""
+        if len(report) > self.max_report_chars:
+            return f"report longer than {self.max_report_chars} characters"
+        if len(entities) < self.min_entities:
+            return f"fewer than {self.min_entities} lexicon entities"
+        if any(name in entities for name in negated):
+            # Mentioned both plainly and negated: not trusted without the LLM
+            return "term mentioned both affirmed and negated"
+        if _HEDGE.search(report.lower()):
+            # "suspected", "rule out", ...: how certain a finding is needs the LLM
+            return "hedged mention"
+        if word_count and len(unknown_words) / word_count > self.max_unknown_ratio:
+            return f"{len(unknown_words)} of {word_count} clinical words not in the lexicon"
+        return None
+
+    @staticmethod
+    def _chief_complaint(report: str, entities: List[Dict[str, Any]]) -> str:
+        found = _CHIEF_COMPLAINT.search(report)
+        if found:
+            return found.group(1).strip(" *.")
+        return ", ".join(e['name'] for e in entities if e['type'] == 'symptom')
+
+    @staticmethod
+    def _infer_relationships(entities: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        relationships = []
+        for source in entities:
+            for target in entities:
+                relationship_type = _INFERRED_RELATIONSHIPS.get((source['type'], target['type']))
+                if relationship_type:
+                    relationships.append({
+                        'from_entity': source['name'],
+                        'to_entity': target['name'],
+                        'relationship_type': relationship_type,
+                        'properties': {'source': 'lexicon', 'inferred': True},
+                        'confidence': 'low'
+                    })
+        return relationships
+
+
+@functools.lru_cache(maxsize=None)
+def load_lexicon(path: str = DEFAULT_LEXICON_PATH) -> ClinicalLexicon:
+    """Load and compile a lexicon once per path"""
+    lexicon = ClinicalLexicon.load(path)
+    logger.info(f"Loaded clinical lexicon with {len(lexicon)} terms from {path}")
+    return lexicon
+
+
+def default_pre_extractor() -> Optional[LexiconPreExtractor]:
+    """Pre-extractor from KG_PREEXTRACT=1 and KG_LEXICON_PATH, or None when disabled"""
+    if os.getenv('KG_PREEXTRACT', '0') != '1':
+        return None
+    return LexiconPreExtractor(load_lexicon(os.getenv('KG_LEXICON_PATH') or DEFAULT_LEXICON_PATH))
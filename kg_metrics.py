@@ -0,0 +1,275 @@
+"""
+Timing spans and metrics for the intake and KG pipeline.
+
+Everything is recorded in one process-wide registry (`METRICS`):
+
+    kg_span_seconds              histogram of span durations, by span name
+                                 (LangGraph nodes, MedicalKGBuilder stages, LLM calls)
+    kg_llm_requests_total        LLM calls, by model and stage
+    kg_llm_request_bytes_total   prompt bytes sent (UTF-8)
+    kg_llm_response_bytes_total  response bytes received
+    kg_llm_input_tokens_total    prompt tokens (reported usage, else ~4 bytes per token)
+    kg_llm_output_tokens_total   completion tokens (likewise)
+    kg_neo4j_query_seconds       histogram of per-statement Neo4j latency, by operation
+
+`render_prometheus()` returns the Prometheus text exposition format and
+`write_prometheus(path)` writes it atomically (e.g. for node_exporter's
+textfile collector).
+
+Spans opened inside `trace_case()` are also collected into that case's
+timing breakdown. The trace lives in a context variable, so it follows
+asyncio tasks and `asyncio.to_thread` calls made while it is active.
+"""
+
+import bisect
+import contextlib
+import contextvars
+import functools
+import inspect
+import os
+import tempfile
+import threading
+import time
+from typing import Dict, Any, Iterator, List, Optional, Tuple
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+_LabelKey = Tuple[Tuple[str, str], ...]
+
+
+def _label_key(labels: Dict[str, Any]) -> _LabelKey:
+    return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+
+def _format_labels(key: _LabelKey, extra: Tuple[Tuple[str, str], ...] = ()) -> str:
+    pairs = key + extra
+    if not pairs:
+        return ""
+    escaped = (value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"') for _, value in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+
+def _format_value(value: float) -> str:
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+class Counter:
+    def __init__(self, name: str, help: str):
+        self.name = name
+        self.help = help
+        self.values: Dict[_LabelKey, float] = {}
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = _label_key(labels)
+        self.values[key] = self.values.get(key, 0.0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for key, value in sorted(self.values.items()):
+            lines.append(f"{self.name}{_format_labels(key)} {_format_value(value)}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(sorted(buckets))
+        # Per label set: [count per bucket (non-cumulative, +Inf last), sum]
+        self.values: Dict[_LabelKey, List[Any]] = {}
+
+    def observe(self, value: float, **labels):
+        key = _label_key(labels)
+        series = self.values.get(key)
+        if series is None:
+            series = self.values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+        series[0][bisect.bisect_left(self.buckets, value)] += 1
+        series[1] += value
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for key, (counts, total) in sorted(self.values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else _format_value(bound)
+                lines.append(f"{self.name}_bucket{_format_labels(key, (('le', le),))} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(key)} {_format_value(round(total, 6))}")
+            lines.append(f"{self.name}_count{_format_labels(key)} {cumulative}")
+        return lines
+
+
+class MetricsRegistry:
+    """Thread-safe set of named counters and histograms"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics: Dict[str, Any] = {}
+
+    def _get(self, cls, name: str, help: str, **kwargs):
+        metric = self._metrics.get(name)
+        if metric is None:
+            metric = self._metrics[name] = cls(name, help, **kwargs)
+        return metric
+
+    def inc(self, name: str, amount: float = 1.0, help: str = "", **labels):
+        with self._lock:
+            self._get(Counter, name, help).inc(amount, **labels)
+
+    def observe(self, name: str, value: float, help: str = "", **labels):
+        with self._lock:
+            self._get(Histogram, name, help).observe(value, **labels)
+
+    def render_prometheus(self) -> str:
+        with self._lock:
+            lines = []
+            for name in sorted(self._metrics):
+                lines.extend(self._metrics[name].render())
+        return "\n".join(lines) + "\n"
+
+    def reset(self):
+        with self._lock:
+            self._metrics.clear()
+
+
+METRICS = MetricsRegistry()
+
+
+class CaseTrace:
+    """Spans recorded while processing one case, in start order"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.spans: List[Dict[str, Any]] = []
+        self._lock = threading.Lock()
+
+    def add(self, name: str, start: float, seconds: float):
+        with self._lock:
+            self.spans.append({'span': name, 'start': round(start - self.started, 6), 'seconds': round(seconds, 6)})
+
+    def breakdown(self) -> Dict[str, Any]:
+        """Total wall time, the spans, and the time per span name"""
+        with self._lock:
+            spans = sorted(self.spans, key=lambda item: item['start'])
+        by_span: Dict[str, float] = {}
+        for item in spans:
+            by_span[item['span']] = round(by_span.get(item['span'], 0.0) + item['seconds'], 6)
+        return {
+            'total_seconds': round(time.perf_counter() - self.started, 6),
+            'by_span': by_span,
+            'spans': spans
+        }
+
+
+_current_trace: contextvars.ContextVar[Optional[CaseTrace]] = contextvars.ContextVar('kg_case_trace', default=None)
+
+
+@contextlib.contextmanager
+def trace_case() -> Iterator[CaseTrace]:
+    """Collect the spans of the enclosed work into a CaseTrace"""
+    trace = CaseTrace()
+    token = _current_trace.set(trace)
+    try:
+        yield trace
+    finally:
+        _current_trace.reset(token)
+
+
+@contextlib.contextmanager
+def span(name: str) -> Iterator[None]:
+    """Time the enclosed block as kg_span_seconds{span=name} (and in the current case trace)"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - start
+        METRICS.observe('kg_span_seconds', seconds, help="Duration of pipeline spans", span=name)
+        trace = _current_trace.get()
+        if trace is not None:
+            trace.add(name, start, seconds)
+
+
+def timed(name: str):
+    """Decorator: run a function (sync or async) inside span(name)"""
+    def decorator(function):
+        if inspect.iscoroutinefunction(function):
+            @functools.wraps(function)
+            async def async_wrapper(*args, **kwargs):
+                with span(name):
+                    return await function(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def record_llm_call(model: str, stage: str, request_bytes: int, response_bytes: int,
+                    input_tokens: Optional[int] = None, output_tokens: Optional[int] = None):
+    """Count one LLM call and return its (input, output) tokens
+
+    Token counts are estimated from bytes when the provider reports none.
+    """
+    labels = {'model': model, 'stage': stage}
+    input_tokens = input_tokens if input_tokens is not None else round(request_bytes / 4)
+    output_tokens = output_tokens if output_tokens is not None else round(response_bytes / 4)
+    METRICS.inc('kg_llm_requests_total', help="LLM calls", **labels)
+    METRICS.inc('kg_llm_request_bytes_total', request_bytes, help="LLM prompt bytes", **labels)
+    METRICS.inc('kg_llm_response_bytes_total', response_bytes, help="LLM response bytes", **labels)
+    METRICS.inc('kg_llm_input_tokens_total', input_tokens, help="LLM prompt tokens", **labels)
+    METRICS.inc('kg_llm_output_tokens_total', output_tokens, help="LLM completion tokens", **labels)
+    return input_tokens, output_tokens
+
+
+def llm_callback_handler(model: str, stage: str):
+    """LangChain callback handler that records every chat model call it sees with record_llm_call
+
+    For LLM calls made inside chains and agents, where the response is not at hand.
+    The handler also totals the tokens of the calls it saw (input_tokens, output_tokens).
+    """
+    from langchain_core.callbacks import BaseCallbackHandler
+
+    class LLMMetricsHandler(BaseCallbackHandler):
+        # Cheap and thread-safe, so async runs call it on the event loop instead of in a worker thread
+        run_inline = True
+
+        def __init__(self):
+            self.request_bytes: Dict[Any, int] = {}
+            self.input_tokens = 0
+            self.output_tokens = 0
+
+        def on_chat_model_start(self, serialized, messages, *, run_id, **kwargs):
+            self.request_bytes[run_id] = sum(len(str(m.content).encode()) for batch in messages for m in batch)
+
+        def on_llm_end(self, response, *, run_id, **kwargs):
+            text = "".join(generation.text for generations in response.generations for generation in generations)
+            usage = (response.llm_output or {}).get('token_usage') or {}
+            input_tokens, output_tokens = record_llm_call(model, stage, self.request_bytes.pop(run_id, 0),
+                                                          len(text.encode()), usage.get('prompt_tokens'),
+                                                          usage.get('completion_tokens'))
+            self.input_tokens += input_tokens
+            self.output_tokens += output_tokens
+
+    return LLMMetricsHandler()
+
+
+def observe_query(operation: str, seconds: float):
+    """Record the latency of one Neo4j statement"""
+    METRICS.observe('kg_neo4j_query_seconds', seconds, help="Neo4j statement latency", operation=operation)
+
+
+def render_prometheus() -> str:
+    return METRICS.render_prometheus()
+
+
+def write_prometheus(path: str) -> str:
+    """Write the metrics to a file, replacing it atomically"""
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    with os.fdopen(fd, 'w', encoding='utf-8') as f:
+        f.write(render_prometheus())
+    os.replace(tmp_path, path)
+    return path
@@ -0,0 +1,40 @@
+"""Pydantic models for structured clinical extraction output.
+
+Kept apart from kg_drafter so that importing the query builders and pipeline
+helpers does not pay for pydantic; kg_drafter re-exports these lazily.
+"""
+
+from typing import Dict, List, Any, Optional
+from pydantic import BaseModel, Field
+
+# Pydantic models for structured output
+class ClinicalEntity(BaseModel):
+    name: str = Field(description="Name of the clinical entity")
+    type: str = Field(description="Type of entity: symptom, condition, test, treatment, medication, risk_factor")
+    properties: Dict[str, Any] = Field(default_factory=dict, description="Additional properties like severity, duration, location, etc.")
+    icd_code: Optional[str] = Field(default=None, description="ICD-10 code if applicable")
+    confidence: Optional[str] = Field(default=None, description="Confidence level: high, moderate, low")
+
+class ClinicalRelationship(BaseModel):
+    from_entity: str = Field(description="Source entity name")
+    to_entity: str = Field(description="Target entity name")
+    relationship_type: str = Field(description="Type: suggests, indicates_need_for, treated_by, diagnosed_with, etc.")
+    properties: Dict[str, Any] = Field(default_factory=dict, description="Relationship properties")
+    confidence: Optional[str] = Field(default=None, description="Confidence in this relationship")
+
+class PatientCase(BaseModel):
+    patient_demographics: Dict[str, Any] = Field(default_factory=dict, description="Age, gender, relevant history")
+    chief_complaint: str = Field(description="Primary reason for visit")
+    entities: List[ClinicalEntity] = Field(description="All clinical entities found in the report")
+    relationships: List[ClinicalRelationship] = Field(description="Relationships between entities")
+    clinical_reasoning: str = Field(description="Summary of clinical reasoning from the report")
+    recommendations: List[str] = Field(description="Next steps and recommendations")
+
+class IcdCodeUpdate(BaseModel):
+    entity: str = Field(description="Name of an existing entity, exactly as given")
+    icd_code: str = Field(description="ICD-10 code for the entity")
+
+class KnowledgeDelta(BaseModel):
+    added_entities: List[ClinicalEntity] = Field(default_factory=list, description="Entities implied by established medical knowledge that are not in the case")
+    added_relationships: List[ClinicalRelationship] = Field(default_factory=list, description="Clinically established relationships not in the case; endpoints must be existing or added entity names")
+    icd_codes: List[IcdCodeUpdate] = Field(default_factory=list, description="ICD-10 codes for existing entities that have none")
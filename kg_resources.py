@@ -0,0 +1,255 @@
+"""
+Process-wide registry of long-lived clients.
+
+Building a ChatOpenAI client, an Ollama client or a Neo4j driver sets up an
+HTTP/Bolt connection pool (and TLS) that is meant to be reused. The registry
+creates each client once per process and hands the same instance to every
+caller, so processing a case reuses warm connections instead of opening new
+ones. Pool sizes come from the constructor or the environment:
+
+    LLM_MAX_CONNECTIONS    HTTP connections per OpenAI client (library default if unset)
+    NEO4J_MAX_POOL_SIZE    Bolt connections per Neo4j driver (library default if unset)
+    OLLAMA_HOST            Ollama server (library default if unset; also serves local_llm)
+
+Asyncio clients are bound to the event loop that created them, so those are
+kept per loop and released with `aclose()` from that loop. `aclose()` also
+closes the connections the shared LLM clients' async HTTP pools opened on that
+loop; the clients stay usable and reconnect on their next call. Everything else
+is released by `close()`, which also runs at interpreter exit.
+"""
+
+import asyncio
+import atexit
+import functools
+import logging
+import os
+import threading
+import weakref
+from typing import Dict, Any, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_NEO4J_URI = "bolt://localhost:7687"
+DEFAULT_NEO4J_USERNAME = "neo4j"
+DEFAULT_NEO4J_PASSWORD = "password"
+DEFAULT_OLLAMA_HOST = "http://localhost:11434"
+
+
+@functools.lru_cache(maxsize=None)
+def load_environment():
+    """Load .env once, on first use rather than at import"""
+    from dotenv import load_dotenv
+    load_dotenv()
+
+
+def _env_int(name: str) -> Optional[int]:
+    value = os.getenv(name)
+    return int(value) if value else None
+
+
+class ResourceRegistry:
+    """Creates shared LLM, Ollama and Neo4j clients on first use and closes them on shutdown"""
+
+    def __init__(self, llm_max_connections: Optional[int] = None, neo4j_max_pool_size: Optional[int] = None,
+                 ollama_host: Optional[str] = None):
+        self.llm_max_connections = llm_max_connections or _env_int('LLM_MAX_CONNECTIONS')
+        self.neo4j_max_pool_size = neo4j_max_pool_size or _env_int('NEO4J_MAX_POOL_SIZE')
+        self.ollama_host = ollama_host or os.getenv('OLLAMA_HOST')
+
+        # Reentrant: kg_builder() creates its LLM through llm() while holding the lock
+        self._lock = threading.RLock()
+        self._resources: Dict[Tuple, Any] = {}
+        # Clients that need an explicit close (httpx pools, Neo4j drivers), in creation order
+        self._closers: List[Any] = []
+        # Async HTTP transports of the shared LLM clients; their connections belong to the loop that used them
+        self._async_transports: List[Any] = []
+        self._loop_resources: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[Tuple, Any]]" = \
+            weakref.WeakKeyDictionary()
+        self.closed = False
+
+    def _get_or_create(self, key: Tuple, factory):
+        with self._lock:
+            if self.closed:
+                raise RuntimeError("Resource registry has been shut down")
+            if key not in self._resources:
+                self._resources[key] = factory()
+                logger.info(f"Created shared {key[0]} client")
+            return self._resources[key]
+
+    def _get_or_create_for_loop(self, key: Tuple, factory):
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            if self.closed:
+                raise RuntimeError("Resource registry has been shut down")
+            resources = self._loop_resources.setdefault(loop, {})
+            if key not in resources:
+                resources[key] = factory()
+                logger.info(f"Created shared {key[0]} client for the running event loop")
+            return resources[key]
+
+    def _http_limits(self):
+        import httpx
+        return httpx.Limits(max_connections=self.llm_max_connections,
+                            max_keepalive_connections=self.llm_max_connections)
+
+    def llm(self, model: str = "gpt-4", **options):
+        """Shared ChatOpenAI client for a model and option set (e.g. temperature, streaming)"""
+        def create():
+            from langchain_openai import ChatOpenAI
+
+            load_environment()
+            kwargs = dict(options)
+            if self.llm_max_connections:
+                import httpx
+                kwargs['http_client'] = httpx.Client(limits=self._http_limits())
+                # An explicit transport, so aclose() can release its pool without closing the client
+                transport = httpx.AsyncHTTPTransport(limits=self._http_limits())
+                kwargs['http_async_client'] = httpx.AsyncClient(transport=transport)
+                self._closers.append(kwargs['http_client'])
+                self._async_transports.append(transport)
+            return ChatOpenAI(model=model, api_key=os.getenv('OPENAI_API_KEY'), **kwargs)
+
+        return self._get_or_create(('llm', model, tuple(sorted(options.items()))), create)
+
+    def local_llm(self, model: str, **options):
+        """Shared chat client for a model served by the Ollama server, through its OpenAI-compatible API"""
+        def create():
+            from langchain_openai import ChatOpenAI
+
+            host = (self.ollama_host or DEFAULT_OLLAMA_HOST).rstrip("/")
+            if "://" not in host:
+                host = f"http://{host}"
+            # Ollama ignores the key, but the client requires one
+            return ChatOpenAI(model=model, base_url=f"{host}/v1", api_key="ollama", **options)
+
+        return self._get_or_create(('local_llm', model, tuple(sorted(options.items()))), create)
+
+    def kg_builder(self, model: str = "gpt-4", cache=None, refresh_cache: bool = False):
+        """Shared MedicalKGBuilder, so prompt templates and the parser are built once"""
+        def create():
+            from kg_drafter import MedicalKGBuilder
+            return MedicalKGBuilder(model=model, cache=cache, refresh_cache=refresh_cache,
+                                    llm=self.llm(model, temperature=0.1))
+
+        # The cache is keyed by identity; a builder per distinct cache instance
+        return self._get_or_create(('kg_builder', model, cache, refresh_cache), create)
+
+    def ollama_client(self):
+        """Shared blocking Ollama client"""
+        def create():
+            from ollama import Client
+            client = Client(host=self.ollama_host)
+            self._closers.append(client)
+            return client
+
+        return self._get_or_create(('ollama',), create)
+
+    def async_ollama_client(self):
+        """Shared Ollama AsyncClient for the running event loop"""
+        def create():
+            from ollama import AsyncClient
+            return AsyncClient(host=self.ollama_host)
+
+        return self._get_or_create_for_loop(('async_ollama',), create)
+
+    def _neo4j_kwargs(self) -> Dict[str, Any]:
+        return {'max_connection_pool_size': self.neo4j_max_pool_size} if self.neo4j_max_pool_size else {}
+
+    def neo4j_driver(self, uri: str = DEFAULT_NEO4J_URI, username: str = DEFAULT_NEO4J_USERNAME,
+                     password: str = DEFAULT_NEO4J_PASSWORD):
+        """Shared pooled Neo4j driver for a server and user"""
+        def create():
+            from neo4j import GraphDatabase
+            driver = GraphDatabase.driver(uri, auth=(username, password), **self._neo4j_kwargs())
+            self._closers.append(driver)
+            return driver
+
+        return self._get_or_create(('neo4j', uri, username), create)
+
+    def async_neo4j_driver(self, uri: str = DEFAULT_NEO4J_URI, username: str = DEFAULT_NEO4J_USERNAME,
+                           password: str = DEFAULT_NEO4J_PASSWORD):
+        """Shared pooled async Neo4j driver for the running event loop"""
+        def create():
+            from neo4j import AsyncGraphDatabase
+            return AsyncGraphDatabase.driver(uri, auth=(username, password), **self._neo4j_kwargs())
+
+        return self._get_or_create_for_loop(('async_neo4j', uri, username), create)
+
+    @staticmethod
+    def _close(resource):
+        # Ollama clients keep their httpx pool in `_client` and have no close() of their own
+        close = getattr(resource, 'close', None) or getattr(getattr(resource, '_client', None), 'close', None)
+        if close is None:
+            return
+        try:
+            close()
+        except Exception as e:
+            logger.warning(f"Failed to close {type(resource).__name__}: {e}")
+
+    async def aclose(self):
+        """Close the async clients created for the running event loop and the LLM connections it opened"""
+        with self._lock:
+            resources = self._loop_resources.pop(asyncio.get_running_loop(), {})
+            transports = list(self._async_transports)
+
+        for transport in transports:
+            try:
+                await transport.aclose()
+            except Exception as e:
+                logger.warning(f"Failed to close {type(transport).__name__}: {e}")
+
+        for resource in resources.values():
+            close = getattr(resource, 'close', None) or getattr(getattr(resource, '_client', None), 'aclose', None)
+            if close is None:
+                continue
+            try:
+                await close()
+            except Exception as e:
+                logger.warning(f"Failed to close {type(resource).__name__}: {e}")
+
+    def close(self):
+        """Close every blocking client; the registry cannot be used afterwards"""
+        with self._lock:
+            if self.closed:
+                return
+            self.closed = True
+            closers, self._closers = self._closers, []
+            self._resources.clear()
+            # Async clients can only be closed from their own loop (see aclose)
+            self._loop_resources.clear()
+
+        for resource in reversed(closers):
+            self._close(resource)
+        logger.info("Shared clients closed")
+
+
+_registry: Optional[ResourceRegistry] = None
+_registry_lock = threading.Lock()
+
+
+def get_registry() -> ResourceRegistry:
+    """The process-wide registry, created on first use"""
+    global _registry
+    with _registry_lock:
+        if _registry is None or _registry.closed:
+            _registry = ResourceRegistry()
+        return _registry
+
+
+def set_registry(registry: ResourceRegistry) -> Optional[ResourceRegistry]:
+    """Install a registry (e.g. one serving stand-in clients) and return the previous one"""
+    global _registry
+    with _registry_lock:
+        previous, _registry = _registry, registry
+        return previous
+
+
+def shutdown_registry():
+    """Close the process-wide registry's clients (also runs at interpreter exit)"""
+    with _registry_lock:
+        registry = _registry
+    if registry is not None:
+        registry.close()
+
+
+atexit.register(shutdown_registry)
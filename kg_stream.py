@@ -0,0 +1,199 @@
+"""
+Incremental parsing and validation of streamed LLM extraction output.
+
+`analyze_medical_report` waits for the whole GPT-4 response before parsing it,
+so an off-schema response is only discovered after the full generation has
+been paid for. `StreamingCaseParser` is fed the response chunk by chunk as it
+streams in. It tracks the JSON structure of the top-level case object, and as
+soon as an element of "entities" or "relationships" is closed it is parsed and
+validated against ClinicalEntity / ClinicalRelationship and handed to a
+callback. The parser raises ExtractionAborted as soon as the output cannot
+become a valid case:
+
+    - too much prose before the JSON object starts
+    - mismatched brackets, or "entities"/"relationships" that are not arrays
+    - more invalid elements than max_invalid (malformed JSON or failed validation)
+    - the stream ends before the top-level object is closed
+
+The scanner only looks at structural characters, so it costs a regex search
+per string and bracket rather than a full parse per chunk.
+"""
+
+import json
+import logging
+import re
+from typing import Dict, Any, Callable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Prose or a ```json fence allowed before the opening brace
+DEFAULT_MAX_PREAMBLE = 256
+
+# Arrays whose elements are validated as they complete, with their pydantic model
+STREAMED_ARRAYS = {"entities": "ClinicalEntity", "relationships": "ClinicalRelationship"}
+
+_STRUCTURAL = re.compile(r'[{}\[\]":]')
+_STRING_END = re.compile(r'["\\]')
+_CLOSING = {"}": "{", "]": "["}
+
+
+class ExtractionAborted(ValueError):
+    """The streamed response cannot be parsed into a valid case"""
+
+
+def _validator(model_name: str) -> Callable[[Dict[str, Any]], Any]:
+    import kg_models
+    model = getattr(kg_models, model_name)
+    # pydantic v2, falling back to v1
+    return getattr(model, "model_validate", None) or model.parse_obj
+
+
+class StreamingCaseParser:
+    """Feed streamed text with feed(); call close() once the stream has ended"""
+
+    def __init__(self, on_entity: Optional[Callable[[Dict[str, Any]], None]] = None,
+                 on_relationship: Optional[Callable[[Dict[str, Any]], None]] = None,
+                 max_invalid: int = 0, max_preamble: int = DEFAULT_MAX_PREAMBLE):
+        self.callbacks = {"entities": on_entity, "relationships": on_relationship}
+        self.max_invalid = max_invalid
+        self.max_preamble = max_preamble
+        self.validators = {key: _validator(model_name) for key, model_name in STREAMED_ARRAYS.items()}
+
+        self.text = ""
+        self.items: Dict[str, List[Dict[str, Any]]] = {key: [] for key in STREAMED_ARRAYS}
+        self.invalid: List[Dict[str, Any]] = []
+        self.complete = False
+        self._seen = {key: 0 for key in STREAMED_ARRAYS}
+
+        self._pos = 0
+        self._start: Optional[int] = None  # offset of the top-level "{"
+        self._stack: List[str] = []
+        self._in_string = False
+        self._string_start = 0
+        self._last_key: Optional[str] = None
+        self._array_key: Optional[str] = None  # streamed array the scanner is inside
+        self._expect_array: Optional[str] = None
+        self._element_start: Optional[int] = None
+
+    @property
+    def entities(self) -> List[Dict[str, Any]]:
+        return self.items["entities"]
+
+    @property
+    def relationships(self) -> List[Dict[str, Any]]:
+        return self.items["relationships"]
+
+    def feed(self, chunk: str):
+        """Scan a chunk of streamed text, emitting every element it completes"""
+        if not chunk or self.complete:
+            self.text += chunk or ""
+            return
+        self.text += chunk
+
+        if self._start is None:
+            start = self.text.find("{", self._pos)
+            if start < 0:
+                if len(self.text) > self.max_preamble:
+                    raise ExtractionAborted(f"No JSON object in the first {len(self.text)} characters")
+                self._pos = len(self.text)
+                return
+            if start > self.max_preamble:
+                raise ExtractionAborted(f"JSON object starts after {start} characters of text")
+            self._start = start
+            self._pos = start
+
+        self._scan()
+
+    def _scan(self):
+        text = self.text
+        pos = self._pos
+        while not self.complete:
+            if self._in_string:
+                match = _STRING_END.search(text, pos)
+                if match is None:
+                    pos = len(text)
+                    break
+                if match.group() == "\\":
+                    if match.end() >= len(text):
+                        # Escape split across chunks; resume at the backslash
+                        pos = match.start()
+                        break
+                    pos = match.end() + 1
+                    continue
+                self._in_string = False
+                pos = match.end()
+                if len(self._stack) == 1:
+                    self._last_key = text[self._string_start:pos]
+                continue
+
+            match = _STRUCTURAL.search(text, pos)
+            if match is None:
+                pos = len(text)
+                break
+            char = match.group()
+            pos = match.end()
+
+            if char == '"':
+                if self._expect_array is not None and len(self._stack) == 1:
+                    raise ExtractionAborted(f'"{self._expect_array}" is not a list')
+                self._in_string = True
+                self._string_start = match.start()
+            elif char == ":":
+                if len(self._stack) == 1 and self._last_key is not None:
+                    key = json.loads(self._last_key)
+                    self._expect_array = key if key in STREAMED_ARRAYS else None
+            elif char in "{[":
+                self._open(char, match.start())
+            else:
+                self._close(char, match.start())
+        self._pos = pos
+
+    def _open(self, char: str, offset: int):
+        depth = len(self._stack)
+        if depth == 1 and self._expect_array is not None:
+            if char != "[":
+                raise ExtractionAborted(f'"{self._expect_array}" is not a list')
+            self._array_key = self._expect_array
+            self._expect_array = None
+        elif depth == 2 and self._array_key is not None:
+            self._element_start = offset
+        self._stack.append(char)
+
+    def _close(self, char: str, offset: int):
+        if not self._stack or self._stack[-1] != _CLOSING[char]:
+            raise ExtractionAborted(f"Unbalanced {char!r} at offset {offset}")
+        self._stack.pop()
+        depth = len(self._stack)
+        if depth == 2 and self._element_start is not None:
+            self._element(self.text[self._element_start:offset + 1])
+            self._element_start = None
+        elif depth == 1:
+            self._array_key = None
+        elif depth == 0:
+            self.complete = True
+            self._expect_array = None
+
+    def _element(self, raw: str):
+        key = self._array_key
+        index = self._seen[key]
+        self._seen[key] += 1
+        try:
+            element = json.loads(raw)
+            self.validators[key](element)
+        except Exception as e:
+            self.invalid.append({"field": key, "index": index, "error": str(e)})
+            logger.warning(f"Invalid streamed {key} element: {e}")
+            if len(self.invalid) > self.max_invalid:
+                raise ExtractionAborted(f"Invalid {key} element: {e}") from e
+            return
+
+        self.items[key].append(element)
+        callback = self.callbacks[key]
+        if callback is not None:
+            callback(element)
+
+    def close(self) -> str:
+        """Check the stream produced a complete object; returns the full response text"""
+        if not self.complete:
+            raise ExtractionAborted("Stream ended before the JSON object was complete")
+        return self.text
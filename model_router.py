@@ -0,0 +1,318 @@
+"""
+Tiered model routing for intake turns and KG extraction.
+
+Most intake turns are routine (a follow-up question, an acknowledgement) and
+many reports are short, and neither needs GPT-4. `ModelRouter` sends those to
+a local model served by Ollama (MedGemma by default) and keeps the large model
+for the rest:
+
+    intake turns   large for the chief complaint, red-flag symptoms, long
+                   patient replies and the closing turn; local otherwise
+    extraction     large for stages outside local_stages (enhancement by
+                   default), long reports and red-flag symptoms; local otherwise
+
+A local answer is checked before it is used: an empty or hedging reply, an
+extraction that does not parse or fails the ClinicalEntity /
+ClinicalRelationship schema, or one whose entities are mostly low-confidence
+is escalated, and the call is repeated on the large model. A local call that
+raises is escalated the same way.
+
+Every call is recorded per route in kg_metrics (kg_route_requests_total,
+kg_route_seconds, kg_route_tokens_total, kg_route_cost_usd_total by route and
+stage; kg_route_escalations_total by stage and reason), and
+ModelRouter.stats() returns a summary of the same for tuning the rules.
+
+Routing is off unless KG_ROUTING=1. The rules are the ModelRouter arguments;
+KG_ROUTER_RULES names a JSON file that overrides any of them, e.g.
+
+    {"max_routine_words": 40, "local_stages": ["analysis"],
+     "escalation_terms": ["chest pain", "syncope"],
+     "costs": {"gpt-4": [0.03, 0.06]}}
+
+KG_ROUTER_LOCAL_MODEL picks the local model.
+"""
+
+import functools
+import json
+import logging
+import os
+import re
+import threading
+import time
+from dataclasses import dataclass
+from typing import Dict, Any, Awaitable, Callable, Optional, Tuple
+
+from kg_metrics import METRICS
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_LOCAL_MODEL = "alibayram/medgemma:latest"
+DEFAULT_LARGE_MODEL = "gpt-4"
+
+# USD per 1K (input, output) tokens; models not listed (local ones) cost nothing
+DEFAULT_COSTS = {"gpt-4": (0.03, 0.06)}
+
+# Patient phrasing that should always get the large model. Pregnancy is not on the list: every intake
+# patient is in the first trimester (see agent.system_prompt), so it would send every report to the large model
+DEFAULT_ESCALATION_TERMS = (
+    "chest pain", "shortness of breath", "difficulty breathing", "can't breathe", "fainted", "passed out",
+    "unconscious", "seizure", "suicid", "overdose", "vomiting blood", "coughing up blood", "heavy bleeding",
+    "stroke", "slurred", "numbness", "worst headache", "allergic reaction", "anaphyla"
+)
+
+# A red-flag term preceded by one of these in the same clause ("no heavy bleeding") is not a red flag
+_NEGATED = re.compile(r"\b(?:no|not|denies|denied|without)\b(?:(?!\bbut\b)[^.;:!?\n]){0,30}$")
+
+# Replies that signal the local model is out of its depth
+DEFAULT_HEDGE_PHRASES = (
+    "i'm not sure", "i am not sure", "i don't know", "i cannot", "i can't help", "unable to", "as an ai"
+)
+
+# A patient answering the assistant's "anything else?" with one of these (as whole words) ends the intake
+DEFAULT_CLOSING_QUESTION = "anything else"
+DEFAULT_CLOSING_PHRASES = ("no", "that's all")
+
+Decision = Tuple["Route", str]
+
+
+@dataclass(frozen=True)
+class Route:
+    name: str  # "local" or "large"
+    model: str
+    local: bool = False
+
+    def llm(self, **options):
+        """The route's shared chat client (see kg_resources)"""
+        from kg_resources import get_registry
+        registry = get_registry()
+        return registry.local_llm(self.model, **options) if self.local else registry.llm(self.model, **options)
+
+
+class ModelRouter:
+    """Picks the local or large model per call and escalates local answers that fail their check"""
+
+    def __init__(self, local_model: str = DEFAULT_LOCAL_MODEL, large_model: str = DEFAULT_LARGE_MODEL,
+                 max_routine_words: int = 30, max_local_report_chars: int = 8000,
+                 local_stages=("analysis", "reconciliation", "annotation"), escalation_terms=DEFAULT_ESCALATION_TERMS,
+                 hedge_phrases=DEFAULT_HEDGE_PHRASES, min_reply_chars: int = 10,
+                 max_low_confidence_share: float = 0.5, closing_question: str = DEFAULT_CLOSING_QUESTION,
+                 closing_phrases=DEFAULT_CLOSING_PHRASES, costs: Optional[Dict[str, Any]] = None):
+        self.local = Route("local", local_model, local=True)
+        self.large = Route("large", large_model)
+        self.max_routine_words = max_routine_words
+        # A MedGemma thesis report is ~5K characters, ~7K as a reconciliation input with the draft name lists
+        self.max_local_report_chars = max_local_report_chars
+        self.local_stages = tuple(local_stages)
+        self.escalation_terms = tuple(term.lower() for term in escalation_terms)
+        self.hedge_phrases = tuple(phrase.lower() for phrase in hedge_phrases)
+        self.min_reply_chars = min_reply_chars
+        self.max_low_confidence_share = max_low_confidence_share
+        self.closing_question = closing_question.lower()
+        self._closing_reply = re.compile(
+            r"\b(?:" + "|".join(re.escape(phrase.lower()) for phrase in closing_phrases) + r")\b"
+        )
+        self.costs = {**DEFAULT_COSTS, **{model: tuple(cost) for model, cost in (costs or {}).items()}}
+
+        self._lock = threading.Lock()
+        self._routes: Dict[str, Dict[str, Any]] = {}
+        self._escalations: Dict[str, int] = {}
+
+    @classmethod
+    def from_file(cls, path: str, **overrides) -> "ModelRouter":
+        """Router with the rules from a JSON file (keys are the constructor arguments)"""
+        with open(path, 'r', encoding='utf-8') as f:
+            rules = json.load(f)
+        return cls(**{**rules, **overrides})
+
+    def _flagged(self, text: str) -> bool:
+        text = text.lower()
+        for term in self.escalation_terms:
+            start = text.find(term)
+            while start != -1:
+                if not _NEGATED.search(text[max(0, start - 40):start]):
+                    return True
+                start = text.find(term, start + 1)
+        return False
+
+    def _closing(self, messages, text: str) -> bool:
+        # The assistant just asked "anything else?" and the patient said no
+        asked = next((m["content"] for m in reversed(messages) if m["role"] == "assistant"), "")
+        return self.closing_question in asked.lower() and self._closing_reply.search(text.lower()) is not None
+
+    def route_turn(self, state: Dict[str, Any]) -> Decision:
+        """Route for the assistant's reply to the latest patient message"""
+        text = state.get("last_user_input", "")
+        messages = state.get("messages", [])
+        if not any(m["role"] == "assistant" for m in messages):
+            return self.large, "chief_complaint"
+        if self._closing(messages, text):
+            return self.large, "closing"
+        if self._flagged(text):
+            return self.large, "red_flag"
+        if len(text.split()) > self.max_routine_words:
+            return self.large, "long_turn"
+        return self.local, "routine"
+
+    def check_reply(self, reply: Optional[str]) -> Optional[str]:
+        """Escalation reason for a local intake reply, or None to accept it"""
+        text = (reply or "").strip().lower()
+        if len(text) < self.min_reply_chars:
+            return "empty_reply"
+        if any(phrase in text for phrase in self.hedge_phrases):
+            return "hedging"
+        return None
+
+    def route_extraction(self, stage: str, text: str) -> Decision:
+        """Route for an extraction stage (analysis, reconciliation, enhancement) over the given input"""
+        if stage not in self.local_stages:
+            return self.large, "stage"
+        if len(text) > self.max_local_report_chars:
+            return self.large, "long_report"
+        if self._flagged(text):
+            return self.large, "red_flag"
+        return self.local, "simple"
+
+    def check_extraction(self, stage: str, data: Any) -> Optional[str]:
+        """Escalation reason for a local extraction result (None when it did not parse), or None to accept it"""
+        from pydantic import ValidationError
+        from kg_models import ClinicalEntity, ClinicalRelationship
+
+        if data is None:
+            return "parse_error"
+        if not isinstance(data, dict):
+            return "schema_error"
+
+        prefix = "added_" if stage == "enhancement" else ""
+        entities = data.get(f"{prefix}entities") or []
+        relationships = data.get(f"{prefix}relationships") or []
+        try:
+            for model, items in ((ClinicalEntity, entities), (ClinicalRelationship, relationships)):
+                validate = getattr(model, "model_validate", None) or model.parse_obj
+                for item in items:
+                    validate(item)
+        except (ValidationError, TypeError):
+            return "schema_error"
+
+        if stage == "analysis" and not entities:
+            return "no_entities"
+        low = sum(1 for e in entities if str(e.get("confidence") or "").lower() == "low")
+        if entities and low / len(entities) > self.max_low_confidence_share:
+            return "low_confidence"
+        return None
+
+    def cost(self, model: str, input_tokens: int, output_tokens: int) -> float:
+        input_cost, output_cost = self.costs.get(model, (0.0, 0.0))
+        return (input_tokens * input_cost + output_tokens * output_cost) / 1000
+
+    def record(self, route: Route, stage: str, reason: str, seconds: float, input_tokens: int = 0,
+               output_tokens: int = 0, failed: bool = False):
+        """Count one call on a route: latency, tokens and cost"""
+        cost = self.cost(route.model, input_tokens, output_tokens)
+        labels = {'route': route.name, 'stage': stage}
+        METRICS.inc('kg_route_requests_total', help="Routed LLM calls", reason=reason, **labels)
+        METRICS.observe('kg_route_seconds', seconds, help="Routed LLM call latency", **labels)
+        METRICS.inc('kg_route_tokens_total', input_tokens + output_tokens, help="Routed LLM tokens", **labels)
+        METRICS.inc('kg_route_cost_usd_total', cost, help="Estimated routed LLM cost in USD", **labels)
+
+        with self._lock:
+            totals = self._routes.setdefault(route.name, {
+                'model': route.model, 'calls': 0, 'failed': 0, 'seconds': 0.0,
+                'input_tokens': 0, 'output_tokens': 0, 'cost_usd': 0.0, 'reasons': {}
+            })
+            totals['calls'] += 1
+            totals['failed'] += int(failed)
+            totals['seconds'] += seconds
+            totals['input_tokens'] += input_tokens
+            totals['output_tokens'] += output_tokens
+            totals['cost_usd'] += cost
+            totals['reasons'][reason] = totals['reasons'].get(reason, 0) + 1
+
+    def record_escalation(self, stage: str, reason: str):
+        METRICS.inc('kg_route_escalations_total', help="Local answers repeated on the large model",
+                    stage=stage, reason=reason)
+        with self._lock:
+            key = f"{stage}:{reason}"
+            self._escalations[key] = self._escalations.get(key, 0) + 1
+        logger.info(f"Escalating {stage} call to {self.large.model}: {reason}")
+
+    def stats(self) -> Dict[str, Any]:
+        """Calls, mean latency, tokens and cost per route, and escalations by stage:reason"""
+        with self._lock:
+            routes = {
+                name: dict(
+                    {key: value for key, value in totals.items() if key != 'seconds'},
+                    mean_seconds=round(totals['seconds'] / totals['calls'], 4),
+                    cost_usd=round(totals['cost_usd'], 6),
+                    reasons=dict(totals['reasons'])
+                )
+                for name, totals in self._routes.items()
+            }
+            return {'routes': routes, 'escalations': dict(self._escalations)}
+
+    def run(self, stage: str, decision: Decision, call: Callable[[Route], Tuple[Any, int, int]],
+            check: Optional[Callable[[Any], Optional[str]]] = None) -> Any:
+        """Run call(route) -> (result, input_tokens, output_tokens) on the decided route
+
+        A local result that check() rejects, or a local call that raises, is
+        recorded as an escalation and the call is repeated on the large route.
+        """
+        route, reason = decision
+        start = time.perf_counter()
+        try:
+            result, input_tokens, output_tokens = call(route)
+        except Exception as e:
+            if not route.local:
+                raise
+            logger.warning(f"Local {stage} call failed: {e}")
+            self.record(route, stage, reason, time.perf_counter() - start, failed=True)
+            escalation = "local_error"
+        else:
+            self.record(route, stage, reason, time.perf_counter() - start, input_tokens, output_tokens)
+            escalation = check(result) if check is not None and route.local else None
+            if escalation is None:
+                return result
+
+        self.record_escalation(stage, escalation)
+        start = time.perf_counter()
+        result, input_tokens, output_tokens = call(self.large)
+        self.record(self.large, stage, f"escalated_{escalation}", time.perf_counter() - start,
+                    input_tokens, output_tokens)
+        return result
+
+    async def arun(self, stage: str, decision: Decision, call: Callable[[Route], Awaitable[Tuple[Any, int, int]]],
+                   check: Optional[Callable[[Any], Optional[str]]] = None) -> Any:
+        """Async version of run"""
+        route, reason = decision
+        start = time.perf_counter()
+        try:
+            result, input_tokens, output_tokens = await call(route)
+        except Exception as e:
+            if not route.local:
+                raise
+            logger.warning(f"Local {stage} call failed: {e}")
+            self.record(route, stage, reason, time.perf_counter() - start, failed=True)
+            escalation = "local_error"
+        else:
+            self.record(route, stage, reason, time.perf_counter() - start, input_tokens, output_tokens)
+            escalation = check(result) if check is not None and route.local else None
+            if escalation is None:
+                return result
+
+        self.record_escalation(stage, escalation)
+        start = time.perf_counter()
+        result, input_tokens, output_tokens = await call(self.large)
+        self.record(self.large, stage, f"escalated_{escalation}", time.perf_counter() - start,
+                    input_tokens, output_tokens)
+        return result
+
+
+@functools.lru_cache(maxsize=None)
+def default_model_router() -> Optional[ModelRouter]:
+    """Process-wide router from KG_ROUTING=1, KG_ROUTER_RULES and KG_ROUTER_LOCAL_MODEL, or None when disabled"""
+    if os.getenv('KG_ROUTING', '0') != '1':
+        return None
+    overrides = {'local_model': os.getenv('KG_ROUTER_LOCAL_MODEL')} if os.getenv('KG_ROUTER_LOCAL_MODEL') else {}
+    rules_path = os.getenv('KG_ROUTER_RULES')
+    router = ModelRouter.from_file(rules_path, **overrides) if rules_path else ModelRouter(**overrides)
+    logger.info(f"Routing between {router.local.model} (local) and {router.large.model}")
+    return router
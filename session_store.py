@@ -0,0 +1,242 @@
+"""
+Durable checkpoints of intake sessions.
+
+A checkpoint is written after every step of the intake graph. It holds the
+session's AgentState, the node that just completed and the node that runs next,
+so a session can be dropped from memory at any time and picked up again
+from the last completed node, without repeating any LLM call that already succeeded.
+
+Only the JSON-safe part of the state is stored: chat_history holds LangChain
+message objects and is rebuilt from messages when the state is restored
+(see agent.restore_state).
+
+    SQLiteSessionStore   one row per session in a local SQLite database (WAL mode)
+    FileSessionStore     one JSON file per session, replaced atomically
+
+open_session_store(location) picks the store from a path: *.db / *.sqlite /
+*.sqlite3 is a SQLite database and anything else a directory of JSON files.
+default_session_store() opens INTAKE_SESSION_STORE (default: intake_sessions.db);
+set it to "none" to keep sessions in memory only.
+
+Checkpoints of completed sessions (next_node None) hold the full transcript and
+knowledge graph and are not needed to resume anything, so they are pruned after
+INTAKE_COMPLETED_RETENTION seconds (default 0: as soon as the diagnosis is
+generated; a negative value keeps them).
+"""
+
+import json
+import logging
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from abc import ABC, abstractmethod
+from dataclasses import dataclass, field
+from typing import Dict, Any, List, Optional
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SESSION_STORE = "intake_sessions.db"
+DEFAULT_COMPLETED_RETENTION = 0.0
+
+_SQLITE_SUFFIXES = (".db", ".sqlite", ".sqlite3")
+
+# State keys that are derived from others and not JSON-safe
+_TRANSIENT_KEYS = ("chat_history",)
+
+
+@dataclass
+class SessionCheckpoint:
+    session_id: str
+    state: Dict[str, Any]
+    node: Optional[str] = None  # Last completed node (None for a new session)
+    next_node: Optional[str] = None  # Node to run next; None once the intake is complete
+    step: int = 0
+    updated_at: float = field(default_factory=time.time)
+
+    @classmethod
+    def from_state(cls, state: Dict[str, Any], node: Optional[str], next_node: Optional[str],
+                   step: int) -> "SessionCheckpoint":
+        stored = {key: value for key, value in state.items() if key not in _TRANSIENT_KEYS}
+        # Round-trip so later in-place changes to the live state cannot leak into the checkpoint
+        return cls(state["session_id"], json.loads(json.dumps(stored, default=str)), node, next_node, step)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'session_id': self.session_id,
+            'node': self.node,
+            'next_node': self.next_node,
+            'step': self.step,
+            'updated_at': self.updated_at,
+            'state': self.state
+        }
+
+
+class SessionStore(ABC):
+    """Interface for checkpoint stores"""
+
+    @abstractmethod
+    def save(self, checkpoint: SessionCheckpoint):
+        """Write a session's checkpoint, replacing the previous one"""
+
+    @abstractmethod
+    def load(self, session_id: str) -> Optional[SessionCheckpoint]:
+        """The session's checkpoint, or None"""
+
+    @abstractmethod
+    def delete(self, session_id: str):
+        """Remove a session's checkpoint (no error if there is none)"""
+
+    @abstractmethod
+    def session_ids(self) -> List[str]:
+        """Stored session ids, least recently updated first"""
+
+    @abstractmethod
+    def prune_completed(self, older_than: float = 0.0) -> int:
+        """Delete checkpoints of completed sessions last updated more than older_than seconds ago"""
+
+    def close(self):
+        pass
+
+
+class SQLiteSessionStore(SessionStore):
+    """Checkpoints in a SQLite database; safe to share between threads"""
+
+    def __init__(self, path: str = DEFAULT_SESSION_STORE):
+        self.path = path
+        self._lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        # WAL with synchronous=NORMAL: a checkpoint write is a small append, without an fsync per commit
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute("""
+            CREATE TABLE IF NOT EXISTS sessions (
+                session_id TEXT PRIMARY KEY,
+                node TEXT,
+                next_node TEXT,
+                step INTEGER NOT NULL,
+                updated_at REAL NOT NULL,
+                state TEXT NOT NULL
+            )
+        """)
+        self.db.commit()
+
+    def save(self, checkpoint: SessionCheckpoint):
+        with self._lock:
+            self.db.execute(
+                "INSERT INTO sessions (session_id, node, next_node, step, updated_at, state) VALUES (?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT(session_id) DO UPDATE SET node = excluded.node, next_node = excluded.next_node, "
+                "step = excluded.step, updated_at = excluded.updated_at, state = excluded.state",
+                (checkpoint.session_id, checkpoint.node, checkpoint.next_node, checkpoint.step,
+                 checkpoint.updated_at, json.dumps(checkpoint.state, ensure_ascii=False))
+            )
+            self.db.commit()
+
+    def load(self, session_id: str) -> Optional[SessionCheckpoint]:
+        with self._lock:
+            row = self.db.execute(
+                "SELECT node, next_node, step, updated_at, state FROM sessions WHERE session_id = ?", (session_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        node, next_node, step, updated_at, state = row
+        return SessionCheckpoint(session_id, json.loads(state), node, next_node, step, updated_at)
+
+    def delete(self, session_id: str):
+        with self._lock:
+            self.db.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
+            self.db.commit()
+
+    def session_ids(self) -> List[str]:
+        with self._lock:
+            return [row[0] for row in self.db.execute("SELECT session_id FROM sessions ORDER BY updated_at")]
+
+    def prune_completed(self, older_than: float = 0.0) -> int:
+        with self._lock:
+            deleted = self.db.execute("DELETE FROM sessions WHERE next_node IS NULL AND updated_at <= ?",
+                                      (time.time() - older_than,)).rowcount
+            self.db.commit()
+        return deleted
+
+    def close(self):
+        with self._lock:
+            self.db.close()
+
+
+class FileSessionStore(SessionStore):
+    """Checkpoints as <directory>/<session_id>.json"""
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, session_id: str) -> str:
+        if os.path.basename(session_id) != session_id or session_id.startswith("."):
+            raise ValueError(f"Invalid session id {session_id!r}")
+        return os.path.join(self.directory, f"{session_id}.json")
+
+    def save(self, checkpoint: SessionCheckpoint):
+        path = self._path(checkpoint.session_id)
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump(checkpoint.to_dict(), f, ensure_ascii=False)
+            os.replace(tmp_path, path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def load(self, session_id: str) -> Optional[SessionCheckpoint]:
+        try:
+            with open(self._path(session_id), 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return None
+        return SessionCheckpoint(**data)
+
+    def delete(self, session_id: str):
+        try:
+            os.remove(self._path(session_id))
+        except FileNotFoundError:
+            pass
+
+    def session_ids(self) -> List[str]:
+        names = [name for name in os.listdir(self.directory) if name.endswith(".json")]
+        names.sort(key=lambda name: os.path.getmtime(os.path.join(self.directory, name)))
+        return [name[:-len(".json")] for name in names]
+
+    def prune_completed(self, older_than: float = 0.0) -> int:
+        cutoff = time.time() - older_than
+        deleted = 0
+        for session_id in self.session_ids():
+            # Oldest first: stop at the first file written after the cutoff
+            if os.path.getmtime(self._path(session_id)) > cutoff:
+                break
+            checkpoint = self.load(session_id)
+            if checkpoint is not None and checkpoint.next_node is None and checkpoint.updated_at <= cutoff:
+                self.delete(session_id)
+                deleted += 1
+        return deleted
+
+
+def open_session_store(location: str) -> SessionStore:
+    """SQLite store for a *.db / *.sqlite / *.sqlite3 path, otherwise a directory of JSON files"""
+    if location.endswith(_SQLITE_SUFFIXES):
+        return SQLiteSessionStore(location)
+    return FileSessionStore(location)
+
+
+def completed_retention() -> float:
+    """Seconds to keep completed sessions' checkpoints, from INTAKE_COMPLETED_RETENTION (negative: keep)"""
+    return float(os.getenv("INTAKE_COMPLETED_RETENTION", DEFAULT_COMPLETED_RETENTION))
+
+
+def default_session_store() -> Optional[SessionStore]:
+    """Store from INTAKE_SESSION_STORE (default: intake_sessions.db), or None when it is set to none"""
+    location = os.getenv("INTAKE_SESSION_STORE", DEFAULT_SESSION_STORE)
+    if location.lower() in ("", "none", "memory"):
+        return None
+    logger.info(f"Checkpointing intake sessions to {location}")
+    return open_session_store(location)